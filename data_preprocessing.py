@@ -1,12 +1,20 @@
+import os
+import sys
 import pandas as pd
 import numpy as np
 
+# 加上 --excel 參數時，另外輸出 xlsx 供人工檢查
+WRITE_EXCEL = '--excel' in sys.argv
+
 print("=" * 80)
 print("資料前處理分析")
 print("=" * 80)
 
-# 讀取合併後的資料
-df = pd.read_excel('FCN_merged_data.xlsx')
+# 讀取合併後的資料 (優先使用 merge_data.py 輸出的 Parquet)
+if os.path.exists('FCN_merged_data.parquet'):
+    df = pd.read_parquet('FCN_merged_data.parquet')
+else:
+    df = pd.read_excel('FCN_merged_data.xlsx')
 print(f"\n原始資料形狀: {df.shape}")
 
 # ============================================================================
@@ -72,10 +80,8 @@ if existing_cols_to_drop:
 
 # 2.2 處理Coupon欄位：將'-'標記為無效，並轉換為數值
 print("\n【處理目標變數 Coupon】")
-df_clean['Coupon_Valid'] = (df_clean['Coupon p.a. (%)'] != '-')
-df_clean['Coupon'] = df_clean['Coupon p.a. (%)'].apply(
-    lambda x: float(x) if x != '-' else np.nan
-)
+df_clean['Coupon_Valid'] = df_clean['Coupon p.a. (%)'].ne('-')
+df_clean['Coupon'] = pd.to_numeric(df_clean['Coupon p.a. (%)'].replace('-', np.nan), errors='coerce')
 print(f"有效Coupon數量: {df_clean['Coupon_Valid'].sum()}")
 print(f"無效Coupon數量: {(~df_clean['Coupon_Valid']).sum()}")
 
@@ -122,9 +128,7 @@ for col in categorical_cols:
 # 3.2 標的數量特徵
 print("\n【建立標的數量特徵】")
 df_clean['Num_Underlyings'] = (
-    df_clean['BBG Code 1'].notna().astype(int) +
-    df_clean['BBG Code 2'].notna().astype(int) +
-    df_clean['BBG Code 3'].notna().astype(int)
+    df_clean[['BBG Code 1', 'BBG Code 2', 'BBG Code 3']].notna().to_numpy().sum(axis=1, dtype=np.int8)
 )
 print(df_clean['Num_Underlyings'].value_counts().sort_index())
 
@@ -139,14 +143,21 @@ print("=" * 80)
 df_valid = df_clean[df_clean['Coupon_Valid']].copy()
 print(f"\n有效資料形狀: {df_valid.shape}")
 
+def save_output(data, stem):
+    """儲存為 Parquet (原始 Coupon 欄位混有 '-' 與數字，Parquet 需統一存為字串)"""
+    output_file = f'{stem}.parquet'
+    data.astype({'Coupon p.a. (%)': str}).to_parquet(output_file, engine='pyarrow', compression='zstd', index=False)
+    if WRITE_EXCEL:
+        data.to_excel(f'{stem}.xlsx', index=False)
+    return output_file
+
+
 # 儲存完整清理資料（包含無效Coupon）
-output_file_all = 'FCN_preprocessed_all.xlsx'
-df_clean.to_excel(output_file_all, index=False)
+output_file_all = save_output(df_clean, 'FCN_preprocessed_all')
 print(f"完整資料已儲存至: {output_file_all}")
 
 # 儲存有效資料（僅有效Coupon，用於訓練）
-output_file_valid = 'FCN_preprocessed_valid.xlsx'
-df_valid.to_excel(output_file_valid, index=False)
+output_file_valid = save_output(df_valid, 'FCN_preprocessed_valid')
 print(f"有效資料已儲存至: {output_file_valid}")
 
 # ============================================================================
@@ -0,0 +1,42 @@
+"""
+xlsx 讀取快取
+=============
+pd.read_excel (openpyxl) 解析 xlsx 很慢，第一次讀取後把解析結果存在同目錄的 `<檔名>.xlsx.pkl`，
+之後 xlsx 沒有變動 (修改時間與大小相同) 就直接載入快取
+
+原始工作表有混合型別的欄位 (例如 IV 檔的中文標題列、Coupon 欄位的 '-')，
+Parquet 無法原樣保存，所以快取使用 pickle
+"""
+
+import os
+import pickle
+
+import pandas as pd
+
+
+def read_excel_cached(xlsx_file):
+    """與 pd.read_excel(xlsx_file) 相同，xlsx 沒有變動時直接讀取快取"""
+    cache_file = f'{xlsx_file}.pkl'
+    stat = os.stat(xlsx_file)
+    source_stamp = (stat.st_mtime_ns, stat.st_size)
+
+    try:
+        with open(cache_file, 'rb') as f:
+            cached_stamp, df = pickle.load(f)
+        if cached_stamp == source_stamp:
+            return df
+    except Exception:
+        pass  # 沒有快取或快取無法讀取時重新解析
+
+    df = pd.read_excel(xlsx_file)
+
+    # 先寫入暫存檔再改名，避免留下寫到一半的快取
+    tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_file, 'wb') as f:
+            pickle.dump((source_stamp, df), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print(f"⚠️ 警告: 無法寫入快取 {cache_file}: {e}")
+
+    return df
@@ -4,17 +4,48 @@ FCN 報價預測 API
 基於 FastAPI 的後端服務，整合我們訓練的機器學習模型
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, Request, Response, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional
 import pandas as pd
 import numpy as np
 import joblib
+import pyarrow as pa
+import pyarrow.parquet as pq
+import asyncio
+import hashlib
+import json
+import math
 import os
 import re
 import shutil
+import warnings
+import zipfile
+from collections import OrderedDict, namedtuple
+from contextlib import asynccontextmanager
 from datetime import datetime
+from functools import lru_cache
+from openpyxl import load_workbook
+
+try:
+    from numba import config as numba_config, njit, prange
+
+    # TBB 執行緒層與 sklearn / onnxruntime 的 OpenMP 同時使用時，程式結束會卡住，優先使用 OpenMP
+    numba_config.THREADING_LAYER_PRIORITY = ['omp', 'tbb', 'workqueue']
+except ImportError:  # 沒有安裝 numba 時，特徵計算以純 Python 執行
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+    prange = range
+
+try:
+    import onnxruntime as ort
+except ImportError:  # 沒有安裝 onnxruntime 時，使用 sklearn 模型預測
+    ort = None
+
+# 特徵以 ndarray (已依模型特徵順序排列) 傳入模型，不需要欄位名稱檢查的警告
+warnings.filterwarnings('ignore', message='X does not have valid feature names')
 
 # 初始化 FastAPI
 app = FastAPI(
@@ -37,18 +68,30 @@ app.add_middleware(
 # ============================================================================
 
 MODEL_PATH = "models/fcn_model_histgradient_boosting_deep.pkl"
+MODEL_ONNX_PATH = "models/fcn_model_histgradient_boosting_deep.onnx"  # 由 export_onnx.py 產生
+# ONNX 以 float32 比較特徵，與 sklearn 的預測實測最大差距約 0.4 個百分點 (見 export_onnx.py)，需設定 FCN_USE_ONNX=1 才會使用
+USE_ONNX = os.environ.get('FCN_USE_ONNX') == '1'
+ONNX_MAX_DIFF = 1e-4  # export_onnx.py 允許的最大預測差距 (%)，超過時不儲存 (ONNX 輸出為 float32，本身約有 1e-6 的誤差)
 FEATURES_PATH = "models/model_features.txt"
 IV_DATA_PATH = "data/iv_data"
+IV_CACHE_SIZE = 32  # 最多同時快取的 IV 資料日期數
+PREDICTION_CACHE_SIZE = 4096  # 單一報價預測結果的快取筆數
+UPLOAD_CHUNK_SIZE = 1 << 20  # 上傳檔案每次複製 1 MB
+BATCH_RESPONSE_CACHE_SIZE = 32  # 批次報價回應 (JSON) 的快取筆數，20 檔股票池的回應約 2.5 MB
 
 model = None
+model_output_finite = False
+onnx_session = None
+model_stamp = b''  # 目前預測所用的模型版本 (批次報價 ETag 使用)
+iv_load_locks = {}  # 日期 -> [asyncio.Lock, 持有與等待的請求數]
+batch_response_cache = OrderedDict()  # ETag -> 批次報價回應的 JSON (依使用順序淘汰)
 feature_cols = []
-iv_cache = {}
-market_indices_cache = {}
+available_dates = []
 
 
 def load_model():
     """載入模型和特徵列表"""
-    global model, feature_cols
+    global model, model_output_finite, onnx_session, model_stamp, feature_cols, feature_order
 
     if os.path.exists(MODEL_PATH):
         model = joblib.load(MODEL_PATH)
@@ -57,6 +100,19 @@ def load_model():
         print(f"❌ 找不到模型檔案: {MODEL_PATH}")
         model = None
 
+    model_output_finite = check_model_output(model)
+    if model is not None and not model_output_finite:
+        print("⚠️ 無法確認模型輸出皆為有限數值，預測時將逐筆檢查 NaN/Inf")
+
+    onnx_session = load_onnx_session()
+
+    # pkl 重新訓練或改用 ONNX 預測時結果會不同，ETag 需要跟著改變
+    model_stamp = file_stamp(MODEL_PATH) if model is not None else b'none'
+    if onnx_session is not None:
+        model_stamp += b'|onnx:' + file_stamp(MODEL_ONNX_PATH)
+    else:
+        model_stamp += b'|sklearn'
+
     if os.path.exists(FEATURES_PATH):
         with open(FEATURES_PATH, 'r') as f:
             feature_cols = [line.strip() for line in f.readlines()]
@@ -65,88 +121,395 @@ def load_model():
         print(f"❌ 找不到特徵列表: {FEATURES_PATH}")
         feature_cols = []
 
+    # 預測時直接傳入 ndarray，sklearn 不會再檢查欄位名稱，載入時先確認順序與模型一致
+    model_features = list(getattr(model, 'feature_names_in_', feature_cols))
+    if model_features != feature_cols:
+        print(f"⚠️ {FEATURES_PATH} 與模型的特徵順序不一致，改用模型內記錄的 {len(model_features)} 個特徵")
+        feature_cols = model_features
 
-def load_iv_data(date_key: str) -> pd.DataFrame:
-    """載入指定日期的IV資料"""
-    global iv_cache, market_indices_cache
+    # 模型特徵順序 -> 特徵緩衝區位置，沒有計算的特徵對應到最後的 NaN 欄位
+    missing = [c for c in feature_cols if c not in FEATURE_INDEX]
+    if missing:
+        print(f"⚠️ 有 {len(missing)} 個模型特徵沒有計算，將以 NaN 代入: {missing}")
+    # 只在啟動時建立一次，設為唯讀避免請求中被意外修改
+    feature_order = np.array([FEATURE_INDEX.get(c, FEATURE_BUFFER_SIZE - 1) for c in feature_cols], dtype=np.intp)
+    feature_order.setflags(write=False)
 
-    if date_key in iv_cache:
-        return iv_cache[date_key]
+    # 模型已更換，舊的預測快取不再有效
+    predict_row_cached.cache_clear()
+    batch_response_cache.clear()
 
-    iv_file = os.path.join(IV_DATA_PATH, f'{date_key}.xlsx')
 
-    if not os.path.exists(iv_file):
-        raise FileNotFoundError(f"找不到IV資料檔案: {iv_file}")
+def check_model_output(model) -> bool:
+    """檢查模型預測值是否必定為有限數值 (HistGradientBoosting 的預測為基準值加上各樹葉節點值)"""
+    try:
+        leaves_finite = all(
+            np.isfinite(p.nodes['value'][p.nodes['is_leaf'] == 1]).all()
+            for predictors in model._predictors for p in predictors
+        )
+        return bool(leaves_finite and np.isfinite(model._baseline_prediction).all())
+    except AttributeError:
+        return False
+
+
+def load_onnx_session():
+    """
+    載入 ONNX 模型 (需設定 FCN_USE_ONNX=1、安裝 onnxruntime 且 ONNX 檔案不舊於 pkl 模型)，
+    無法使用時回傳 None
+    """
+    if not USE_ONNX or ort is None or model is None or not os.path.exists(MODEL_ONNX_PATH):
+        return None
+    if os.path.getmtime(MODEL_ONNX_PATH) < os.path.getmtime(MODEL_PATH):
+        print(f"⚠️ ONNX 模型比 {MODEL_PATH} 舊，請重新執行 export_onnx.py，暫以 sklearn 預測")
+        return None
+
+    session = ort.InferenceSession(MODEL_ONNX_PATH, providers=['CPUExecutionProvider'])
+    n_inputs = session.get_inputs()[0].shape[1]
+    if n_inputs != model.n_features_in_:
+        print(f"⚠️ ONNX 模型特徵數 ({n_inputs}) 與 sklearn 模型不符，暫以 sklearn 預測")
+        return None
+    print(f"✅ ONNX 模型載入成功: {MODEL_ONNX_PATH}")
+    return session
+
+
+def predict_coupons(X: np.ndarray) -> np.ndarray:
+    """模型預測，無效的預測值 (NaN/Inf) 以 0 代替"""
+    if onnx_session is not None:
+        predictions = onnx_session.run(None, {'input': X.astype(np.float32)})[0].ravel().astype(np.float64)
+    else:
+        predictions = model.predict(X)
+    if not model_output_finite:
+        predictions = np.nan_to_num(predictions, nan=0.0, posinf=0.0, neginf=0.0)
+    return predictions
+
+
+@lru_cache(maxsize=PREDICTION_CACHE_SIZE)
+def predict_row_cached(row_bytes: bytes) -> float:
+    """單筆預測並快取結果，以特徵列的原始位元組為鍵 (相同條件重複詢價時不需重新預測)"""
+    return float(predict_coupons(np.frombuffer(row_bytes, dtype=np.float64).reshape(1, -1))[0])
+
+
+def _row_bytes_view(matrix: np.ndarray) -> np.ndarray:
+    """將二維矩陣的每一列視為一個位元組字串 (np.unique 以位元組比較，NaN 也視為相同)"""
+    matrix = np.ascontiguousarray(matrix)
+    return matrix.view(np.dtype((np.void, matrix.dtype.itemsize * matrix.shape[1]))).ravel()
+
+
+def predict_unique_coupons(X: np.ndarray) -> np.ndarray:
+    """只預測不重複的特徵列，再展開回原本的順序"""
+    rows = _row_bytes_view(X)
+    _, first_index, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    if len(first_index) == len(rows):
+        return predict_coupons(X)
+    return predict_coupons(X[first_index])[inverse]
+
+
+def has_duplicate_rows(matrix: np.ndarray) -> bool:
+    """檢查矩陣是否有完全相同的列"""
+    rows = _row_bytes_view(matrix)
+    return len(np.unique(rows)) < len(rows)
+
+
+# 移除 Bloomberg 代碼的 " Equity" 與 " US" 後綴 (一次替換)
+BBG_SUFFIX_PATTERN = re.compile(r' Equity| US')
+
+# Bloomberg 欄位 -> 內部欄位名稱
+IV_COLUMN_MAPPING = {
+    'Unnamed: 0': 'BBG_Code',
+    'PX_LAST': 'PX_LAST',
+    '3MO_PUT_IMP_VOL': 'PUT_IMP_VOL_3M',
+    '2M_CALL_IMP_VOL_25DELTA_DFLT': 'CALL_IMP_VOL_2M_25D',
+    '2M_PUT_IMP_VOL_25DELTA_DFLT': 'PUT_IMP_VOL_2M_25D',
+    'HIST_PUT_IMP_VOL': 'HIST_PUT_IMP_VOL',
+    'VOL_STDDEV': 'VOL_STDDEV',
+    'VOLATILITY_90D': 'VOLATILITY_90D',
+    'VOL_PERCENTILE': 'VOL_PERCENTILE',
+    'CHG_PCT_1YR': 'CHG_PCT_1YR',
+    'CORR_COEF': 'CORR_COEF',
+    'DIVIDEND_INDICATED_YIELD': 'DIVIDEND_YIELD'
+}
+
+IV_NUMERIC_COLS = ['PX_LAST', 'PUT_IMP_VOL_3M', 'CALL_IMP_VOL_2M_25D',
+                   'PUT_IMP_VOL_2M_25D', 'HIST_PUT_IMP_VOL', 'VOL_STDDEV',
+                   'VOLATILITY_90D', 'VOL_PERCENTILE', 'CHG_PCT_1YR',
+                   'CORR_COEF', 'DIVIDEND_YIELD']
+
+IV_COLUMNS = ['BBG_Code'] + IV_NUMERIC_COLS
+
+
+def iv_excel_path(date_key: str) -> str:
+    return os.path.join(IV_DATA_PATH, f'{date_key}.xlsx')
+
+
+def iv_parquet_path(date_key: str) -> str:
+    return os.path.join(IV_DATA_PATH, f'{date_key}.parquet')
+
+
+# Parquet metadata 內記錄來源 xlsx 的修改時間與大小，用來判斷快取是否過期
+IV_SOURCE_KEY = b'iv_source'
+
+
+def file_stamp(path: str) -> bytes:
+    """檔案版本 (修改時間與大小)"""
+    stat = os.stat(path)
+    return f'{stat.st_mtime_ns}:{stat.st_size}'.encode()
+
+
+def is_parquet_fresh(parquet_file: str, iv_file: str) -> bool:
+    """Parquet 快取存在、可讀取，且是由目前的 xlsx 轉換而來"""
+    if not os.path.exists(parquet_file):
+        return False
+    try:
+        metadata = pq.read_schema(parquet_file).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return False
+    return metadata.get(IV_SOURCE_KEY) == file_stamp(iv_file)
+
+
+def read_iv_excel(iv_file: str) -> pd.DataFrame:
+    """
+    以 openpyxl 唯讀模式逐列讀取 xlsx 第一個工作表 (不建立整份活頁簿的物件)
+    第一列為欄位名稱，並略過第二列的中文標題
+    """
+    wb = load_workbook(iv_file, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        data = list(rows)
+    finally:
+        wb.close()
+
+    # 與 pd.read_excel 相同，只移除結尾的全空白列
+    while data and all(v is None or v == '' for v in data[-1]):
+        data.pop()
+
+    columns = [f'Unnamed: {i}' if v is None else str(v) for i, v in enumerate(header)]
+    width = max([len(columns)] + [len(row) for row in data])
+    columns += [f'Unnamed: {i}' for i in range(len(columns), width)]
+    df = pd.DataFrame(data[1:], columns=columns)
+    # 空白儲存格視為缺值
+    return df.replace('', np.nan).fillna(np.nan)
 
-    df_iv = pd.read_excel(iv_file)
 
-    # 跳過標題行 (中文標題)
-    df_iv = df_iv.iloc[1:].reset_index(drop=True)
+def convert_iv_to_parquet(date_key: str) -> pd.DataFrame:
+    """
+    解析 Bloomberg 匯出的 xlsx 並轉存為 Parquet
+    欄位整理 (跳過標題行、重命名、數值轉換) 只在這裡做一次
+    """
+    iv_file = iv_excel_path(date_key)
+    source_stamp = file_stamp(iv_file)
+    df_iv = read_iv_excel(iv_file)
 
     # 重命名列 - 根據實際 Bloomberg 數據列名
-    column_mapping = {
-        'Unnamed: 0': 'BBG_Code',
-        'PX_LAST': 'PX_LAST',
-        '3MO_PUT_IMP_VOL': 'PUT_IMP_VOL_3M',
-        '2M_CALL_IMP_VOL_25DELTA_DFLT': 'CALL_IMP_VOL_2M_25D',
-        '2M_PUT_IMP_VOL_25DELTA_DFLT': 'PUT_IMP_VOL_2M_25D',
-        'HIST_PUT_IMP_VOL': 'HIST_PUT_IMP_VOL',
-        'VOL_STDDEV': 'VOL_STDDEV',
-        'VOLATILITY_90D': 'VOLATILITY_90D',
-        'VOL_PERCENTILE': 'VOL_PERCENTILE',
-        'CHG_PCT_1YR': 'CHG_PCT_1YR',
-        'CORR_COEF': 'CORR_COEF',
-        'DIVIDEND_INDICATED_YIELD': 'DIVIDEND_YIELD'
-    }
-    df_iv = df_iv.rename(columns=column_mapping)
-
-    # 清理 BBG_Code - 移除 " Equity" 後綴
-    if 'BBG_Code' in df_iv.columns:
-        df_iv['BBG_Code'] = df_iv['BBG_Code'].astype(str).str.replace(' Equity', '', regex=False)
-        df_iv['BBG_Code'] = df_iv['BBG_Code'].str.replace(' US', '', regex=False)
-
-    # 轉換數值列
-    numeric_cols = ['PX_LAST', 'PUT_IMP_VOL_3M', 'CALL_IMP_VOL_2M_25D',
-                    'PUT_IMP_VOL_2M_25D', 'HIST_PUT_IMP_VOL', 'VOL_STDDEV',
-                    'VOLATILITY_90D', 'VOL_PERCENTILE', 'CHG_PCT_1YR',
-                    'CORR_COEF', 'DIVIDEND_YIELD']
-    for col in numeric_cols:
-        if col in df_iv.columns:
+    df_iv = df_iv.rename(columns=IV_COLUMN_MAPPING)
+
+    missing = [col for col in ('BBG_Code', 'PX_LAST') if col not in df_iv.columns]
+    if missing:
+        raise ValueError(f"缺少必要欄位: {', '.join(missing)}")
+
+    # 只保留需要的欄位，缺少的數值欄位補 NaN
+    df_iv = df_iv.reindex(columns=IV_COLUMNS)
+
+    # 清理 BBG_Code - 移除 " Equity"、" US" 後綴
+    df_iv['BBG_Code'] = df_iv['BBG_Code'].astype(str).str.replace(BBG_SUFFIX_PATTERN, '', regex=True)
+
+    # 轉換數值列 (一次轉成 float64；有無法轉換的字串，例如 Bloomberg 的 #N/A 時才逐欄轉換)
+    try:
+        df_iv[IV_NUMERIC_COLS] = df_iv[IV_NUMERIC_COLS].to_numpy(dtype=np.float64)
+    except (TypeError, ValueError):
+        for col in IV_NUMERIC_COLS:
             df_iv[col] = pd.to_numeric(df_iv[col], errors='coerce')
 
+    # 先寫入暫存檔再改名，避免多個 worker 同時轉換時讀到寫到一半的檔案
+    table = pa.Table.from_pandas(df_iv, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), IV_SOURCE_KEY: source_stamp})
+    parquet_file = iv_parquet_path(date_key)
+    tmp_file = f'{parquet_file}.{os.getpid()}.tmp'
+    pq.write_table(table, tmp_file, compression="zstd")
+    os.replace(tmp_file, parquet_file)
+    return df_iv
+
+
+def build_stock_list(df_iv: pd.DataFrame) -> List[dict]:
+    """整理可供選擇的股票清單 (排除指數、無效代碼與沒有價格的記錄)"""
+    codes = df_iv['BBG_Code'].astype(str)
+    valid = (codes != '') & (codes != 'nan') & ~codes.str.contains('Index', regex=False)
+    valid &= np.isfinite(df_iv['PX_LAST'])
+
+    stocks_df = df_iv.loc[valid, ['BBG_Code', 'PX_LAST', 'VOLATILITY_90D', 'PUT_IMP_VOL_3M']]
+    stocks_df.columns = ['code', 'price', 'vol90d', 'iv']
+    # NaN / inf 轉為 None
+    stocks_df = stocks_df.replace([np.inf, -np.inf], np.nan)
+    stocks_df = stocks_df.astype(object).where(stocks_df.notna(), None)
+    return stocks_df.to_dict('records')
+
+
+@lru_cache(maxsize=IV_CACHE_SIZE)
+def _load_iv_bundle(date_key: str) -> tuple:
+    """
+    載入指定日期的IV資料
+
+    回傳 (DataFrame, BBG_Code -> 欄位 dict, (BBG_Code -> 列索引, 數值矩陣), 市場指數, 股票清單)，
+    同一日期的資料一起快取、一起淘汰
+    """
+    iv_file = iv_excel_path(date_key)
+
+    if not os.path.exists(iv_file):
+        raise FileNotFoundError(f"找不到IV資料檔案: {iv_file}")
+
+    # 優先讀取已整理好的 Parquet，xlsx 更換過 (修改時間或大小不同) 時重新轉換
+    parquet_file = iv_parquet_path(date_key)
+    if is_parquet_fresh(parquet_file, iv_file):
+        df_iv = pd.read_parquet(parquet_file, engine="pyarrow", columns=IV_COLUMNS)
+    else:
+        df_iv = convert_iv_to_parquet(date_key)
+
     # 提取市場指數 (SOFR, VIX 等)
     market_indices = {'SOFR_RATE': 5.0, 'VIX_INDEX': 15.0}  # 預設值
-    for _, row in df_iv.iterrows():
-        code = str(row['BBG_Code'])
-        price = safe_float(row['PX_LAST'])
-        if price is not None:
-            if 'SOFRRATE' in code or 'SOFR' in code:
-                market_indices['SOFR_RATE'] = price
-            elif 'VIX' in code:
-                market_indices['VIX_INDEX'] = price
-    market_indices_cache[date_key] = market_indices
-
-    iv_cache[date_key] = df_iv
-    return df_iv
+    codes = df_iv['BBG_Code'].astype(str)
+    has_price = np.isfinite(df_iv['PX_LAST'])
+    sofr_mask = codes.str.contains('SOFR', regex=False)
+    vix_mask = codes.str.contains('VIX', regex=False) & ~sofr_mask
+    for key, mask in (('SOFR_RATE', sofr_mask), ('VIX_INDEX', vix_mask)):
+        mask = mask & has_price
+        if mask.any():
+            market_indices[key] = float(df_iv.loc[mask, 'PX_LAST'].iloc[-1])
+
+    # BBG_Code -> 欄位 dict (同代碼取第一筆)
+    df_unique = df_iv.drop_duplicates('BBG_Code')
+    iv_rows = df_unique.set_index('BBG_Code', drop=False).to_dict('index')
+
+    # BBG_Code -> 列索引，以及依 IV_NUMERIC_COLS 排列的數值矩陣 (批次報價使用)
+    code_to_row = {code: i for i, code in enumerate(df_unique['BBG_Code'])}
+    iv_matrix = (code_to_row, df_unique[IV_NUMERIC_COLS].to_numpy(dtype=np.float64))
+
+    return df_iv, iv_rows, iv_matrix, market_indices, build_stock_list(df_iv)
+
+
+def load_iv_data(date_key: str) -> pd.DataFrame:
+    """載入指定日期的IV資料"""
+    return _load_iv_bundle(date_key)[0]
+
+
+@asynccontextmanager
+async def iv_load_lock(date_key: str):
+    """同一日期的載入與寫入互斥；沒有人持有或等待時移除該日期的鎖，iv_load_locks 不會無限增長"""
+    entry = iv_load_locks.get(date_key)
+    if entry is None:
+        entry = iv_load_locks[date_key] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del iv_load_locks[date_key]
+
+
+async def load_iv_data_async(date_key: str) -> pd.DataFrame:
+    """在背景執行緒載入IV資料，避免阻塞 event loop (同一日期同時只載入一次)"""
+    async with iv_load_lock(date_key):
+        return await asyncio.to_thread(load_iv_data, date_key)
+
+
+def clear_iv_cache():
+    """清除IV資料快取 (上傳或刪除檔案後呼叫)"""
+    _load_iv_bundle.cache_clear()
+    batch_response_cache.clear()
+
+
+XLSX_MAGIC = b'PK\x03\x04'  # xlsx 為 ZIP 格式
+
+
+def check_xlsx_upload(source):
+    """
+    寫入磁碟前先檢查上傳檔案是 xlsx (ZIP 檔頭正確且包含活頁簿)，不符時丟出 ValueError
+    只讀取檔頭與 ZIP 目錄，檢查完將讀取位置移回開頭
+    """
+    try:
+        if source.read(len(XLSX_MAGIC)) != XLSX_MAGIC:
+            raise ValueError("不是有效的 xlsx 檔案")
+        source.seek(0)
+        with zipfile.ZipFile(source) as archive:
+            if 'xl/workbook.xml' not in archive.namelist():
+                raise ValueError("xlsx 檔案中找不到活頁簿")
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"不是有效的 xlsx 檔案: {e}")
+    finally:
+        source.seek(0)
+
+
+def save_upload_file(source, file_path: str):
+    """將上傳檔案寫入暫存檔後再改名，寫到一半失敗時不會留下不完整的 xlsx"""
+    tmp_path = f'{file_path}.{os.getpid()}.upload'
+    try:
+        with open(tmp_path, "wb") as buffer:
+            shutil.copyfileobj(source, buffer, UPLOAD_CHUNK_SIZE)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def preload_iv_data():
+    """啟動時預先載入最近日期的IV資料 (最多 IV_CACHE_SIZE 個)"""
+    for date_key in get_available_dates()[:IV_CACHE_SIZE]:
+        try:
+            load_iv_data(date_key)
+        except Exception as e:
+            print(f"⚠️ 無法載入IV資料 {date_key}: {e}")
+    print(f"✅ IV資料預載完成: {_load_iv_bundle.cache_info().currsize} 個日期")
+
+
+def get_iv_rows(date_key: str) -> dict:
+    """取得指定日期 BBG_Code -> IV資料 的對照表"""
+    return _load_iv_bundle(date_key)[1]
+
+
+def get_iv_matrix(date_key: str) -> tuple:
+    """取得指定日期的 (BBG_Code -> 列索引, IV 數值矩陣)"""
+    return _load_iv_bundle(date_key)[2]
 
 
 def get_market_indices(date_key: str) -> dict:
     """取得指定日期的市場指數"""
-    if date_key not in market_indices_cache:
-        load_iv_data(date_key)
-    return market_indices_cache.get(date_key, {'SOFR_RATE': 5.0, 'VIX_INDEX': 15.0})
+    return _load_iv_bundle(date_key)[3]
 
 
-def get_available_dates() -> List[str]:
-    """取得可用的IV資料日期"""
-    if not os.path.exists(IV_DATA_PATH):
-        return []
+def refresh_available_dates():
+    """重新掃描IV資料目錄，更新可用日期列表 (啟動、上傳、刪除時呼叫)"""
+    global available_dates
 
     dates = []
-    for f in os.listdir(IV_DATA_PATH):
-        if f.endswith('.xlsx'):
-            dates.append(f.replace('.xlsx', ''))
-    return sorted(dates, reverse=True)
+    if os.path.exists(IV_DATA_PATH):
+        for f in os.listdir(IV_DATA_PATH):
+            if f.endswith('.xlsx'):
+                dates.append(f.replace('.xlsx', ''))
+    # 整個列表一次替換，讀取端不需要加鎖
+    available_dates = sorted(dates, reverse=True)
+
+
+def get_available_dates() -> List[str]:
+    """取得可用的IV資料日期 (由新到舊)"""
+    return available_dates
+
+
+def resolve_pricing_date(pricing_date: Optional[str]) -> str:
+    """
+    取得請求的定價日期 (未指定時使用最新日期)
+    日期會用來組成 IV 檔案路徑 (快取未命中時還會寫入 Parquet)，必須是已存在的 YYYYMMDD 日期
+    """
+    dates = get_available_dates()
+    if not dates:
+        raise HTTPException(status_code=404, detail="沒有可用的IV資料")
+    if not pricing_date:
+        return dates[0]
+    if not re.match(r'^\d{8}$', pricing_date):
+        raise HTTPException(status_code=400, detail="無效的日期格式")
+    if pricing_date not in dates:
+        raise HTTPException(status_code=404, detail="找不到該日期的資料")
+    return pricing_date
 
 
 def safe_float(value) -> float | None:
@@ -163,26 +526,9 @@ def safe_float(value) -> float | None:
 
 
 def get_available_stocks(date_key: str) -> List[dict]:
-    """取得指定日期可用的股票清單"""
+    """取得指定日期可用的股票清單 (載入IV資料時已整理好，直接回傳快取)"""
     try:
-        df_iv = load_iv_data(date_key)
-        stocks = []
-        for _, row in df_iv.iterrows():
-            code = row['BBG_Code']
-            # 過濾掉無效的股票代碼
-            if not code or code == 'nan' or 'Index' in str(code):
-                continue
-            # 過濾掉沒有價格的記錄
-            price = safe_float(row['PX_LAST'])
-            if price is None:
-                continue
-            stocks.append({
-                'code': code,
-                'price': price,
-                'vol90d': safe_float(row['VOLATILITY_90D']),
-                'iv': safe_float(row['PUT_IMP_VOL_3M'])
-            })
-        return stocks
+        return _load_iv_bundle(date_key)[4]
     except Exception as e:
         print(f"Error loading stocks: {e}")
         return []
@@ -193,7 +539,9 @@ def get_available_stocks(date_key: str) -> List[dict]:
 # ============================================================================
 
 class FCNRequest(BaseModel):
-    stocks: List[str] = Field(..., min_items=1, max_items=4, description="股票代碼列表(最多4檔)")
+    model_config = ConfigDict(extra="forbid")
+
+    stocks: List[str] = Field(..., min_length=1, max_length=4, description="股票代碼列表(最多4檔)")
     period: int = Field(..., ge=2, le=12, description="承作期間(月)")
     strikePrice: float = Field(..., ge=50, le=100, description="轉換價(%)")
     knockOutPrice: float = Field(..., ge=90, le=150, description="上限價(%)")
@@ -206,8 +554,10 @@ class FCNRequest(BaseModel):
 
 class BatchFCNRequest(BaseModel):
     """批次報價請求 - 用於 AI 智慧詢價"""
-    stockPool: List[str] = Field(..., min_items=1, max_items=20, description="股票池(最多20檔)")
-    basketSizes: List[int] = Field(..., min_items=1, description="組合大小(1-4)")
+    model_config = ConfigDict(extra="forbid")
+
+    stockPool: List[str] = Field(..., min_length=1, max_length=20, description="股票池(最多20檔)")
+    basketSizes: List[int] = Field(..., min_length=1, description="組合大小(1-4)")
     period: int = Field(..., ge=2, le=12, description="承作期間(月)")
     strikePrice: float = Field(..., ge=50, le=100, description="轉換價(%)")
     knockOutPrice: float = Field(..., ge=90, le=150, description="上限價(%)")
@@ -229,6 +579,8 @@ class FCNResponse(BaseModel):
 
 
 class StockDetailsRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
     symbols: List[str]
 
 
@@ -236,204 +588,386 @@ class StockDetailsRequest(BaseModel):
 # 特徵工程函數
 # ============================================================================
 
-def compute_features(input_data: dict, iv_data_list: list) -> pd.DataFrame:
-    """計算所有特徵"""
-    features = {}
+# 原始 IV 欄位列表
+IV_COLS = IV_NUMERIC_COLS
+IV_IDX = {col: j for j, col in enumerate(IV_COLS)}
+MAX_STOCKS = 4
+
+# 各標的原始欄位 (PUT_IMP_VOL_3M, PUT_IMP_VOL_3M_2, ...) 與排序後欄位 (_Rank_1, ...) 名稱
+_STOCK_COLS = tuple(tuple(f'{col}{"" if i == 0 else f"_{i+1}"}' for col in IV_COLS) for i in range(MAX_STOCKS))
+_RANK_COLS = tuple(tuple(f'{col}_Rank_{r+1}' for col in IV_COLS) for r in range(MAX_STOCKS))
+
+# 純量特徵: (kernel 內使用的代號, 特徵名稱)
+_SCALAR_FEATURES = (
+    ('STRIKE', 'Strike (%)'),
+    ('KO_BARRIER', 'KO Barrier (%)'),
+    ('KI_BARRIER', 'KI Barrier (%)'),
+    ('TENOR', 'Tenor (m)'),
+    ('NON_CALL', 'Non-call Periods (m)'),
+    ('COST', 'Cost (%)'),
+    ('BARRIER_TYPE_AKI', 'Barrier_Type_AKI'),
+    ('NO_KO_FLAG', 'No_KO_Flag'),
+    ('NO_KO_TENOR', 'No_KO_Tenor_Interaction'),
+    ('NO_KO_KI', 'No_KO_KI_Interaction'),
+    ('NO_KO_STRIKE', 'No_KO_Strike_Interaction'),
+    ('FEE', 'Fee'),
+    ('ANNUALIZED_FEE', 'Annualized_Fee'),
+    ('TENOR_SQRT', 'Tenor_Sqrt'),
+    ('TENOR_SQUARED', 'Tenor_Squared'),
+    ('CALLABLE_PERIOD', 'Callable_Period'),
+    ('CALLABLE_RATIO', 'Callable_Ratio'),
+    ('NONCALL_RATIO', 'NonCall_Ratio'),
+    ('KO_STRIKE_DISTANCE', 'KO_Strike_Distance'),
+    ('STRIKE_KI_DISTANCE', 'Strike_KI_Distance'),
+    ('KO_KI_RANGE', 'KO_KI_Range'),
+    ('KI_STRIKE_RATIO', 'KI_Strike_Ratio'),
+    ('KO_STRIKE_RATIO', 'KO_Strike_Ratio'),
+    ('KI_DISTANCE_PCT', 'KI_Distance_Pct'),
+    ('KO_DISTANCE_PCT', 'KO_Distance_Pct'),
+    ('BASKET_SIZE', 'Basket_Size'),
+    ('BASKET_COMPLEXITY', 'Basket_Complexity_Factor'),
+    ('WORST_IV', 'Basket_Worst_IV'),
+    ('BEST_IV', 'Basket_Best_IV'),
+    ('IV_RANGE', 'Basket_IV_Range'),
+    ('AVG_IV', 'Basket_Avg_IV'),
+    ('WORST_HV', 'Basket_Worst_HV'),
+    ('BEST_HV', 'Basket_Best_HV'),
+    ('AVG_HV', 'Basket_Avg_HV'),
+    ('AVG_CORR', 'Basket_Avg_Corr'),
+    ('BASKET_MIN_CORR', 'Basket_Min_Corr'),
+    ('MAX_CORR', 'Max_Correlation'),
+    ('AVG_SKEW', 'Basket_Avg_Skew'),
+    ('MAX_SKEW', 'Basket_Max_Skew'),
+    ('AVG_PREMIUM', 'Basket_Avg_IV_Premium'),
+    ('MAX_PREMIUM', 'Basket_Max_IV_Premium'),
+    ('IV_HV_RATIO', 'IV_HV_Ratio'),
+    ('VOL_FACTOR', 'Annualized_Vol_Factor'),
+    ('KI_DISTANCE_STD', 'KI_Distance_Std'),
+    ('KO_DISTANCE_STD', 'KO_Distance_Std'),
+    ('ANNUALIZED_VOL', 'Annualized_Vol'),
+    ('CORR_ADJUSTED_IV', 'Corr_Adjusted_IV'),
+    ('KI_RISK_SCORE', 'KI_Risk_Score'),
+    ('BASKET_RISK_SCORE', 'Basket_Risk_Score'),
+    ('RISK_SCORE_SORTED', 'Risk_Score_Sorted'),
+    ('RETURN_POTENTIAL', 'Return_Potential'),
+    ('NO_KO_BASKET', 'No_KO_Basket_Interaction'),
+)
+
+# 純量特徵在緩衝區的位置 (namedtuple 可在 numba kernel 內當常數使用)
+S = namedtuple('FeatureSlot', [key for key, _ in _SCALAR_FEATURES])(*range(len(_SCALAR_FEATURES)))
+
+# 特徵緩衝區配置: 純量特徵 | 各標的原始欄位 | 排序後欄位 | Skew | Premium | Skew_Rank | Premium_Rank
+FEATURE_NAMES = (
+    tuple(name for _, name in _SCALAR_FEATURES)
+    + sum(_STOCK_COLS, ())
+    + sum(_RANK_COLS, ())
+    + tuple(f'IV_Skew_{i+1}' for i in range(MAX_STOCKS))
+    + tuple(f'IV_Premium_{i+1}' for i in range(MAX_STOCKS))
+    + tuple(f'IV_Skew_Rank_{r+1}' for r in range(MAX_STOCKS))
+    + tuple(f'IV_Premium_Rank_{r+1}' for r in range(MAX_STOCKS))
+)
+FEATURE_INDEX = {name: i for i, name in enumerate(FEATURE_NAMES)}
+
+# 與其他特徵數值相同的特徵直接指向同一個緩衝區位置，kernel 不重複寫入
+FEATURE_ALIASES = {
+    'Num_Underlyings': 'Basket_Size',
+    'Min_Correlation': 'Basket_Min_Corr',
+    'KI_Distance_Std_Sorted': 'KI_Distance_Std',
+}
+FEATURE_INDEX.update({alias: FEATURE_INDEX[name] for alias, name in FEATURE_ALIASES.items()})
+
+N_IV_COLS = len(IV_COLS)
+STOCK_START = FEATURE_INDEX[_STOCK_COLS[0][0]]
+RANK_START = FEATURE_INDEX[_RANK_COLS[0][0]]
+SKEW_START = FEATURE_INDEX['IV_Skew_1']
+PREMIUM_START = FEATURE_INDEX['IV_Premium_1']
+SKEW_RANK_START = FEATURE_INDEX['IV_Skew_Rank_1']
+PREMIUM_RANK_START = FEATURE_INDEX['IV_Premium_Rank_1']
+
+# 緩衝區長度多留一格固定為 NaN，給模型需要但沒有計算的特徵使用
+FEATURE_BUFFER_SIZE = len(FEATURE_NAMES) + 1
+
+# kernel 內使用的 IV 欄位位置
+_PX_3M = IV_IDX['PUT_IMP_VOL_3M']
+_PX_PUT_2M = IV_IDX['PUT_IMP_VOL_2M_25D']
+_PX_CALL_2M = IV_IDX['CALL_IMP_VOL_2M_25D']
+_PX_HV = IV_IDX['VOLATILITY_90D']
+_PX_CORR = IV_IDX['CORR_COEF']
+
+# 模型特徵順序 -> 緩衝區位置 (load_model 時建立)
+feature_order = np.empty(0, dtype=np.intp)
+
+
+def build_iv_matrix(iv_data_list: list) -> tuple:
+    """將各標的IV資料 dict 整理成 (MAX_STOCKS, len(IV_COLS)) 陣列，回傳 (陣列, 標的數)"""
+    iv_matrix = np.full((MAX_STOCKS, len(IV_COLS)), np.nan)
+    basket_size = 0
+    for i, d in enumerate(iv_data_list[:MAX_STOCKS]):
+        if d is not None:
+            iv_matrix[i] = [d.get(col, np.nan) for col in IV_COLS]
+            basket_size += 1
+    return iv_matrix, basket_size
+
+
+@njit(cache=True, error_model='numpy')
+def _compute_features_kernel(out, iv_matrix, basket_size, strike, ko_barrier, ki_barrier,
+                             tenor, cost, barrier_type_aki, non_call):
+    """
+    特徵計算核心 (numba 編譯)，依 FEATURE_NAMES 順序寫入 out
+    iv_matrix 為 (MAX_STOCKS, N_IV_COLS)，各列已按 PUT_IMP_VOL_3M 降冪排序，沒有標的的列為 NaN
+    """
+    out[FEATURE_BUFFER_SIZE - 1] = np.nan
 
     # 基本FCN條件特徵
-    features['Strike (%)'] = input_data['strike']
-    features['KO Barrier (%)'] = input_data['ko_barrier']
-    features['KI Barrier (%)'] = input_data['ki_barrier']
-    features['Tenor (m)'] = input_data['tenor']
-    features['Non-call Periods (m)'] = input_data.get('non_call_periods', 1)
-    features['Cost (%)'] = input_data['cost']
-    features['Barrier_Type_AKI'] = 1 if input_data['barrier_type'] == 'AKI' else 0
+    out[S.STRIKE] = strike
+    out[S.KO_BARRIER] = ko_barrier
+    out[S.KI_BARRIER] = ki_barrier
+    out[S.TENOR] = tenor
+    out[S.NON_CALL] = non_call
+    out[S.COST] = cost
+    out[S.BARRIER_TYPE_AKI] = barrier_type_aki
 
     # No KO Flag (當 Non-call == Tenor 時，不會觸發 KO)
-    features['No_KO_Flag'] = 1 if features['Non-call Periods (m)'] == input_data['tenor'] else 0
+    no_ko = 1.0 if non_call == tenor else 0.0
+    out[S.NO_KO_FLAG] = no_ko
 
     # No_KO 交互特徵 (V4 新增)
-    no_ko = features['No_KO_Flag']
-    features['No_KO_Tenor_Interaction'] = no_ko * input_data['tenor']
-    features['No_KO_KI_Interaction'] = no_ko * input_data['ki_barrier']
-    features['No_KO_Strike_Interaction'] = no_ko * input_data['strike']
+    out[S.NO_KO_TENOR] = no_ko * tenor
+    out[S.NO_KO_KI] = no_ko * ki_barrier
+    out[S.NO_KO_STRIKE] = no_ko * strike
 
     # 費用特徵
-    features['Fee'] = 100 - input_data['cost']
-    features['Annualized_Fee'] = features['Fee'] / input_data['tenor'] * 12
+    fee = 100 - cost
+    out[S.FEE] = fee
+    out[S.ANNUALIZED_FEE] = fee / tenor * 12
 
     # 時間特徵
-    features['Tenor_Sqrt'] = np.sqrt(input_data['tenor'])
-    features['Tenor_Squared'] = input_data['tenor'] ** 2
-    features['Callable_Period'] = input_data['tenor'] - features['Non-call Periods (m)']
-    features['Callable_Ratio'] = features['Callable_Period'] / input_data['tenor']
-    features['NonCall_Ratio'] = features['Non-call Periods (m)'] / input_data['tenor']
+    callable_period = tenor - non_call
+    out[S.TENOR_SQRT] = np.sqrt(tenor)
+    out[S.TENOR_SQUARED] = tenor ** 2
+    out[S.CALLABLE_PERIOD] = callable_period
+    out[S.CALLABLE_RATIO] = callable_period / tenor
+    out[S.NONCALL_RATIO] = non_call / tenor
 
     # 障礙價特徵
-    features['KO_Strike_Distance'] = input_data['ko_barrier'] - input_data['strike']
-    features['Strike_KI_Distance'] = input_data['strike'] - input_data['ki_barrier']
-    features['KO_KI_Range'] = input_data['ko_barrier'] - input_data['ki_barrier']
-    features['KI_Strike_Ratio'] = input_data['ki_barrier'] / input_data['strike']
-    features['KO_Strike_Ratio'] = input_data['ko_barrier'] / input_data['strike']
-    features['KI_Distance_Pct'] = input_data['strike'] - input_data['ki_barrier']
-    features['KO_Distance_Pct'] = input_data['ko_barrier'] - input_data['strike']
+    ki_distance_pct = strike - ki_barrier
+    ko_distance_pct = ko_barrier - strike
+    out[S.KO_STRIKE_DISTANCE] = ko_distance_pct
+    out[S.STRIKE_KI_DISTANCE] = ki_distance_pct
+    out[S.KO_KI_RANGE] = ko_barrier - ki_barrier
+    out[S.KI_STRIKE_RATIO] = ki_barrier / strike
+    out[S.KO_STRIKE_RATIO] = ko_barrier / strike
+    out[S.KI_DISTANCE_PCT] = ki_distance_pct
+    out[S.KO_DISTANCE_PCT] = ko_distance_pct
 
     # Basket特徵
-    basket_size = len([d for d in iv_data_list if d is not None])
-    features['Basket_Size'] = basket_size
-    features['Num_Underlyings'] = basket_size
-    features['Basket_Complexity_Factor'] = basket_size / 3.0
-
-    # 原始 IV 欄位列表
-    iv_cols = ['PX_LAST', 'PUT_IMP_VOL_3M', 'CALL_IMP_VOL_2M_25D', 'PUT_IMP_VOL_2M_25D',
-               'HIST_PUT_IMP_VOL', 'VOL_STDDEV', 'VOLATILITY_90D', 'VOL_PERCENTILE',
-               'CHG_PCT_1YR', 'CORR_COEF', 'DIVIDEND_YIELD']
-
-    # V8: 先生成原始 IV 欄位 (PUT_IMP_VOL_3M, PUT_IMP_VOL_3M_2, etc.)
-    max_stocks = 4
-    for i in range(max_stocks):
-        suffix = '' if i == 0 else f'_{i+1}'
-        for col in iv_cols:
-            col_name = f'{col}{suffix}'
-            if i < len(iv_data_list) and iv_data_list[i] is not None:
-                features[col_name] = iv_data_list[i].get(col, np.nan)
-            else:
-                features[col_name] = np.nan
-
-    # V8: 按 PUT_IMP_VOL_3M 降冪排序生成 _Rank_ 欄位
-    # 收集每個股票的 IV 值和索引
-    iv_pairs = []
-    for i in range(max_stocks):
-        suffix = '' if i == 0 else f'_{i+1}'
-        iv_val = features.get(f'PUT_IMP_VOL_3M{suffix}', np.nan)
-        if pd.notna(iv_val):
-            iv_pairs.append((i, iv_val))
-        else:
-            iv_pairs.append((i, -np.inf))
-
-    # 按 IV 降冪排序
-    sorted_pairs = sorted(iv_pairs, key=lambda x: x[1], reverse=True)
-    sorted_indices = [p[0] for p in sorted_pairs]
+    out[S.BASKET_SIZE] = basket_size
+    out[S.BASKET_COMPLEXITY] = basket_size / 3.0
+
+    # V8: 原始 IV 欄位 (PUT_IMP_VOL_3M, PUT_IMP_VOL_3M_2, etc.)
+    for i in range(MAX_STOCKS):
+        for j in range(N_IV_COLS):
+            out[STOCK_START + i * N_IV_COLS + j] = iv_matrix[i, j]
+
+    # V8: 按 PUT_IMP_VOL_3M 降冪排序 (NaN 排最後，同值維持原順序的插入排序)
+    order = np.arange(MAX_STOCKS)
+    keys = np.empty(MAX_STOCKS)
+    for i in range(MAX_STOCKS):
+        v = iv_matrix[i, _PX_3M]
+        keys[i] = -np.inf if np.isnan(v) else v
+    for i in range(1, MAX_STOCKS):
+        idx = order[i]
+        key = keys[idx]
+        j = i
+        while j > 0 and keys[order[j - 1]] < key:
+            order[j] = order[j - 1]
+            j -= 1
+        order[j] = idx
 
     # 生成排序後的特徵 (_Rank_1, _Rank_2, etc.)
-    for col in iv_cols:
-        for rank in range(max_stocks):
-            rank_col = f'{col}_Rank_{rank+1}'
-            orig_idx = sorted_indices[rank]
-            orig_suffix = '' if orig_idx == 0 else f'_{orig_idx+1}'
-            features[rank_col] = features.get(f'{col}{orig_suffix}', np.nan)
-
-    # IV Skew 和 Premium - 原始版本 (IV_Skew_1, IV_Skew_2, etc.)
-    for i in range(max_stocks):
-        suffix = '' if i == 0 else f'_{i+1}'
-        put_iv = features.get(f'PUT_IMP_VOL_2M_25D{suffix}', np.nan)
-        call_iv = features.get(f'CALL_IMP_VOL_2M_25D{suffix}', np.nan)
-        hist_iv = features.get(f'VOLATILITY_90D{suffix}', np.nan)
-        iv_3m = features.get(f'PUT_IMP_VOL_3M{suffix}', np.nan)
-
-        if pd.notna(put_iv) and pd.notna(call_iv):
-            features[f'IV_Skew_{i+1}'] = put_iv - call_iv
-        else:
-            features[f'IV_Skew_{i+1}'] = np.nan
-
-        if pd.notna(iv_3m) and pd.notna(hist_iv) and hist_iv != 0:
-            features[f'IV_Premium_{i+1}'] = (iv_3m - hist_iv) / hist_iv
-        else:
-            features[f'IV_Premium_{i+1}'] = np.nan
-
-    # IV Skew 和 Premium - 排序版本 (IV_Skew_Rank_1, etc.)
-    for rank in range(max_stocks):
-        orig_idx = sorted_indices[rank]
-        features[f'IV_Skew_Rank_{rank+1}'] = features.get(f'IV_Skew_{orig_idx+1}', np.nan)
-        features[f'IV_Premium_Rank_{rank+1}'] = features.get(f'IV_Premium_{orig_idx+1}', np.nan)
-
-    # Basket聚合特徵
-    iv_values = [d.get('PUT_IMP_VOL_3M') for d in iv_data_list if d and pd.notna(d.get('PUT_IMP_VOL_3M'))]
-    hv_values = [d.get('VOLATILITY_90D') for d in iv_data_list if d and pd.notna(d.get('VOLATILITY_90D'))]
-    corr_values = [d.get('CORR_COEF') for d in iv_data_list if d and pd.notna(d.get('CORR_COEF'))]
+    for r in range(MAX_STOCKS):
+        for j in range(N_IV_COLS):
+            out[RANK_START + r * N_IV_COLS + j] = iv_matrix[order[r], j]
+
+    # IV Skew 和 Premium - 原始版本與排序版本
+    skew = np.empty(MAX_STOCKS)
+    premium = np.empty(MAX_STOCKS)
+    for i in range(MAX_STOCKS):
+        skew[i] = iv_matrix[i, _PX_PUT_2M] - iv_matrix[i, _PX_CALL_2M]
+        hist_iv = iv_matrix[i, _PX_HV]
+        premium[i] = (iv_matrix[i, _PX_3M] - hist_iv) / hist_iv if hist_iv != 0 else np.nan
+    for i in range(MAX_STOCKS):
+        out[SKEW_START + i] = skew[i]
+        out[PREMIUM_START + i] = premium[i]
+        out[SKEW_RANK_START + i] = skew[order[i]]
+        out[PREMIUM_RANK_START + i] = premium[order[i]]
+
+    # Basket聚合特徵 (略過 NaN)
+    n_iv = 0
+    n_hv = 0
+    n_corr = 0
+    n_skew = 0
+    n_premium = 0
+    sum_iv = 0.0
+    sum_hv = 0.0
+    sum_corr = 0.0
+    sum_skew = 0.0
+    sum_premium = 0.0
+    worst_iv = best_iv = worst_hv = best_hv = max_corr = min_corr = max_skew = max_premium = np.nan
+    for i in range(MAX_STOCKS):
+        v = iv_matrix[i, _PX_3M]
+        if not np.isnan(v):
+            worst_iv = v if n_iv == 0 or v > worst_iv else worst_iv
+            best_iv = v if n_iv == 0 or v < best_iv else best_iv
+            sum_iv += v
+            n_iv += 1
+        v = iv_matrix[i, _PX_HV]
+        if not np.isnan(v):
+            worst_hv = v if n_hv == 0 or v > worst_hv else worst_hv
+            best_hv = v if n_hv == 0 or v < best_hv else best_hv
+            sum_hv += v
+            n_hv += 1
+        v = iv_matrix[i, _PX_CORR]
+        if not np.isnan(v):
+            max_corr = v if n_corr == 0 or v > max_corr else max_corr
+            min_corr = v if n_corr == 0 or v < min_corr else min_corr
+            sum_corr += v
+            n_corr += 1
+        if i < basket_size:
+            v = skew[i]
+            if not np.isnan(v):
+                max_skew = v if n_skew == 0 or v > max_skew else max_skew
+                sum_skew += v
+                n_skew += 1
+            v = premium[i]
+            if not np.isnan(v):
+                max_premium = v if n_premium == 0 or v > max_premium else max_premium
+                sum_premium += v
+                n_premium += 1
+
+    avg_iv = sum_iv / n_iv if n_iv else np.nan
+    avg_hv = sum_hv / n_hv if n_hv else np.nan
+    avg_corr = sum_corr / n_corr if n_corr else np.nan
 
     # V8: IV 聚合特徵 (使用 Basket_Worst_IV/Best_IV 命名)
-    features['Basket_Worst_IV'] = max(iv_values) if iv_values else np.nan
-    features['Basket_Best_IV'] = min(iv_values) if iv_values else np.nan
-    features['Basket_IV_Range'] = (max(iv_values) - min(iv_values)) if len(iv_values) >= 2 else 0
-    features['Basket_Avg_IV'] = np.mean(iv_values) if iv_values else np.nan
+    out[S.WORST_IV] = worst_iv
+    out[S.BEST_IV] = best_iv
+    out[S.IV_RANGE] = (worst_iv - best_iv) if n_iv >= 2 else 0.0
+    out[S.AVG_IV] = avg_iv
 
     # HV 聚合特徵
-    features['Basket_Worst_HV'] = max(hv_values) if hv_values else np.nan
-    features['Basket_Best_HV'] = min(hv_values) if hv_values else np.nan
-    features['Basket_Avg_HV'] = np.mean(hv_values) if hv_values else np.nan
+    out[S.WORST_HV] = worst_hv
+    out[S.BEST_HV] = best_hv
+    out[S.AVG_HV] = avg_hv
 
     # 相關係數聚合特徵
-    features['Basket_Avg_Corr'] = np.mean(corr_values) if corr_values else np.nan
-    features['Basket_Min_Corr'] = min(corr_values) if corr_values else np.nan
-    features['Max_Correlation'] = max(corr_values) if corr_values else np.nan
-    features['Min_Correlation'] = min(corr_values) if corr_values else np.nan
-
-    skew_values = [features.get(f'IV_Skew_{i+1}') for i in range(basket_size)
-                   if pd.notna(features.get(f'IV_Skew_{i+1}'))]
-    premium_values = [features.get(f'IV_Premium_{i+1}') for i in range(basket_size)
-                      if pd.notna(features.get(f'IV_Premium_{i+1}'))]
-
-    features['Basket_Avg_Skew'] = np.mean(skew_values) if skew_values else np.nan
-    features['Basket_Max_Skew'] = max(skew_values) if skew_values else np.nan
-    features['Basket_Avg_IV_Premium'] = np.mean(premium_values) if premium_values else np.nan
-    features['Basket_Max_IV_Premium'] = max(premium_values) if premium_values else np.nan
-
-    if iv_values and hv_values:
-        features['IV_HV_Ratio'] = np.mean(iv_values) / np.mean(hv_values)
-    else:
-        features['IV_HV_Ratio'] = np.nan
+    out[S.AVG_CORR] = avg_corr
+    out[S.BASKET_MIN_CORR] = min_corr
+    out[S.MAX_CORR] = max_corr
 
-    # 風險評分特徵 - V8 使用 Basket_Worst_IV
-    rank_1_iv = features.get('PUT_IMP_VOL_3M_Rank_1', np.nan)
-    worst_iv = features.get('Basket_Worst_IV', np.nan)
+    out[S.AVG_SKEW] = sum_skew / n_skew if n_skew else np.nan
+    out[S.MAX_SKEW] = max_skew
+    out[S.AVG_PREMIUM] = sum_premium / n_premium if n_premium else np.nan
+    out[S.MAX_PREMIUM] = max_premium
 
-    if pd.notna(worst_iv):
+    out[S.IV_HV_RATIO] = avg_iv / avg_hv if n_iv and n_hv else np.nan
+
+    # 風險評分特徵 - V8 使用 Basket_Worst_IV
+    if n_iv:
         # V8: 使用 worst_iv 計算 Annualized_Vol_Factor
-        features['Annualized_Vol_Factor'] = worst_iv / 100 * np.sqrt(input_data['tenor'] / 12)
+        vol_factor = worst_iv / 100 * np.sqrt(tenor / 12)
+        out[S.VOL_FACTOR] = vol_factor
 
-        if features['Annualized_Vol_Factor'] > 0:
-            features['KI_Distance_Std'] = features['KI_Distance_Pct'] / 100 / features['Annualized_Vol_Factor']
-            features['KO_Distance_Std'] = features['KO_Distance_Pct'] / 100 / features['Annualized_Vol_Factor']
-            features['KI_Distance_Std_Sorted'] = features['KI_Distance_Std']
+        if vol_factor > 0:
+            out[S.KI_DISTANCE_STD] = ki_distance_pct / 100 / vol_factor
+            out[S.KO_DISTANCE_STD] = ko_distance_pct / 100 / vol_factor
         else:
-            features['KI_Distance_Std'] = np.nan
-            features['KO_Distance_Std'] = np.nan
-            features['KI_Distance_Std_Sorted'] = np.nan
+            out[S.KI_DISTANCE_STD] = np.nan
+            out[S.KO_DISTANCE_STD] = np.nan
 
-        features['Annualized_Vol'] = features['Basket_Avg_IV'] * np.sqrt(input_data['tenor'] / 12) if pd.notna(features['Basket_Avg_IV']) else np.nan
+        out[S.ANNUALIZED_VOL] = avg_iv * np.sqrt(tenor / 12)
 
-        if pd.notna(features['Basket_Avg_Corr']) and basket_size > 1:
-            features['Corr_Adjusted_IV'] = worst_iv * (1 + 0.1 * (basket_size - 1) * (1 - features['Basket_Avg_Corr']))
+        has_corr = not np.isnan(avg_corr) and basket_size > 1
+        if has_corr:
+            out[S.CORR_ADJUSTED_IV] = worst_iv * (1 + 0.1 * (basket_size - 1) * (1 - avg_corr))
         else:
-            features['Corr_Adjusted_IV'] = worst_iv
+            out[S.CORR_ADJUSTED_IV] = worst_iv
 
         # V8: 用 worst_iv 的平均值 (約 43.5) 作為基準
         mean_worst_iv = 43.5
-        features['KI_Risk_Score'] = (worst_iv / mean_worst_iv) * (input_data['ki_barrier'] / 100)
-        features['Basket_Risk_Score'] = features['KI_Risk_Score'] * (1 + 0.2 * (basket_size - 1))
-
-        if pd.notna(features['Basket_Avg_Corr']) and basket_size > 1:
-            features['Basket_Risk_Score'] *= (1 + 0.1 * (1 - features['Basket_Avg_Corr']))
+        ki_risk_score = (worst_iv / mean_worst_iv) * (ki_barrier / 100)
+        basket_risk_score = ki_risk_score * (1 + 0.2 * (basket_size - 1))
+        if has_corr:
+            basket_risk_score *= (1 + 0.1 * (1 - avg_corr))
+        out[S.KI_RISK_SCORE] = ki_risk_score
+        out[S.BASKET_RISK_SCORE] = basket_risk_score
 
         # V8: 用 rank_1_iv 計算 Risk_Score_Sorted (如果可用)
-        if pd.notna(rank_1_iv):
+        rank_1_iv = iv_matrix[order[0], _PX_3M]
+        if not np.isnan(rank_1_iv):
             mean_rank1_iv = 52.4
-            features['Risk_Score_Sorted'] = (rank_1_iv / mean_rank1_iv) * (input_data['ki_barrier'] / 100) * (1 + 0.2 * (basket_size - 1))
+            out[S.RISK_SCORE_SORTED] = (rank_1_iv / mean_rank1_iv) * (ki_barrier / 100) * (1 + 0.2 * (basket_size - 1))
         else:
-            features['Risk_Score_Sorted'] = features['KI_Risk_Score'] * (1 + 0.2 * (basket_size - 1))
+            out[S.RISK_SCORE_SORTED] = ki_risk_score * (1 + 0.2 * (basket_size - 1))
     else:
-        for key in ['Annualized_Vol_Factor', 'KI_Distance_Std', 'KO_Distance_Std',
-                    'KI_Distance_Std_Sorted', 'Annualized_Vol', 'Corr_Adjusted_IV',
-                    'KI_Risk_Score', 'Basket_Risk_Score', 'Risk_Score_Sorted']:
-            features[key] = np.nan
+        out[S.VOL_FACTOR] = np.nan
+        out[S.KI_DISTANCE_STD] = np.nan
+        out[S.KO_DISTANCE_STD] = np.nan
+        out[S.ANNUALIZED_VOL] = np.nan
+        out[S.CORR_ADJUSTED_IV] = np.nan
+        out[S.KI_RISK_SCORE] = np.nan
+        out[S.BASKET_RISK_SCORE] = np.nan
+        out[S.RISK_SCORE_SORTED] = np.nan
 
-    features['Return_Potential'] = (input_data['ko_barrier'] / 100) * (input_data['tenor'] / 12)
+    out[S.RETURN_POTENTIAL] = (ko_barrier / 100) * (tenor / 12)
 
     # No_KO 交互特徵
-    features['No_KO_Basket_Interaction'] = features['No_KO_Flag'] * basket_size
+    out[S.NO_KO_BASKET] = no_ko * basket_size
+
+    return out
+
+
+@njit(cache=True, error_model='numpy', parallel=True)
+def _compute_features_batch_kernel(out, iv_tensor, basket_sizes, strike, ko_barrier, ki_barrier,
+                                   tenor, cost, barrier_type_aki, non_call):
+    """
+    批次特徵計算 (numba 編譯)，iv_tensor 為 (n, MAX_STOCKS, N_IV_COLS)，逐列寫入 out (n, FEATURE_BUFFER_SIZE)
+
+    各組合互不相關，以 prange 分配到多個 CPU 核心；不使用 fastmath，因為特徵需要保留 NaN 語意
+    """
+    for i in prange(iv_tensor.shape[0]):
+        _compute_features_kernel(out[i], iv_tensor[i], basket_sizes[i], strike, ko_barrier, ki_barrier,
+                                 tenor, cost, barrier_type_aki, non_call)
+    return out
+
+
+def _kernel_args(input_data: dict) -> tuple:
+    """將FCN條件整理成 kernel 使用的浮點數參數"""
+    return (
+        float(input_data['strike']), float(input_data['ko_barrier']), float(input_data['ki_barrier']),
+        float(input_data['tenor']), float(input_data['cost']),
+        1.0 if input_data['barrier_type'] == 'AKI' else 0.0,
+        float(input_data.get('non_call_periods', 1))
+    )
+
+
+def compute_features_into(out: np.ndarray, input_data: dict, iv_matrix: np.ndarray, basket_size: int) -> np.ndarray:
+    """計算所有特徵，依 FEATURE_NAMES 順序寫入 out"""
+    return _compute_features_kernel(out, iv_matrix, basket_size, *_kernel_args(input_data))
+
 
-    return pd.DataFrame([features])
+def compute_features_batch(input_data: dict, iv_tensor: np.ndarray, basket_sizes: np.ndarray) -> np.ndarray:
+    """批次計算所有組合的特徵，回傳 (n, FEATURE_BUFFER_SIZE) 矩陣 (依 FEATURE_NAMES 順序)"""
+    out = np.empty((len(iv_tensor), FEATURE_BUFFER_SIZE), dtype=np.float64)
+    return _compute_features_batch_kernel(out, iv_tensor, basket_sizes, *_kernel_args(input_data))
+
+
+def compute_features(input_data: dict, iv_data_list: list) -> np.ndarray:
+    """計算所有特徵，回傳依模型特徵順序排列的 (1, n_features) 陣列"""
+    iv_matrix, basket_size = build_iv_matrix(iv_data_list)
+    buffer = np.empty(FEATURE_BUFFER_SIZE, dtype=np.float64)
+    compute_features_into(buffer, input_data, iv_matrix, basket_size)
+    return buffer[feature_order].reshape(1, -1)
 
 
 # ============================================================================
@@ -442,8 +976,15 @@ def compute_features(input_data: dict, iv_data_list: list) -> pd.DataFrame:
 
 @app.on_event("startup")
 async def startup_event():
-    """應用啟動時載入模型"""
+    """應用啟動時載入模型和IV資料"""
     load_model()
+    refresh_available_dates()
+    preload_iv_data()
+    # 預先編譯特徵計算 kernel，避免第一個請求等待 numba 編譯
+    _compute_features_kernel(np.empty(FEATURE_BUFFER_SIZE), np.full((MAX_STOCKS, N_IV_COLS), np.nan),
+                             1, 100.0, 100.0, 70.0, 6.0, 99.0, 0.0, 1.0)
+    _compute_features_batch_kernel(np.empty((1, FEATURE_BUFFER_SIZE)), np.full((1, MAX_STOCKS, N_IV_COLS), np.nan),
+                                   np.ones(1, dtype=np.int64), 100.0, 100.0, 70.0, 6.0, 99.0, 0.0, 1.0)
 
 
 @app.get("/api/health")
@@ -465,6 +1006,7 @@ async def get_stocks():
         raise HTTPException(status_code=404, detail="沒有可用的IV資料")
 
     latest_date = dates[0]
+    await load_iv_data_async(latest_date)
     stocks = get_available_stocks(latest_date)
     return stocks
 
@@ -477,6 +1019,7 @@ async def get_market_params():
         raise HTTPException(status_code=404, detail="沒有可用的IV資料")
 
     latest_date = dates[0]
+    await load_iv_data_async(latest_date)
     market_data = get_market_indices(latest_date)
     return market_data
 
@@ -489,13 +1032,13 @@ async def get_stock_details(request: StockDetailsRequest):
         raise HTTPException(status_code=404, detail="沒有可用的IV資料")
 
     latest_date = dates[0]
-    df_iv = load_iv_data(latest_date)
+    await load_iv_data_async(latest_date)
+    iv_rows = get_iv_rows(latest_date)
 
     results = []
     for symbol in request.symbols:
-        stock_data = df_iv[df_iv['BBG_Code'] == symbol]
-        if len(stock_data) > 0:
-            row = stock_data.iloc[0]
+        row = iv_rows.get(symbol)
+        if row is not None:
             results.append({
                 'symbol': symbol,
                 'currentPrice': safe_float(row['PX_LAST']),
@@ -513,11 +1056,7 @@ async def calculate_fcn(request: FCNRequest):
         raise HTTPException(status_code=500, detail="模型未載入")
 
     # 取得定價日期
-    dates = get_available_dates()
-    if not dates:
-        raise HTTPException(status_code=404, detail="沒有可用的IV資料")
-
-    pricing_date = request.pricingDate if request.pricingDate else dates[0]
+    pricing_date = resolve_pricing_date(request.pricingDate)
 
     # 驗證輸入
     if request.knockInPrice >= request.strikePrice:
@@ -527,17 +1066,19 @@ async def calculate_fcn(request: FCNRequest):
 
     try:
         # 載入IV資料
-        df_iv = load_iv_data(pricing_date)
+        await load_iv_data_async(pricing_date)
+        iv_rows = get_iv_rows(pricing_date)
+
+        code_to_row, stock_matrix = get_iv_matrix(pricing_date)
 
-        # 取得各標的的IV資料
-        iv_data_list = []
+        # 取得各標的在 IV 數值矩陣中的列索引
+        stock_rows = []
         stock_info = {}
 
         for bbg in request.stocks:
-            stock_data = df_iv[df_iv['BBG_Code'] == bbg]
-            if len(stock_data) > 0:
-                row = stock_data.iloc[0].to_dict()
-                iv_data_list.append(row)
+            row = iv_rows.get(bbg)
+            if row is not None:
+                stock_rows.append(code_to_row[bbg])
                 stock_info[bbg] = {
                     'price': safe_float(row['PX_LAST']),
                     'put_iv_3m': safe_float(row['PUT_IMP_VOL_3M']),
@@ -546,12 +1087,11 @@ async def calculate_fcn(request: FCNRequest):
             else:
                 raise HTTPException(status_code=400, detail=f"找不到股票 {bbg} 的IV資料")
 
-        # 按PUT_IMP_VOL_3M降冪排序
-        iv_data_list.sort(key=lambda x: x.get('PUT_IMP_VOL_3M', 0) or 0, reverse=True)
-
-        # 填補到4個 (支援最多4檔股票)
-        while len(iv_data_list) < 4:
-            iv_data_list.append(None)
+        # 按PUT_IMP_VOL_3M降冪排序，直接從數值矩陣取出各列 (沒有標的的列維持 NaN)
+        iv_3m = stock_matrix[:, IV_IDX['PUT_IMP_VOL_3M']]
+        stock_rows.sort(key=lambda r: iv_3m[r] or 0, reverse=True)
+        iv_matrix = np.full((MAX_STOCKS, N_IV_COLS), np.nan)
+        iv_matrix[:len(stock_rows)] = stock_matrix[stock_rows]
 
         # 準備輸入資料
         non_call = request.nonCallPeriods if request.nonCallPeriods else 1
@@ -568,16 +1108,13 @@ async def calculate_fcn(request: FCNRequest):
             'non_call_periods': non_call
         }
 
-        # 計算特徵
-        features_df = compute_features(input_data, iv_data_list)
-
-        # 確保特徵順序正確
-        X = features_df.reindex(columns=feature_cols)
+        # 計算特徵 (依模型特徵順序取出欄位)
+        buffer = np.empty(FEATURE_BUFFER_SIZE, dtype=np.float64)
+        compute_features_into(buffer, input_data, iv_matrix, len(stock_rows))
+        X = buffer[feature_order].reshape(1, -1)
 
-        # 預測
-        predicted_coupon = safe_float(model.predict(X)[0])
-        if predicted_coupon is None:
-            predicted_coupon = 0.0
+        # 預測 (相同特徵直接使用快取結果)
+        predicted_coupon = predict_row_cached(X.tobytes())
 
         return FCNResponse(
             annualized_yield=predicted_coupon,
@@ -623,8 +1160,6 @@ async def upload_iv_data(file: UploadFile = File(...)):
     上傳 IV 資料檔案 (xlsx 格式)
     檔案名稱必須是日期格式，例如 20251212.xlsx
     """
-    global iv_cache, market_indices_cache
-
     # 驗證檔案類型
     if not file.filename.endswith('.xlsx'):
         raise HTTPException(status_code=400, detail="只接受 .xlsx 格式的檔案")
@@ -643,31 +1178,39 @@ async def upload_iv_data(file: UploadFile = File(...)):
     except ValueError:
         raise HTTPException(status_code=400, detail="無效的日期格式")
 
+    # 不是 xlsx 的檔案直接拒絕，不寫入磁碟
+    try:
+        await asyncio.to_thread(check_xlsx_upload, file.file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"檔案格式錯誤: {str(e)}")
+
     # 確保目錄存在
     os.makedirs(IV_DATA_PATH, exist_ok=True)
 
-    # 儲存檔案
+    # 儲存檔案 (在背景執行緒複製，不阻塞 event loop；同一日期的載入會等待寫入完成)
     file_path = os.path.join(IV_DATA_PATH, file.filename)
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        async with iv_load_lock(filename_without_ext):
+            await asyncio.to_thread(save_upload_file, file.file, file_path)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"儲存檔案失敗: {str(e)}")
 
-    # 清除快取以載入新資料
-    if filename_without_ext in iv_cache:
-        del iv_cache[filename_without_ext]
-    if filename_without_ext in market_indices_cache:
-        del market_indices_cache[filename_without_ext]
+    # 清除快取以載入新資料 (舊的 Parquet 也要移除)
+    parquet_file = iv_parquet_path(filename_without_ext)
+    if os.path.exists(parquet_file):
+        os.remove(parquet_file)
+    clear_iv_cache()
 
     # 驗證檔案可以正確載入
     try:
-        df_iv = load_iv_data(filename_without_ext)
+        await load_iv_data_async(filename_without_ext)
         stocks = get_available_stocks(filename_without_ext)
         stock_count = len(stocks)
+        refresh_available_dates()
     except Exception as e:
         # 如果載入失敗，刪除檔案
         os.remove(file_path)
+        refresh_available_dates()
         raise HTTPException(status_code=400, detail=f"檔案格式錯誤: {str(e)}")
 
     return {
@@ -682,26 +1225,27 @@ async def upload_iv_data(file: UploadFile = File(...)):
 @app.delete("/api/iv-data/{date}")
 async def delete_iv_data(date: str):
     """刪除指定日期的 IV 資料"""
-    global iv_cache, market_indices_cache
-
     # 驗證日期格式
     if not re.match(r'^\d{8}$', date):
         raise HTTPException(status_code=400, detail="無效的日期格式")
 
-    file_path = os.path.join(IV_DATA_PATH, f"{date}.xlsx")
+    file_path = iv_excel_path(date)
 
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="找不到該日期的資料")
+    # 與同一日期的上傳、載入互斥，避免載入中的資料在刪除後寫回 Parquet 或快取
+    async with iv_load_lock(date):
+        if not os.path.exists(file_path):
+            raise HTTPException(status_code=404, detail="找不到該日期的資料")
 
-    try:
-        os.remove(file_path)
-        # 清除快取
-        if date in iv_cache:
-            del iv_cache[date]
-        if date in market_indices_cache:
-            del market_indices_cache[date]
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"刪除失敗: {str(e)}")
+        try:
+            os.remove(file_path)
+            parquet_file = iv_parquet_path(date)
+            if os.path.exists(parquet_file):
+                os.remove(parquet_file)
+            # 清除快取
+            clear_iv_cache()
+            refresh_available_dates()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"刪除失敗: {str(e)}")
 
     return {
         "message": "刪除成功",
@@ -714,10 +1258,202 @@ async def delete_iv_data(date: str):
 # 批次報價 API (AI 智慧詢價)
 # ============================================================================
 
-from itertools import combinations as iter_combinations
+from itertools import chain, combinations as iter_combinations
+
+
+def build_combo_tensor(pool_matrix: np.ndarray, basket_sizes: list) -> tuple:
+    """
+    產生股票池所有 C(n, k) 組合的 IV 資料
+
+    pool_matrix 為股票池各檔的 IV 數值矩陣 (n, N_IV_COLS)；
+    回傳 (組合的股票池索引 (組合數, MAX_STOCKS)，依 PUT_IMP_VOL_3M 降冪排序、不足補 -1,
+          IV 資料 (組合數, MAX_STOCKS, N_IV_COLS)，不足的列為 NaN,
+          各組合標的數)
+    """
+    n = len(pool_matrix)
+    iv_3m = pool_matrix[:, IV_IDX['PUT_IMP_VOL_3M']]
+    iv_3m_list = iv_3m.tolist()
+    blocks = []
+    for k in basket_sizes:
+        if k > n:
+            continue
+        # itertools.combinations 產生的整數直接寫入預先配置大小的陣列
+        combos = np.fromiter(chain.from_iterable(iter_combinations(range(n), k)), dtype=np.intp,
+                             count=math.comb(n, k) * k).reshape(-1, k)
+
+        # 按 PUT_IMP_VOL_3M 降冪排序 (穩定排序，同值維持股票池順序)
+        keys = iv_3m[combos]
+        sorted_combos = np.take_along_axis(combos, np.argsort(-keys, axis=1, kind='stable'), axis=1)
+
+        # 含 NaN 的組合改用 Python sorted 排序，與單筆報價的順序一致
+        for i in np.flatnonzero(np.isnan(keys).any(axis=1)):
+            sorted_combos[i] = sorted(combos[i].tolist(), key=iv_3m_list.__getitem__, reverse=True)
+        combos = sorted_combos
+
+        padded = np.full((len(combos), MAX_STOCKS), -1, dtype=np.intp)
+        padded[:, :k] = combos
+        blocks.append(padded)
+
+    combo_index = np.concatenate(blocks) if blocks else np.empty((0, MAX_STOCKS), dtype=np.intp)
+
+    # 最後一列補 NaN，讓索引 -1 取到空白標的
+    padded_matrix = np.vstack([pool_matrix, np.full((1, pool_matrix.shape[1]), np.nan)])
+    iv_tensor = padded_matrix[combo_index]
+    basket_sizes_arr = (combo_index >= 0).sum(axis=1)
+    return combo_index, iv_tensor, basket_sizes_arr
+
+
+def compute_batch_quotes(request: BatchFCNRequest, pricing_date: str, valid_sizes: list) -> dict:
+    """
+    計算批次報價的所有組合 (特徵計算 + 模型預測皆為 CPU 運算)
+
+    由 render_batch_quotes 在背景執行緒中呼叫，避免阻塞事件迴圈
+    """
+    iv_rows = get_iv_rows(pricing_date)
+    code_to_row, stock_matrix = get_iv_matrix(pricing_date)
+
+    # 取得所有股票的IV資料
+    stock_iv_data = {}
+    stock_info = {}
+
+    for bbg in request.stockPool:
+        row = iv_rows.get(bbg)
+        if row is not None:
+            stock_iv_data[bbg] = row
+            stock_info[bbg] = {
+                'price': safe_float(row['PX_LAST']),
+                'put_iv_3m': safe_float(row['PUT_IMP_VOL_3M']),
+                'vol_90d': safe_float(row['VOLATILITY_90D'])
+            }
+
+    # 只使用有IV資料的股票
+    valid_stocks = list(stock_iv_data.keys())
+    if len(valid_stocks) == 0:
+        raise HTTPException(status_code=400, detail="股票池中沒有可用的IV資料")
+
+    # 準備基礎輸入資料
+    non_call = request.nonCallPeriods if request.nonCallPeriods else 1
+    non_call = min(non_call, request.period)
+
+    base_input = {
+        'strike': request.strikePrice,
+        'ko_barrier': request.knockOutPrice,
+        'ki_barrier': request.knockInPrice,
+        'tenor': request.period,
+        'cost': request.customFeeRate,
+        'barrier_type': request.kiType,
+        'non_call_periods': non_call
+    }
+
+    # 產生所有 C(n, k) 組合，一次計算全部組合的特徵
+    pool_matrix = stock_matrix[[code_to_row[s] for s in valid_stocks]]
+    combo_index, iv_tensor, basket_sizes = build_combo_tensor(pool_matrix, valid_sizes)
+    X_buffer = compute_features_batch(base_input, iv_tensor, basket_sizes)
+
+    # 所有組合一次預測 (依模型特徵順序取出欄位)
+    # 股票池中有 IV 資料完全相同的股票時，不同組合可能得到相同特徵，只預測不重複的列
+    if not len(combo_index):
+        predictions = []
+    elif has_duplicate_rows(pool_matrix):
+        predictions = predict_unique_coupons(X_buffer[:, feature_order]).tolist()
+    else:
+        predictions = predict_coupons(X_buffer[:, feature_order]).tolist()
+
+    # 組合內的股票維持股票池順序
+    pool_order = np.sort(np.where(combo_index < 0, len(valid_stocks), combo_index), axis=1)
+    stock_names = np.array(valid_stocks + [None], dtype=object)
+    combos = [row[:size] for row, size in zip(stock_names[pool_order].tolist(), basket_sizes.tolist())]
+
+    # 距KI距離與風險等級只取決於FCN條件，所有組合相同
+    distance_to_ki = round(request.strikePrice - request.knockInPrice, 1)
+    if request.knockInPrice < 60 and request.strikePrice > 85:
+        risk_level = "low"
+    elif request.knockInPrice > 70 or request.strikePrice < 70:
+        risk_level = "high"
+    else:
+        risk_level = "medium"
+
+    # 各組合內最高的 3M IV (沒有資料視為 0，補位的索引對應 -inf 不影響最大值)
+    put_iv_3m = np.array([stock_info[s]['put_iv_3m'] or 0 for s in valid_stocks] + [-np.inf])
+    max_ivs = put_iv_3m[pool_order].max(axis=1).tolist()
+
+    quotes = []
+    for quote_id, (combo_list, predicted_coupon, max_iv) in enumerate(zip(combos, predictions, max_ivs)):
+        quotes.append({
+            'id': f"quote-{quote_id}",
+            'stocks': combo_list,
+            'basketSize': len(combo_list),
+            'couponRate': round(predicted_coupon, 2),
+            'distanceToKI': distance_to_ki,
+            'maxIV': round(max_iv, 1) if max_iv else None,
+            'riskLevel': risk_level,
+            'stockInfo': {s: stock_info[s] for s in combo_list}
+        })
+
+    # 按 couponRate 降冪排序
+    quotes.sort(key=lambda x: x['couponRate'], reverse=True)
+
+    # 計算 yieldBoost (相對於單一標的的增益)
+    avg_coupon_by_size = {}
+    for size in valid_sizes:
+        size_quotes = [q for q in quotes if q['basketSize'] == size]
+        if size_quotes:
+            avg_coupon_by_size[size] = sum(q['couponRate'] for q in size_quotes) / len(size_quotes)
+
+    min_size = min(valid_sizes)
+    for quote in quotes:
+        if quote['basketSize'] > min_size and min_size in avg_coupon_by_size:
+            quote['yieldBoost'] = round(
+                avg_coupon_by_size.get(quote['basketSize'], 0) - avg_coupon_by_size[min_size],
+                2
+            )
+        else:
+            quote['yieldBoost'] = None
+
+    return {
+        'quotes': quotes,
+        'totalCount': len(quotes),
+        'pricingDate': pricing_date,
+        'params': {
+            'period': request.period,
+            'strikePrice': request.strikePrice,
+            'knockOutPrice': request.knockOutPrice,
+            'knockInPrice': request.knockInPrice,
+            'kiType': request.kiType,
+            'nonCallPeriods': non_call,
+            'noKO': non_call == request.period
+        },
+        'marketParams': get_market_indices(pricing_date)
+    }
+
+
+
+def batch_etag(request: BatchFCNRequest, pricing_date: str) -> str:
+    """批次報價的 ETag：由模型版本、定價日期、IV 檔案版本 (修改時間與大小) 與請求內容決定"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (model_stamp, pricing_date.encode(), file_stamp(iv_excel_path(pricing_date)),
+                 request.model_dump_json().encode()):
+        digest.update(part)
+        digest.update(b'\0')
+    return f'"{digest.hexdigest()}"'
+
+
+def render_batch_quotes(request: BatchFCNRequest, pricing_date: str, valid_sizes: list) -> bytes:
+    """計算批次報價並轉為 JSON (與 FastAPI 預設的 JSONResponse 輸出相同)"""
+    result = compute_batch_quotes(request, pricing_date, valid_sizes)
+    return json.dumps(result, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode('utf-8')
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """檢查 If-None-Match 是否包含目前的 ETag (POST 請求不把 '*' 視為符合)"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return etag in tags or f'W/{etag}' in tags
+
 
 @app.post("/api/fcn/batch-calculate")
-async def batch_calculate_fcn(request: BatchFCNRequest):
+async def batch_calculate_fcn(request: BatchFCNRequest, http_request: Request):
     """
     批次計算 FCN 收益率 - 用於 AI 智慧詢價
     根據股票池和組合大小，產生所有排列組合的報價
@@ -726,11 +1462,7 @@ async def batch_calculate_fcn(request: BatchFCNRequest):
         raise HTTPException(status_code=500, detail="模型未載入")
 
     # 取得定價日期
-    dates = get_available_dates()
-    if not dates:
-        raise HTTPException(status_code=404, detail="沒有可用的IV資料")
-
-    pricing_date = request.pricingDate if request.pricingDate else dates[0]
+    pricing_date = resolve_pricing_date(request.pricingDate)
 
     # 驗證輸入
     if request.knockInPrice >= request.strikePrice:
@@ -744,135 +1476,24 @@ async def batch_calculate_fcn(request: BatchFCNRequest):
         raise HTTPException(status_code=400, detail="組合大小必須在1-4之間")
 
     try:
-        # 載入IV資料
-        df_iv = load_iv_data(pricing_date)
-
-        # 取得所有股票的IV資料
-        stock_iv_data = {}
-        stock_info = {}
-
-        for bbg in request.stockPool:
-            stock_data = df_iv[df_iv['BBG_Code'] == bbg]
-            if len(stock_data) > 0:
-                row = stock_data.iloc[0].to_dict()
-                stock_iv_data[bbg] = row
-                stock_info[bbg] = {
-                    'price': safe_float(row['PX_LAST']),
-                    'put_iv_3m': safe_float(row['PUT_IMP_VOL_3M']),
-                    'vol_90d': safe_float(row['VOLATILITY_90D'])
-                }
-
-        # 只使用有IV資料的股票
-        valid_stocks = list(stock_iv_data.keys())
-        if len(valid_stocks) == 0:
-            raise HTTPException(status_code=400, detail="股票池中沒有可用的IV資料")
-
-        # 準備基礎輸入資料
-        non_call = request.nonCallPeriods if request.nonCallPeriods else 1
-        non_call = min(non_call, request.period)
+        # 載入IV資料後，在執行緒中計算所有組合，計算期間仍可處理其他請求
+        await load_iv_data_async(pricing_date)
 
-        base_input = {
-            'strike': request.strikePrice,
-            'ko_barrier': request.knockOutPrice,
-            'ki_barrier': request.knockInPrice,
-            'tenor': request.period,
-            'cost': request.customFeeRate,
-            'barrier_type': request.kiType,
-            'non_call_periods': non_call
-        }
+        # 模型預測結果固定，相同模型、相同日期、相同 IV 檔案與相同條件的請求直接回傳上次的結果
+        etag = batch_etag(request, pricing_date)
+        if etag_matches(http_request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers={'ETag': etag})
 
-        # 產生所有組合並計算
-        quotes = []
-        quote_id = 0
-
-        for basket_size in valid_sizes:
-            if basket_size > len(valid_stocks):
-                continue
-
-            # 產生所有 C(n, k) 組合
-            for combo in iter_combinations(valid_stocks, basket_size):
-                combo_list = list(combo)
-
-                # 取得這個組合的 IV 資料
-                iv_data_list = [stock_iv_data[s] for s in combo_list]
-
-                # 按 PUT_IMP_VOL_3M 降冪排序
-                iv_data_list.sort(key=lambda x: x.get('PUT_IMP_VOL_3M', 0) or 0, reverse=True)
-
-                # 填補到4個
-                while len(iv_data_list) < 4:
-                    iv_data_list.append(None)
-
-                # 計算特徵
-                features_df = compute_features(base_input, iv_data_list)
-
-                # 確保特徵順序正確
-                X = features_df.reindex(columns=feature_cols)
-
-                # 預測
-                predicted_coupon = safe_float(model.predict(X)[0])
-                if predicted_coupon is None:
-                    predicted_coupon = 0.0
-
-                # 計算距KI距離 (使用最高IV股票)
-                max_iv = max([stock_info[s]['put_iv_3m'] or 0 for s in combo_list])
-                distance_to_ki = request.strikePrice - request.knockInPrice
-
-                # 決定風險等級
-                if request.knockInPrice < 60 and request.strikePrice > 85:
-                    risk_level = "low"
-                elif request.knockInPrice > 70 or request.strikePrice < 70:
-                    risk_level = "high"
-                else:
-                    risk_level = "medium"
-
-                quotes.append({
-                    'id': f"quote-{quote_id}",
-                    'stocks': combo_list,
-                    'basketSize': basket_size,
-                    'couponRate': round(predicted_coupon, 2),
-                    'distanceToKI': round(distance_to_ki, 1),
-                    'maxIV': round(max_iv, 1) if max_iv else None,
-                    'riskLevel': risk_level,
-                    'stockInfo': {s: stock_info[s] for s in combo_list}
-                })
-                quote_id += 1
-
-        # 按 couponRate 降冪排序
-        quotes.sort(key=lambda x: x['couponRate'], reverse=True)
-
-        # 計算 yieldBoost (相對於單一標的的增益)
-        avg_coupon_by_size = {}
-        for size in valid_sizes:
-            size_quotes = [q for q in quotes if q['basketSize'] == size]
-            if size_quotes:
-                avg_coupon_by_size[size] = sum(q['couponRate'] for q in size_quotes) / len(size_quotes)
-
-        min_size = min(valid_sizes)
-        for quote in quotes:
-            if quote['basketSize'] > min_size and min_size in avg_coupon_by_size:
-                quote['yieldBoost'] = round(
-                    avg_coupon_by_size.get(quote['basketSize'], 0) - avg_coupon_by_size[min_size],
-                    2
-                )
-            else:
-                quote['yieldBoost'] = None
-
-        return {
-            'quotes': quotes,
-            'totalCount': len(quotes),
-            'pricingDate': pricing_date,
-            'params': {
-                'period': request.period,
-                'strikePrice': request.strikePrice,
-                'knockOutPrice': request.knockOutPrice,
-                'knockInPrice': request.knockInPrice,
-                'kiType': request.kiType,
-                'nonCallPeriods': non_call,
-                'noKO': non_call == request.period
-            },
-            'marketParams': get_market_indices(pricing_date)
-        }
+        body = batch_response_cache.get(etag)
+        if body is not None:
+            batch_response_cache.move_to_end(etag)
+        else:
+            # 回應有上千筆報價，在執行緒中一併轉成 JSON，快取命中時也不需要重新序列化
+            body = await asyncio.to_thread(render_batch_quotes, request, pricing_date, valid_sizes)
+            batch_response_cache[etag] = body
+            if len(batch_response_cache) > BATCH_RESPONSE_CACHE_SIZE:
+                batch_response_cache.popitem(last=False)
+        return Response(content=body, media_type='application/json', headers={'ETag': etag})
 
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -1,12 +1,24 @@
+import os
+import sys
+import warnings
 import pandas as pd
 import numpy as np
 
+from corr_utils import coupon_corr
+
+# 加上 --excel 參數時，另外輸出 xlsx 供人工檢查
+WRITE_EXCEL = '--excel' in sys.argv
+
 print("=" * 80)
 print("FCN 特徵工程")
 print("=" * 80)
 
 # 讀取前處理後的有效資料
-df = pd.read_excel('FCN_preprocessed_valid.xlsx')
+# 優先讀取 data_preprocessing.py 輸出的 Parquet
+if os.path.exists('FCN_preprocessed_valid.parquet'):
+    df = pd.read_parquet('FCN_preprocessed_valid.parquet')
+else:
+    df = pd.read_excel('FCN_preprocessed_valid.xlsx')
 print(f"\n原始資料形狀: {df.shape}")
 
 # ============================================================================
@@ -28,11 +40,11 @@ print(df[['Cost (%)', 'Tenor (m)', 'Fee', 'Annualized_Fee', 'Coupon']].describe(
 
 print("\n【年化費用範例】")
 print("\n短期 FCN (3個月):")
-short_term = df[df['Tenor (m)'] == 3][['Cost (%)', 'Tenor (m)', 'Fee', 'Annualized_Fee', 'Coupon']].head(3)
+short_term = df.loc[df['Tenor (m)'] == 3, ['Cost (%)', 'Tenor (m)', 'Fee', 'Annualized_Fee', 'Coupon']].head(3)
 print(short_term)
 
 print("\n長期 FCN (12個月):")
-long_term = df[df['Tenor (m)'] == 12][['Cost (%)', 'Tenor (m)', 'Fee', 'Annualized_Fee', 'Coupon']].head(3)
+long_term = df.loc[df['Tenor (m)'] == 12, ['Cost (%)', 'Tenor (m)', 'Fee', 'Annualized_Fee', 'Coupon']].head(3)
 print(long_term)
 
 # 計算相關性
@@ -68,7 +80,7 @@ barrier_features = ['KO_Strike_Distance', 'Strike_KI_Distance', 'KO_KI_Range',
 print(df[barrier_features].describe())
 
 print("\n【障礙價特徵與Coupon的相關性】")
-barrier_corr = df[barrier_features + ['Coupon']].corr()['Coupon'].sort_values(ascending=False)
+barrier_corr = coupon_corr(df, barrier_features + ['Coupon']).sort_values(ascending=False)
 print(barrier_corr)
 
 # ============================================================================
@@ -78,24 +90,32 @@ print("\n" + "=" * 80)
 print("3. 波動率相關特徵")
 print("=" * 80)
 
-# 3.1 多標的平均波動率
-# 對於有多個標的的情況，計算平均隱含波動率
-df['Avg_IV_3M'] = df[['PUT_IMP_VOL_3M', 'PUT_IMP_VOL_3M_2', 'PUT_IMP_VOL_3M_3']].mean(axis=1, skipna=True)
-df['Avg_Historical_Vol_90D'] = df[['VOLATILITY_90D', 'VOLATILITY_90D_2', 'VOLATILITY_90D_3']].mean(axis=1, skipna=True)
+# 各組多標的欄位只取出一次，平均/最大/最小值都由同一個陣列計算 (忽略缺值，全部缺值時為 NaN)
+iv_3m = df[['PUT_IMP_VOL_3M', 'PUT_IMP_VOL_3M_2', 'PUT_IMP_VOL_3M_3']].to_numpy(dtype=np.float64)
+hv_90d = df[['VOLATILITY_90D', 'VOLATILITY_90D_2', 'VOLATILITY_90D_3']].to_numpy(dtype=np.float64)
+corr_coef = df[['CORR_COEF', 'CORR_COEF_2', 'CORR_COEF_3']].to_numpy(dtype=np.float64)
+
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore', RuntimeWarning)  # 全部缺值的列
+
+    # 3.1 多標的平均波動率
+    # 對於有多個標的的情況，計算平均隱含波動率
+    df['Avg_IV_3M'] = np.nanmean(iv_3m, axis=1)
+    df['Avg_Historical_Vol_90D'] = np.nanmean(hv_90d, axis=1)
 
-# 3.2 最大/最小波動率 (worst case)
-df['Max_IV_3M'] = df[['PUT_IMP_VOL_3M', 'PUT_IMP_VOL_3M_2', 'PUT_IMP_VOL_3M_3']].max(axis=1, skipna=True)
-df['Min_IV_3M'] = df[['PUT_IMP_VOL_3M', 'PUT_IMP_VOL_3M_2', 'PUT_IMP_VOL_3M_3']].min(axis=1, skipna=True)
+    # 3.2 最大/最小波動率 (worst case)
+    df['Max_IV_3M'] = np.nanmax(iv_3m, axis=1)
+    df['Min_IV_3M'] = np.nanmin(iv_3m, axis=1)
 
-# 3.3 波動率差異 (標的間的波動率分散度)
-df['IV_Spread'] = df['Max_IV_3M'] - df['Min_IV_3M']
+    # 3.3 波動率差異 (標的間的波動率分散度)
+    df['IV_Spread'] = df['Max_IV_3M'] - df['Min_IV_3M']
 
-# 3.4 隱含波動率 vs 歷史波動率比例
-df['IV_HV_Ratio'] = df['Avg_IV_3M'] / df['Avg_Historical_Vol_90D']
+    # 3.4 隱含波動率 vs 歷史波動率比例
+    df['IV_HV_Ratio'] = df['Avg_IV_3M'] / df['Avg_Historical_Vol_90D']
 
-# 3.5 最大相關係數 (標的間的相關性)
-df['Max_Correlation'] = df[['CORR_COEF', 'CORR_COEF_2', 'CORR_COEF_3']].max(axis=1, skipna=True)
-df['Min_Correlation'] = df[['CORR_COEF', 'CORR_COEF_2', 'CORR_COEF_3']].min(axis=1, skipna=True)
+    # 3.5 最大相關係數 (標的間的相關性)
+    df['Max_Correlation'] = np.nanmax(corr_coef, axis=1)
+    df['Min_Correlation'] = np.nanmin(corr_coef, axis=1)
 
 print("\n【波動率特徵統計】")
 vol_features = ['Avg_IV_3M', 'Avg_Historical_Vol_90D', 'Max_IV_3M', 'Min_IV_3M',
@@ -103,7 +123,7 @@ vol_features = ['Avg_IV_3M', 'Avg_Historical_Vol_90D', 'Max_IV_3M', 'Min_IV_3M',
 print(df[vol_features].describe())
 
 print("\n【波動率特徵與Coupon的相關性】")
-vol_corr = df[vol_features + ['Coupon']].corr()['Coupon'].sort_values(ascending=False)
+vol_corr = coupon_corr(df, vol_features + ['Coupon']).sort_values(ascending=False)
 print(vol_corr)
 
 # ============================================================================
@@ -126,7 +146,7 @@ tenor_features = ['NonCall_Ratio', 'Annualized_Vol']
 print(df[tenor_features].describe())
 
 print("\n【期限特徵與Coupon的相關性】")
-tenor_corr = df[tenor_features + ['Coupon']].corr()['Coupon'].sort_values(ascending=False)
+tenor_corr = coupon_corr(df, tenor_features + ['Coupon']).sort_values(ascending=False)
 print(tenor_corr)
 
 # ============================================================================
@@ -148,7 +168,7 @@ risk_features = ['KI_Risk_Score', 'Return_Potential']
 print(df[risk_features].describe())
 
 print("\n【風險評分與Coupon的相關性】")
-risk_corr = df[risk_features + ['Coupon']].corr()['Coupon'].sort_values(ascending=False)
+risk_corr = coupon_corr(df, risk_features + ['Coupon']).sort_values(ascending=False)
 print(risk_corr)
 
 # ============================================================================
@@ -200,8 +220,10 @@ print("\n" + "=" * 80)
 print("8. 儲存資料")
 print("=" * 80)
 
-output_file = 'FCN_engineered_features.xlsx'
-df.to_excel(output_file, index=False)
+output_file = 'FCN_engineered_features.parquet'
+df.to_parquet(output_file, engine='pyarrow', compression='zstd', index=False)
+if WRITE_EXCEL:
+    df.to_excel('FCN_engineered_features.xlsx', index=False)
 print(f"\n特徵工程完成！")
 print(f"資料已儲存至: {output_file}")
 print(f"最終形狀: {df.shape}")
@@ -220,7 +242,7 @@ exclude_cols = ['Coupon', 'Coupon_Valid', 'Coupon p.a. (%)']
 feature_cols = [col for col in numeric_features if col not in exclude_cols]
 
 # 計算與Coupon的相關性
-correlations = df[feature_cols + ['Coupon']].corr()['Coupon'].drop('Coupon')
+correlations = coupon_corr(df, feature_cols + ['Coupon']).drop('Coupon')
 correlations_abs = correlations.abs().sort_values(ascending=False)
 
 print("\n【絕對值相關性 Top 20】")
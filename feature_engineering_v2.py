@@ -1,12 +1,23 @@
+import os
+import sys
 import pandas as pd
 import numpy as np
 
+from corr_utils import coupon_corr
+
+# 加上 --excel 參數時，另外輸出 xlsx 供人工檢查
+WRITE_EXCEL = '--excel' in sys.argv
+
 print("=" * 80)
 print("FCN 特徵工程 V2 - 進階特徵")
 print("=" * 80)
 
 # 讀取已處理的資料
-df = pd.read_excel('FCN_basket_handled.xlsx')
+# 優先讀取 handle_variable_basket.py 輸出的 Parquet
+if os.path.exists('FCN_basket_handled.parquet'):
+    df = pd.read_parquet('FCN_basket_handled.parquet')
+else:
+    df = pd.read_excel('FCN_basket_handled.xlsx')
 print(f"\n原始資料形狀: {df.shape}")
 
 # ============================================================================
@@ -36,18 +47,20 @@ time_features = ['Tenor (m)', 'Tenor_Sqrt', 'Tenor_Squared',
 print(df[time_features].describe())
 
 print("\n【時間價值特徵與Coupon的相關性】")
-time_corr = df[time_features + ['Coupon']].corr()['Coupon'].sort_values(ascending=False)
+time_corr = coupon_corr(df, time_features + ['Coupon']).sort_values(ascending=False)
 print(time_corr)
 
 print("\n【Callable_Ratio範例】")
 print("短Non-call (1個月) + 長Tenor (12個月):")
-example1 = df[(df['Non-call Periods (m)'] == 1) & (df['Tenor (m)'] == 12)][
+example1 = df.loc[
+    (df['Non-call Periods (m)'] == 1) & (df['Tenor (m)'] == 12),
     ['Tenor (m)', 'Non-call Periods (m)', 'Callable_Period', 'Callable_Ratio', 'Coupon']
 ].head(3)
 print(example1)
 
 print("\n長Non-call (3個月) + 短Tenor (3個月):")
-example2 = df[(df['Non-call Periods (m)'] == 3) & (df['Tenor (m)'] == 3)][
+example2 = df.loc[
+    (df['Non-call Periods (m)'] == 3) & (df['Tenor (m)'] == 3),
     ['Tenor (m)', 'Non-call Periods (m)', 'Callable_Period', 'Callable_Ratio', 'Coupon']
 ].head(3)
 print(example2)
@@ -89,7 +102,7 @@ barrier_std_features = ['KI_Distance_Pct', 'KI_Distance_Std',
 print(df[barrier_std_features].describe())
 
 print("\n【標準化距離與Coupon的相關性】")
-barrier_std_corr = df[barrier_std_features + ['Coupon']].corr()['Coupon'].sort_values(ascending=False)
+barrier_std_corr = coupon_corr(df, barrier_std_features + ['Coupon']).sort_values(ascending=False)
 print(barrier_std_corr)
 
 print("\n【標準化的效果驗證】")
@@ -100,7 +113,8 @@ high_iv_mask = df['Basket_Worst_IV'] > df['Basket_Worst_IV'].quantile(0.75)
 low_ki_dist_mask = df['KI_Distance_Pct'] < df['KI_Distance_Pct'].quantile(0.25)
 
 print("\n高波動 + 小KI距離 (高風險):")
-high_risk = df[high_iv_mask & low_ki_dist_mask][
+high_risk = df.loc[
+    high_iv_mask & low_ki_dist_mask,
     ['Basket_Worst_IV', 'KI_Distance_Pct', 'KI_Distance_Std', 'Coupon']
 ].head(3)
 print(high_risk)
@@ -110,7 +124,8 @@ low_iv_mask = df['Basket_Worst_IV'] < df['Basket_Worst_IV'].quantile(0.25)
 high_ki_dist_mask = df['KI_Distance_Pct'] > df['KI_Distance_Pct'].quantile(0.75)
 
 print("\n低波動 + 大KI距離 (低風險):")
-low_risk = df[low_iv_mask & high_ki_dist_mask][
+low_risk = df.loc[
+    low_iv_mask & high_ki_dist_mask,
     ['Basket_Worst_IV', 'KI_Distance_Pct', 'KI_Distance_Std', 'Coupon']
 ].head(3)
 print(low_risk)
@@ -139,29 +154,21 @@ df['IV_Skew_2'] = df['PUT_IMP_VOL_2M_25D_2'] - df['CALL_IMP_VOL_2M_25D_2']
 # 標的3的Skew
 df['IV_Skew_3'] = df['PUT_IMP_VOL_2M_25D_3'] - df['CALL_IMP_VOL_2M_25D_3']
 
-# 3.2 Basket層級的IV Skew聚合
-def safe_mean(row, cols):
-    values = [row[col] for col in cols if pd.notna(row[col])]
-    return np.mean(values) if values else np.nan
-
-def safe_max(row, cols):
-    values = [row[col] for col in cols if pd.notna(row[col])]
-    return max(values) if values else np.nan
-
+# 3.2 Basket層級的IV Skew聚合 (忽略缺值的標的，全部缺值時為 NaN)
 skew_cols = ['IV_Skew_1', 'IV_Skew_2', 'IV_Skew_3']
 
 # 平均Skew
-df['Basket_Avg_Skew'] = df.apply(lambda row: safe_mean(row, skew_cols), axis=1)
+df['Basket_Avg_Skew'] = df[skew_cols].mean(axis=1, skipna=True)
 
 # 最大Skew (最悲觀的標的)
-df['Basket_Max_Skew'] = df.apply(lambda row: safe_max(row, skew_cols), axis=1)
+df['Basket_Max_Skew'] = df[skew_cols].max(axis=1, skipna=True)
 
 print("\n【IV Skew統計】")
 skew_features = ['IV_Skew_1', 'IV_Skew_2', 'IV_Skew_3', 'Basket_Avg_Skew', 'Basket_Max_Skew']
 print(df[skew_features].describe())
 
 print("\n【IV Skew與Coupon的相關性】")
-skew_corr = df[skew_features + ['Coupon']].corr()['Coupon'].sort_values(ascending=False)
+skew_corr = coupon_corr(df, skew_features + ['Coupon']).sort_values(ascending=False)
 print(skew_corr)
 
 # 3.3 IV Premium (隱含波動率溢價)
@@ -175,17 +182,17 @@ df['IV_Premium_3'] = (df['PUT_IMP_VOL_3M_3'] - df['VOLATILITY_90D_3']) / df['VOL
 premium_cols = ['IV_Premium_1', 'IV_Premium_2', 'IV_Premium_3']
 
 # 平均IV Premium
-df['Basket_Avg_IV_Premium'] = df.apply(lambda row: safe_mean(row, premium_cols), axis=1)
+df['Basket_Avg_IV_Premium'] = df[premium_cols].mean(axis=1, skipna=True)
 
 # 最大IV Premium (最貴的選擇權)
-df['Basket_Max_IV_Premium'] = df.apply(lambda row: safe_max(row, premium_cols), axis=1)
+df['Basket_Max_IV_Premium'] = df[premium_cols].max(axis=1, skipna=True)
 
 print("\n【IV Premium統計】")
 premium_features = ['IV_Premium_1', 'Basket_Avg_IV_Premium', 'Basket_Max_IV_Premium']
 print(df[premium_features].describe())
 
 print("\n【IV Premium與Coupon的相關性】")
-premium_corr = df[premium_features + ['Coupon']].corr()['Coupon'].sort_values(ascending=False)
+premium_corr = coupon_corr(df, premium_features + ['Coupon']).sort_values(ascending=False)
 print(premium_corr)
 
 print("\n【IV Premium解釋】")
@@ -223,7 +230,7 @@ print("\n" + "=" * 80)
 print("5. 新增特徵與Coupon相關性排名")
 print("=" * 80)
 
-all_new_corr = df[new_features_v2 + ['Coupon']].corr()['Coupon'].drop('Coupon')
+all_new_corr = coupon_corr(df, new_features_v2 + ['Coupon']).drop('Coupon')
 all_new_corr_sorted = all_new_corr.abs().sort_values(ascending=False)
 
 print("\n【絕對值相關性排序】")
@@ -238,8 +245,10 @@ print("\n" + "=" * 80)
 print("6. 儲存資料")
 print("=" * 80)
 
-output_file = 'FCN_features_v2.xlsx'
-df.to_excel(output_file, index=False)
+output_file = 'FCN_features_v2.parquet'
+df.to_parquet(output_file, engine='pyarrow', compression='zstd', index=False)
+if WRITE_EXCEL:
+    df.to_excel('FCN_features_v2.xlsx', index=False)
 
 print(f"\n資料已儲存至: {output_file}")
 print(f"最終形狀: {df.shape}")
@@ -1,12 +1,23 @@
+import os
+import sys
 import pandas as pd
 import numpy as np
 
+from corr_utils import coupon_corr
+
+# 加上 --excel 參數時，另外輸出 xlsx 供人工檢查
+WRITE_EXCEL = '--excel' in sys.argv
+
 print("=" * 80)
 print("FCN 特徵工程 V3 - IV 降冪排序 (Sorted IVs)")
 print("=" * 80)
 
 # 讀取V2資料
-df = pd.read_excel('FCN_features_v2.xlsx')
+# 優先讀取 feature_engineering_v2.py 輸出的 Parquet
+if os.path.exists('FCN_features_v2.parquet'):
+    df = pd.read_parquet('FCN_features_v2.parquet')
+else:
+    df = pd.read_excel('FCN_features_v2.xlsx')
 print(f"\n原始資料形狀: {df.shape}")
 
 # ============================================================================
@@ -64,53 +75,24 @@ iv_groups = {
 # 2.2 使用PUT_IMP_VOL_3M作為排序基準（3個月賣權隱含波動率）
 print("\n【排序基準】使用 PUT_IMP_VOL_3M (3個月賣權隱含波動率)")
 
-def get_iv_sort_indices(row):
-    """
-    根據PUT_IMP_VOL_3M獲取降冪排序的索引
-    返回：排序後的索引列表 [idx1, idx2, idx3]，其中idx1對應最大IV
-    """
-    iv_values = [
-        (0, row['PUT_IMP_VOL_3M'] if pd.notna(row['PUT_IMP_VOL_3M']) else -np.inf),
-        (1, row['PUT_IMP_VOL_3M_2'] if pd.notna(row.get('PUT_IMP_VOL_3M_2')) else -np.inf),
-        (2, row['PUT_IMP_VOL_3M_3'] if pd.notna(row.get('PUT_IMP_VOL_3M_3')) else -np.inf),
-    ]
-    # 根據IV值降冪排序
-    sorted_indices = sorted(iv_values, key=lambda x: x[1], reverse=True)
-    return [x[0] for x in sorted_indices]
-
 # 2.3 對每一組特徵進行排序
 print("\n開始對所有IV相關特徵進行降冪排序...")
 
-# 先計算排序索引
+# 先計算排序索引 (缺值視為 -inf 排在最後，同值維持原本順序)
 print("計算排序索引...")
-sort_indices = df.apply(get_iv_sort_indices, axis=1)
-df['_sort_idx_0'] = sort_indices.apply(lambda x: x[0])
-df['_sort_idx_1'] = sort_indices.apply(lambda x: x[1])
-df['_sort_idx_2'] = sort_indices.apply(lambda x: x[2])
-
-# 創建排序後的特徵
-for group_name, cols in iv_groups.items():
-    if all(col in df.columns for col in cols[:1]):  # 至少第一個欄位存在
-        # 創建新的排序欄位名稱
-        rank_cols = [f'{group_name}_Rank_{i+1}' for i in range(3)]
-
-        print(f"  排序 {group_name}...")
-
-        # 對每一行進行排序
-        for i, rank_col in enumerate(rank_cols):
-            def get_sorted_value(row, original_cols, sort_idx_col):
-                idx = int(row[sort_idx_col])
-                if idx < len(original_cols) and original_cols[idx] in row.index:
-                    return row[original_cols[idx]]
-                return np.nan
-
-            df[rank_col] = df.apply(
-                lambda row: get_sorted_value(row, cols, f'_sort_idx_{i}'),
-                axis=1
-            )
-
-# 移除輔助欄位
-df = df.drop(['_sort_idx_0', '_sort_idx_1', '_sort_idx_2'], axis=1)
+base_iv = df.reindex(columns=iv_groups['PUT_IMP_VOL_3M']).to_numpy(dtype=np.float64)
+base_iv = np.nan_to_num(base_iv, nan=-np.inf, posinf=np.inf, neginf=-np.inf)
+sort_order = np.argsort(-base_iv, axis=1, kind='stable')
+
+# 創建排序後的特徵：所有組的欄位疊成 (筆數, 組數, 3) 陣列，以同一組排序索引一次取出 (缺少的欄位視為 NaN)
+sorted_groups = {name: cols for name, cols in iv_groups.items() if cols[0] in df.columns}  # 至少第一個欄位存在
+for group_name in sorted_groups:
+    print(f"  排序 {group_name}...")
+
+stacked = np.stack([df.reindex(columns=cols).to_numpy() for cols in sorted_groups.values()], axis=1)
+ranked = np.take_along_axis(stacked, sort_order[:, None, :], axis=2)
+rank_cols = [f'{group_name}_Rank_{i+1}' for group_name in sorted_groups for i in range(3)]
+df[rank_cols] = ranked.reshape(len(df), -1)
 
 print("\n排序完成！")
 
@@ -154,7 +136,7 @@ print("\n【PUT_IMP_VOL_3M 排序後統計】")
 print(df[rank_iv_cols].describe())
 
 print("\n【各Rank與Coupon的相關性】")
-rank_corr = df[rank_iv_cols + ['Coupon']].corr()['Coupon'].drop('Coupon')
+rank_corr = coupon_corr(df, rank_iv_cols + ['Coupon']).drop('Coupon')
 for feat, corr in rank_corr.items():
     print(f"  {feat}: {corr:.4f}")
 
@@ -213,7 +195,7 @@ print(f"\n共新增 {len(sorted_features)} 個排序相關特徵")
 
 # 計算相關性
 valid_sorted_features = [f for f in sorted_features if f in df.columns]
-sorted_corr = df[valid_sorted_features + ['Coupon']].corr()['Coupon'].drop('Coupon')
+sorted_corr = coupon_corr(df, valid_sorted_features + ['Coupon']).drop('Coupon')
 sorted_corr_abs = sorted_corr.abs().sort_values(ascending=False)
 
 print("\n【Top 20 排序特徵相關性】")
@@ -228,17 +210,21 @@ print("\n" + "=" * 80)
 print("7. 排序前後效果比較")
 print("=" * 80)
 
+# 比較用的欄位一次計算與Coupon的相關性
+compare_corr = coupon_corr(df, ['PUT_IMP_VOL_3M', 'PUT_IMP_VOL_3M_Rank_1', 'PUT_IMP_VOL_3M_2',
+                                'PUT_IMP_VOL_3M_Rank_2', 'Basket_Risk_Score', 'Risk_Score_Sorted'])
+
 print("\n【原始IV vs 排序IV的相關性對比】")
 print("\nPUT_IMP_VOL_3M:")
-print(f"  原始 IV_1 (隨機順序):     {df['PUT_IMP_VOL_3M'].corr(df['Coupon']):.4f}")
-print(f"  排序 Rank_1 (最高IV):     {df['PUT_IMP_VOL_3M_Rank_1'].corr(df['Coupon']):.4f}")
+print(f"  原始 IV_1 (隨機順序):     {compare_corr['PUT_IMP_VOL_3M']:.4f}")
+print(f"  排序 Rank_1 (最高IV):     {compare_corr['PUT_IMP_VOL_3M_Rank_1']:.4f}")
 
-print(f"\n  原始 IV_2 (隨機順序):     {df['PUT_IMP_VOL_3M_2'].corr(df['Coupon']):.4f}")
-print(f"  排序 Rank_2 (次高IV):     {df['PUT_IMP_VOL_3M_Rank_2'].corr(df['Coupon']):.4f}")
+print(f"\n  原始 IV_2 (隨機順序):     {compare_corr['PUT_IMP_VOL_3M_2']:.4f}")
+print(f"  排序 Rank_2 (次高IV):     {compare_corr['PUT_IMP_VOL_3M_Rank_2']:.4f}")
 
 print("\n【風險評分比較】")
-print(f"  原始 Basket_Risk_Score:   {df['Basket_Risk_Score'].corr(df['Coupon']):.4f}")
-print(f"  排序 Risk_Score_Sorted:   {df['Risk_Score_Sorted'].corr(df['Coupon']):.4f}")
+print(f"  原始 Basket_Risk_Score:   {compare_corr['Basket_Risk_Score']:.4f}")
+print(f"  排序 Risk_Score_Sorted:   {compare_corr['Risk_Score_Sorted']:.4f}")
 
 # ============================================================================
 # 8. 儲存資料
@@ -247,8 +233,10 @@ print("\n" + "=" * 80)
 print("8. 儲存資料")
 print("=" * 80)
 
-output_file = 'FCN_features_v3_sorted.xlsx'
-df.to_excel(output_file, index=False)
+output_file = 'FCN_features_v3_sorted.parquet'
+df.to_parquet(output_file, engine='pyarrow', compression='zstd', index=False)
+if WRITE_EXCEL:
+    df.to_excel('FCN_features_v3_sorted.xlsx', index=False)
 
 print(f"\n資料已儲存至: {output_file}")
 print(f"最終形狀: {df.shape}")
@@ -2,6 +2,7 @@
 FCN 模型特徵重要性深入分析
 """
 
+import os
 import pandas as pd
 import numpy as np
 import joblib
@@ -33,8 +34,13 @@ with open('model_features.txt', 'r') as f:
     feature_cols = [line.strip() for line in f.readlines()]
 print(f"✅ 特徵數量: {len(feature_cols)}")
 
-# 載入資料
-df = pd.read_excel('FCN_features_v3_sorted.xlsx')
+# 載入資料 (只讀取模型特徵與 Coupon 欄位)
+# 優先讀取 feature_engineering_v3_sorted_iv.py 輸出的 Parquet
+use_cols = feature_cols + ['Coupon']
+if os.path.exists('FCN_features_v3_sorted.parquet'):
+    df = pd.read_parquet('FCN_features_v3_sorted.parquet', columns=use_cols)
+else:
+    df = pd.read_excel('FCN_features_v3_sorted.xlsx', usecols=use_cols)
 X = df[feature_cols]
 y = df['Coupon']
 print(f"✅ 資料載入: {X.shape}")
@@ -51,8 +57,12 @@ from sklearn.model_selection import train_test_split
 
 X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
+# 轉為連續的 float64 陣列 (模型預測時使用的型別)，每次打亂特徵時不需再從 DataFrame 轉換
+X_test_np = np.ascontiguousarray(X_test.to_numpy(dtype=np.float64))
+y_test_np = y_test.to_numpy(dtype=np.float64)
+
 print("\n計算Permutation Importance (這可能需要幾分鐘)...")
-perm_importance = permutation_importance(model, X_test, y_test, n_repeats=10, random_state=42, n_jobs=-1)
+perm_importance = permutation_importance(model, X_test_np, y_test_np, n_repeats=10, random_state=42, n_jobs=-1)
 
 # 整理結果
 perm_importance_df = pd.DataFrame({
@@ -65,9 +75,8 @@ print("\n【Permutation Importance Top 30】")
 print(f"{'排名':<5} {'特徵名稱':<40} {'重要性':>12} {'標準差':>10}")
 print("-" * 70)
 
-for i, row in perm_importance_df.head(30).iterrows():
-    rank = perm_importance_df.index.get_loc(i) + 1
-    print(f"{rank:<5} {row['feature']:<40} {row['importance_mean']:>12.6f} {row['importance_std']:>10.6f}")
+for rank, row in enumerate(perm_importance_df.head(30).itertuples(index=False), 1):
+    print(f"{rank:<5} {row.feature:<40} {row.importance_mean:>12.6f} {row.importance_std:>10.6f}")
 
 # ============================================================================
 # 3. 特徵分類分析
@@ -128,13 +137,15 @@ feature_categories = {
     ]
 }
 
+# 特徵名稱 -> 重要性 的對照表，各類別直接以特徵名稱查詢
+imp_map = perm_importance_df.set_index('feature')['importance_mean']
+
 # 計算每個類別的總重要性
 category_importance = {}
 for category, features in feature_categories.items():
-    valid_features = [f for f in features if f in perm_importance_df['feature'].values]
-    if valid_features:
-        importance = perm_importance_df[perm_importance_df['feature'].isin(valid_features)]['importance_mean'].sum()
-        category_importance[category] = importance
+    category_features = imp_map.index.intersection(features)
+    if len(category_features):
+        category_importance[category] = imp_map[category_features].sum()
 
 # 排序
 category_importance = dict(sorted(category_importance.items(), key=lambda x: x[1], reverse=True))
@@ -155,32 +166,16 @@ print("\n" + "=" * 80)
 print("4. IV排序重要性驗證 (Rank_1 vs Rank_2 vs Rank_3)")
 print("=" * 80)
 
-rank_comparison = {
-    'Rank_1': [],
-    'Rank_2': [],
-    'Rank_3': []
-}
-
-# 收集各Rank的重要性
-for _, row in perm_importance_df.iterrows():
-    feature = row['feature']
-    importance = row['importance_mean']
-
-    if '_Rank_1' in feature:
-        rank_comparison['Rank_1'].append(importance)
-    elif '_Rank_2' in feature:
-        rank_comparison['Rank_2'].append(importance)
-    elif '_Rank_3' in feature:
-        rank_comparison['Rank_3'].append(importance)
+# 依特徵名稱中的 _Rank_N 分組，一次加總各Rank的重要性
+feature_rank = perm_importance_df['feature'].str.extract(r'_Rank_([123])', expand=False)
+rank_totals = (perm_importance_df.groupby(feature_rank)['importance_mean'].sum()
+               .reindex(['1', '2', '3'], fill_value=0.0))
 
 print("\n【各Rank總重要性】")
-for rank, importances in rank_comparison.items():
-    total = sum(importances)
-    print(f"  {rank}: {total:.6f}")
+for rank, total in rank_totals.items():
+    print(f"  Rank_{rank}: {total:.6f}")
 
-rank_1_total = sum(rank_comparison['Rank_1'])
-rank_2_total = sum(rank_comparison['Rank_2'])
-rank_3_total = sum(rank_comparison['Rank_3'])
+rank_1_total, rank_2_total, rank_3_total = rank_totals.to_numpy()
 
 print(f"\n【重要性比例】")
 print(f"  Rank_1 / Rank_2 = {rank_1_total / rank_2_total:.2f}x")
@@ -203,8 +198,8 @@ for base_feature in iv_features_to_compare:
     print(f"\n【{base_feature}】")
     for rank in ['1', '2', '3']:
         feature_name = f'{base_feature}_Rank_{rank}'
-        if feature_name in perm_importance_df['feature'].values:
-            importance = perm_importance_df[perm_importance_df['feature'] == feature_name]['importance_mean'].values[0]
+        if feature_name in imp_map.index:
+            importance = imp_map[feature_name]
             print(f"  Rank_{rank}: {importance:.6f}")
 
 # ============================================================================
@@ -220,8 +215,8 @@ top_10 = perm_importance_df.head(10)
 print("\n🏆 【Top 10 最重要特徵】")
 print(f"{'排名':<5} {'特徵':<40} {'重要性':>12}")
 print("-" * 60)
-for i, (_, row) in enumerate(top_10.iterrows(), 1):
-    print(f"{i:<5} {row['feature']:<40} {row['importance_mean']:>12.6f}")
+for i, row in enumerate(top_10.itertuples(index=False), 1):
+    print(f"{i:<5} {row.feature:<40} {row.importance_mean:>12.6f}")
 
 # 儲存特徵重要性
 perm_importance_df.to_excel('feature_importance_permutation.xlsx', index=False)
@@ -234,19 +229,21 @@ print("\n" + "=" * 80)
 print("7. 生成視覺化圖表")
 print("=" * 80)
 
-# 圖1: Top 25 特徵重要性
+# 圖1: Top 25 特徵重要性 (perm_importance_df 已依 importance_mean 降冪排序)
 fig, ax = plt.subplots(figsize=(12, 10))
 top_25 = perm_importance_df.head(25)
 y_pos = np.arange(len(top_25))
 
-ax.barh(y_pos, top_25['importance_mean'], xerr=top_25['importance_std'], align='center', color='steelblue', alpha=0.8)
+ax.barh(y_pos, top_25['importance_mean'].to_numpy(), xerr=top_25['importance_std'].to_numpy(),
+        align='center', color='steelblue', alpha=0.8)
 ax.set_yticks(y_pos)
-ax.set_yticklabels(top_25['feature'])
+ax.set_yticklabels(top_25['feature'].tolist())
 ax.invert_yaxis()
 ax.set_xlabel('Permutation Importance')
 ax.set_title('FCN Model - Top 25 Feature Importance')
-plt.tight_layout()
-plt.savefig('feature_importance_top25.png', dpi=150, bbox_inches='tight')
+fig.tight_layout()
+fig.savefig('feature_importance_top25.png', dpi=150, bbox_inches='tight')
+plt.close(fig)  # 存檔後立即釋放圖表記憶體
 print("✅ 已儲存: feature_importance_top25.png")
 
 # 圖2: 類別重要性
@@ -259,8 +256,9 @@ bars = ax.barh(categories, importances, color=colors)
 ax.set_xlabel('Total Importance')
 ax.set_title('Feature Category Importance')
 ax.invert_yaxis()
-plt.tight_layout()
-plt.savefig('feature_importance_categories.png', dpi=150, bbox_inches='tight')
+fig.tight_layout()
+fig.savefig('feature_importance_categories.png', dpi=150, bbox_inches='tight')
+plt.close(fig)
 print("✅ 已儲存: feature_importance_categories.png")
 
 # 圖3: Rank比較
@@ -278,12 +276,11 @@ for bar, val in zip(bars, rank_values):
     ax.text(bar.get_x() + bar.get_width()/2, bar.get_height() + 0.001,
             f'{val:.4f}', ha='center', va='bottom', fontsize=11)
 
-plt.tight_layout()
-plt.savefig('feature_importance_rank_comparison.png', dpi=150, bbox_inches='tight')
+fig.tight_layout()
+fig.savefig('feature_importance_rank_comparison.png', dpi=150, bbox_inches='tight')
+plt.close(fig)
 print("✅ 已儲存: feature_importance_rank_comparison.png")
 
-plt.close('all')
-
 print("\n" + "=" * 80)
 print("特徵重要性分析完成！")
 print("=" * 80)
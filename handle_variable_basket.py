@@ -1,12 +1,24 @@
+import os
+import sys
+import warnings
 import pandas as pd
 import numpy as np
 
+from corr_utils import coupon_corr
+
+# 加上 --excel 參數時，另外輸出 xlsx 供人工檢查
+WRITE_EXCEL = '--excel' in sys.argv
+
 print("=" * 80)
 print("處理變長資產籃 (Variable-Length Basket Handling)")
 print("=" * 80)
 
 # 讀取特徵工程後的資料
-df = pd.read_excel('FCN_engineered_features.xlsx')
+# 優先讀取 feature_engineering.py 輸出的 Parquet
+if os.path.exists('FCN_engineered_features.parquet'):
+    df = pd.read_parquet('FCN_engineered_features.parquet')
+else:
+    df = pd.read_excel('FCN_engineered_features.xlsx')
 print(f"\n原始資料形狀: {df.shape}")
 
 # ============================================================================
@@ -40,21 +52,13 @@ print("\n" + "=" * 80)
 print("2. ❌ 錯誤做法示範 (僅供參考，不實際使用)")
 print("=" * 80)
 
-# 示範：如果填0會發生什麼
-df_wrong = df.copy()
-iv_cols_to_fill = ['PUT_IMP_VOL_3M_2', 'PUT_IMP_VOL_3M_3', 'VOLATILITY_90D_2', 'VOLATILITY_90D_3']
-for col in iv_cols_to_fill:
-    if col in df_wrong.columns:
-        df_wrong[f'{col}_FILLED_ZERO'] = df_wrong[col].fillna(0)
-
+# 示範：如果把缺少的標的 IV (例如 PUT_IMP_VOL_3M_2/_3、VOLATILITY_90D_2/_3) 填0會發生什麼
+# 只說明問題，不實際建立填0的欄位
 print("\n❌ 填0的問題：")
 print("  - IV=0 代表股價不會動，風險為0，這是完全錯誤的訊號")
 print("  - 會讓模型誤以為單一標的FCN的風險最低")
 print("  - 實際上：單一標的可能風險更集中！")
 
-# 不保留這些錯誤欄位
-df_wrong = df.copy()
-
 # ============================================================================
 # 3. 正確做法：Basket-aware特徵
 # ============================================================================
@@ -66,11 +70,21 @@ print("=" * 80)
 # Worst Case Performance 原則：FCN的敲入通常由表現最差的標的觸發
 print("\n【3.1 Worst-Case IV (最高波動率 = 最大風險)】")
 
-# 計算最高隱含波動率（忽略NaN）
-df['Basket_Worst_IV'] = df[['PUT_IMP_VOL_3M', 'PUT_IMP_VOL_3M_2', 'PUT_IMP_VOL_3M_3']].max(axis=1, skipna=True)
+iv_3m_cols = ['PUT_IMP_VOL_3M', 'PUT_IMP_VOL_3M_2', 'PUT_IMP_VOL_3M_3']
+hv_90d_cols = ['VOLATILITY_90D', 'VOLATILITY_90D_2', 'VOLATILITY_90D_3']
+
+# 各組標的欄位只取出一次，最高/最低值都由同一個陣列計算 (忽略NaN，全部缺值時為 NaN)
+iv_3m = df[iv_3m_cols].to_numpy(dtype=np.float64)
+hv_90d = df[hv_90d_cols].to_numpy(dtype=np.float64)
+
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore', RuntimeWarning)  # 全部缺值的列
+
+    # 計算最高隱含波動率
+    df['Basket_Worst_IV'] = np.nanmax(iv_3m, axis=1)
 
-# 計算最高歷史波動率
-df['Basket_Worst_HV'] = df[['VOLATILITY_90D', 'VOLATILITY_90D_2', 'VOLATILITY_90D_3']].max(axis=1, skipna=True)
+    # 計算最高歷史波動率
+    df['Basket_Worst_HV'] = np.nanmax(hv_90d, axis=1)
 
 print("Basket_Worst_IV 統計:")
 print(df.groupby('Basket_Size')['Basket_Worst_IV'].agg(['mean', 'std', 'min', 'max']))
@@ -78,8 +92,10 @@ print(df.groupby('Basket_Size')['Basket_Worst_IV'].agg(['mean', 'std', 'min', 'm
 # 3.2 Best-Case IV (最低波動率)
 print("\n【3.2 Best-Case IV (最低波動率 = 最小風險)】")
 
-df['Basket_Best_IV'] = df[['PUT_IMP_VOL_3M', 'PUT_IMP_VOL_3M_2', 'PUT_IMP_VOL_3M_3']].min(axis=1, skipna=True)
-df['Basket_Best_HV'] = df[['VOLATILITY_90D', 'VOLATILITY_90D_2', 'VOLATILITY_90D_3']].min(axis=1, skipna=True)
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore', RuntimeWarning)  # 全部缺值的列
+    df['Basket_Best_IV'] = np.nanmin(iv_3m, axis=1)
+    df['Basket_Best_HV'] = np.nanmin(hv_90d, axis=1)
 
 print("Basket_Best_IV 統計:")
 print(df.groupby('Basket_Size')['Basket_Best_IV'].agg(['mean', 'std', 'min', 'max']))
@@ -96,18 +112,9 @@ print(df.groupby('Basket_Size')['Basket_IV_Range'].agg(['mean', 'std', 'min', 'm
 # 3.4 加權平均IV (考慮標的數量)
 print("\n【3.4 Basket Weighted Average IV】")
 
-# 計算有效標的數量的IV總和，然後除以Basket_Size
-# 這樣可以正確處理NaN
-def safe_mean_iv(row, cols):
-    """安全計算平均IV，自動忽略NaN"""
-    values = [row[col] for col in cols if pd.notna(row[col])]
-    return np.mean(values) if values else np.nan
-
-iv_3m_cols = ['PUT_IMP_VOL_3M', 'PUT_IMP_VOL_3M_2', 'PUT_IMP_VOL_3M_3']
-hv_90d_cols = ['VOLATILITY_90D', 'VOLATILITY_90D_2', 'VOLATILITY_90D_3']
-
-df['Basket_Avg_IV'] = df.apply(lambda row: safe_mean_iv(row, iv_3m_cols), axis=1)
-df['Basket_Avg_HV'] = df.apply(lambda row: safe_mean_iv(row, hv_90d_cols), axis=1)
+# 只對有效標的取平均 (忽略NaN)，相當於有效標的IV總和除以Basket_Size
+df['Basket_Avg_IV'] = df[iv_3m_cols].mean(axis=1, skipna=True)
+df['Basket_Avg_HV'] = df[hv_90d_cols].mean(axis=1, skipna=True)
 
 print("Basket_Avg_IV 統計:")
 print(df.groupby('Basket_Size')['Basket_Avg_IV'].agg(['mean', 'std', 'min', 'max']))
@@ -119,15 +126,13 @@ print("\n【3.5 Basket Correlation Features】")
 # 相關性低 = 分散效果好 = 風險較低 = Coupon應該較低
 
 # 最低相關性（最差情況：標的獨立變動）
-df['Basket_Min_Corr'] = df[['CORR_COEF', 'CORR_COEF_2', 'CORR_COEF_3']].min(axis=1, skipna=True)
-
-# 平均相關性
-def safe_mean_corr(row, cols):
-    values = [row[col] for col in cols if pd.notna(row[col])]
-    return np.mean(values) if values else np.nan
-
 corr_cols = ['CORR_COEF', 'CORR_COEF_2', 'CORR_COEF_3']
-df['Basket_Avg_Corr'] = df.apply(lambda row: safe_mean_corr(row, corr_cols), axis=1)
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore', RuntimeWarning)  # 全部缺值的列
+    df['Basket_Min_Corr'] = np.nanmin(df[corr_cols].to_numpy(dtype=np.float64), axis=1)
+
+# 平均相關性 (忽略NaN)
+df['Basket_Avg_Corr'] = df[corr_cols].mean(axis=1, skipna=True)
 
 # 對於單一標的，相關性特徵無意義，設為NaN是合理的
 print("Basket_Avg_Corr 統計 (單一標的為NaN是正確的):")
@@ -160,15 +165,13 @@ df['Basket_Complexity_Factor'] = df['Basket_Size'] / 3.0  # 標準化到1檔=0.3
 # Effective_IV = Worst_IV * (1 + Basket_Size_Effect * (1 - Avg_Corr))
 # 相關性低時，Basket Size效應放大
 
-df['Corr_Adjusted_IV'] = df['Basket_Worst_IV'].copy()
-
 # 只對多標的進行調整
-multi_asset_mask = (df['Basket_Size'] > 1) & (df['Basket_Avg_Corr'].notna())
+multi_asset_mask = ((df['Basket_Size'] > 1) & (df['Basket_Avg_Corr'].notna())).to_numpy()
 
-df.loc[multi_asset_mask, 'Corr_Adjusted_IV'] = (
-    df.loc[multi_asset_mask, 'Basket_Worst_IV'] *
-    (1 + 0.1 * (df.loc[multi_asset_mask, 'Basket_Size'] - 1) *
-     (1 - df.loc[multi_asset_mask, 'Basket_Avg_Corr']))
+df['Corr_Adjusted_IV'] = np.where(
+    multi_asset_mask,
+    df['Basket_Worst_IV'] * (1 + 0.1 * (df['Basket_Size'] - 1) * (1 - df['Basket_Avg_Corr'])),
+    df['Basket_Worst_IV']
 )
 
 print("\n【相關性調整後的IV】")
@@ -195,9 +198,10 @@ df['Basket_Risk_Score'] = (
 )
 
 # 對於有相關性數據的，進一步調整
-df.loc[multi_asset_mask, 'Basket_Risk_Score'] = (
-    df.loc[multi_asset_mask, 'Basket_Risk_Score'] *
-    (1 + 0.1 * (1 - df.loc[multi_asset_mask, 'Basket_Avg_Corr']))
+df['Basket_Risk_Score'] = np.where(
+    multi_asset_mask,
+    df['Basket_Risk_Score'] * (1 + 0.1 * (1 - df['Basket_Avg_Corr'])),
+    df['Basket_Risk_Score']
 )
 
 print("\n【Basket Risk Score統計】")
@@ -220,11 +224,11 @@ basket_features = [
 ]
 
 print("\n【單一標的 (Basket_Size=1) 範例】")
-single_asset = df[df['Basket_Size'] == 1][basket_features + ['Coupon']].head(3)
+single_asset = df.loc[df['Basket_Size'] == 1, basket_features + ['Coupon']].head(3)
 print(single_asset)
 
 print("\n【三標的 (Basket_Size=3) 範例】")
-triple_asset = df[df['Basket_Size'] == 3][basket_features + ['Coupon']].head(3)
+triple_asset = df.loc[df['Basket_Size'] == 3, basket_features + ['Coupon']].head(3)
 print(triple_asset)
 
 # ============================================================================
@@ -241,7 +245,7 @@ basket_feature_list = [
     'Basket_Worst_HV', 'Basket_Best_HV'
 ]
 
-correlations = df[basket_feature_list + ['Coupon']].corr()['Coupon'].drop('Coupon')
+correlations = coupon_corr(df, basket_feature_list + ['Coupon']).drop('Coupon')
 correlations_sorted = correlations.abs().sort_values(ascending=False)
 
 print("\n【絕對值相關性排序】")
@@ -274,8 +278,10 @@ print("\n" + "=" * 80)
 print("9. 儲存資料")
 print("=" * 80)
 
-output_file = 'FCN_basket_handled.xlsx'
-df.to_excel(output_file, index=False)
+output_file = 'FCN_basket_handled.parquet'
+df.to_parquet(output_file, engine='pyarrow', compression='zstd', index=False)
+if WRITE_EXCEL:
+    df.to_excel('FCN_basket_handled.xlsx', index=False)
 
 print(f"\n資料已儲存至: {output_file}")
 print(f"最終形狀: {df.shape}")
@@ -1,11 +1,17 @@
 import pandas as pd
 import os
+import sys
 from datetime import datetime
 
+from excel_cache import read_excel_cached
+
+# 加上 --excel 參數時，另外輸出 xlsx 供人工檢查
+WRITE_EXCEL = '--excel' in sys.argv
+
 print("開始合併FCN資料與IV資料...")
 
 # 讀取FCN資料表
-df_fcn = pd.read_excel('FCN資料表.xlsx')
+df_fcn = read_excel_cached('FCN資料表.xlsx')
 print(f"FCN資料表載入完成: {df_fcn.shape}")
 
 # 建立日期欄位（格式: YYYYMMDD）
@@ -22,7 +28,7 @@ for iv_file in iv_files:
     print(f"\n處理 {iv_file}...")
 
     # 讀取IV檔案
-    df_iv = pd.read_excel(f'iv_data/{iv_file}')
+    df_iv = read_excel_cached(f'iv_data/{iv_file}')
 
     # 跳過第一行（中文標題）
     df_iv = df_iv.iloc[1:].reset_index(drop=True)
@@ -51,47 +57,39 @@ print(f"\n所有IV資料合併完成: {df_iv_all.shape}")
 
 print("\n開始merge FCN資料與IV資料...")
 
-# 先複製FCN資料
-df_merged = df_fcn.copy()
+# 只拿 Date_Key 與 BBG Code 欄位去 merge，IV 欄位都併好後再一次接回 FCN 資料
+# (_row 記錄每一列對應的 FCN 資料列)
+iv_value_cols = [col for col in df_iv_all.columns if col not in ('BBG_Code', 'Date_Key')]
+bbg_cols = [f'BBG Code {i}' for i in range(1, 4) if f'BBG Code {i}' in df_fcn.columns]
+df_keys = df_fcn[['Date_Key'] + bbg_cols].assign(_row=range(len(df_fcn)))
+merged_iv_cols = []
 
 # 對每個BBG Code欄位進行merge
 for i in range(1, 4):  # BBG Code 1, 2, 3
     bbg_col = f'BBG Code {i}'
 
-    if bbg_col in df_merged.columns:
+    if bbg_col in bbg_cols:
         print(f"\n處理 {bbg_col}...")
 
-        # Merge IV資料
-        df_temp = df_merged.merge(
-            df_iv_all,
+        # 第一個標的不加後綴，第2、3個標的加 _2、_3
+        suffix = '' if i == 1 else f'_{i}'
+        iv_renamed = df_iv_all.rename(columns={col: f'{col}{suffix}' for col in iv_value_cols})
+
+        # Merge IV資料，並移除BBG_Code欄位（已經有BBG Code 1/2/3了）
+        df_keys = df_keys.merge(
+            iv_renamed,
             left_on=['Date_Key', bbg_col],
             right_on=['Date_Key', 'BBG_Code'],
-            how='left',
-            suffixes=('', f'_{i}')
-        )
-
-        # 重新命名合併的欄位
-        for col in ['PX_LAST', 'PUT_IMP_VOL_3M', 'CALL_IMP_VOL_2M_25D',
-                    'PUT_IMP_VOL_2M_25D', 'HIST_PUT_IMP_VOL', 'VOL_STDDEV',
-                    'VOLATILITY_90D', 'VOL_PERCENTILE', 'CHG_PCT_1YR',
-                    'CORR_COEF', 'DIVIDEND_YIELD']:
-            if i == 1:
-                # 第一個標的不加後綴
-                if col in df_temp.columns:
-                    continue
-            else:
-                # 第2、3個標的加後綴
-                old_name = f'{col}_{i}' if f'{col}_{i}' in df_temp.columns else col
-                new_name = f'{col}_{i}'
-                if old_name in df_temp.columns and old_name != new_name:
-                    df_temp = df_temp.rename(columns={old_name: new_name})
-
-        # 移除BBG_Code欄位（已經有BBG Code 1/2/3了）
-        if 'BBG_Code' in df_temp.columns:
-            df_temp = df_temp.drop('BBG_Code', axis=1)
-
-        df_merged = df_temp
-        print(f"  - Merge完成，當前形狀: {df_merged.shape}")
+            how='left'
+        ).drop('BBG_Code', axis=1)
+        merged_iv_cols += [f'{col}{suffix}' for col in iv_value_cols]
+
+        print(f"  - Merge完成，當前形狀: {(len(df_keys), len(df_fcn.columns) + len(merged_iv_cols))}")
+
+df_merged = pd.concat([
+    df_fcn.iloc[df_keys['_row'].to_numpy()].reset_index(drop=True),
+    df_keys[merged_iv_cols],
+], axis=1)
 
 # 移除Date_Key（輔助欄位）
 if 'Date_Key' in df_merged.columns:
@@ -102,9 +100,11 @@ print("\n欄位列表:")
 for i, col in enumerate(df_merged.columns, 1):
     print(f"{i}. {col}")
 
-# 儲存合併後的資料
-output_file = 'FCN_merged_data.xlsx'
-df_merged.to_excel(output_file, index=False)
+# 儲存合併後的資料 (Parquet，原始 Coupon 欄位混有 '-' 與數字，需統一存為字串)
+output_file = 'FCN_merged_data.parquet'
+df_merged.astype({'Coupon p.a. (%)': str}).to_parquet(output_file, engine='pyarrow', compression='zstd', index=False)
+if WRITE_EXCEL:
+    df_merged.to_excel('FCN_merged_data.xlsx', index=False)
 print(f"\n合併資料已儲存至: {output_file}")
 
 # 顯示前幾筆資料
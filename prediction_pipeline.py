@@ -30,17 +30,44 @@ FCN 報價預測 Pipeline
 import pandas as pd
 import numpy as np
 import joblib
+import pyarrow as pa
+import pyarrow.parquet as pq
 import os
+import threading
+from collections import OrderedDict, defaultdict
+from itertools import combinations
 from datetime import datetime
+from openpyxl import load_workbook
 import warnings
 warnings.filterwarnings('ignore')
 
+try:
+    import onnxruntime as ort
+except ImportError:  # 沒有安裝 onnxruntime 時，使用 sklearn 模型預測
+    ort = None
+
+# 原始 IV 欄位列表
+IV_COLS = ('PUT_IMP_VOL_3M', 'CALL_IMP_VOL_2M_25D', 'PUT_IMP_VOL_2M_25D', 'HIST_PUT_IMP_VOL',
+           'VOL_STDDEV', 'VOLATILITY_90D', 'VOL_PERCENTILE', 'CHG_PCT_1YR', 'CORR_COEF',
+           'DIVIDEND_YIELD', 'PX_LAST')
+MAX_STOCKS = 3
+IV_CACHE_SIZE = 32  # 最多同時快取的 IV 資料日期數
+ONNX_MAX_DIFF = 1e-4  # export_onnx() 允許與 sklearn 的最大預測差距 (%)，超過時不儲存 ONNX 檔案
+
+# IV Parquet 快取的 metadata 鍵 (來源 xlsx 的修改時間與大小)
+IV_SOURCE_KEY = b'iv_source'
+
+# 排序後特徵名稱 (PUT_IMP_VOL_3M_Rank_1, ..., IV_Skew_Rank_1, ...)，匯入時建立一次
+_RANK_COLS = tuple((col, tuple(f'{col}_Rank_{i+1}' for i in range(MAX_STOCKS))) for col in IV_COLS)
+_SKEW_RANK_COLS = tuple(f'IV_Skew_Rank_{i+1}' for i in range(MAX_STOCKS))
+_PREMIUM_RANK_COLS = tuple(f'IV_Premium_Rank_{i+1}' for i in range(MAX_STOCKS))
+
 
 class FCNPredictor:
     """FCN報價預測器"""
 
     def __init__(self, model_path='fcn_model_histgradient_boosting_deep.pkl',
-                 iv_data_folder='iv_data'):
+                 iv_data_folder='iv_data', use_onnx=False):
         """
         初始化預測器
 
@@ -50,21 +77,124 @@ class FCNPredictor:
             模型檔案路徑
         iv_data_folder : str
             IV資料資料夾路徑
+        use_onnx : bool
+            是否使用 export_onnx() 匯出的 ONNX 模型預測 (以 float32 比較特徵，與 sklearn 的預測會有差距，見 export_onnx)
         """
         self.model_path = model_path
         self.iv_data_folder = iv_data_folder
+        self.use_onnx = use_onnx
 
         # 載入模型
         print("載入模型...")
         self.model = joblib.load(model_path)
         print(f"✅ 模型載入成功: {model_path}")
 
-        # 載入特徵列表
+        # 載入特徵列表 (預測時直接傳入 ndarray，需與模型的特徵順序一致)
         self.feature_cols = self._load_feature_list()
+        model_features = list(getattr(self.model, 'feature_names_in_', self.feature_cols))
+        if model_features != self.feature_cols:
+            print("⚠️ model_features.txt 與模型的特徵順序不一致，改用模型內記錄的特徵")
+            self.feature_cols = model_features
         print(f"✅ 特徵數量: {len(self.feature_cols)}")
 
-        # 快取IV資料
-        self.iv_cache = {}
+        # 特徵名稱 -> 特徵陣列位置，模型沒有用到的特徵寫到最後一格暫存位置
+        self._feature_idx = defaultdict(lambda: len(self.feature_cols),
+                                        {name: i for i, name in enumerate(self.feature_cols)})
+        self._check_feature_coverage()
+
+        # use_onnx=True 且模型旁有 export_onnx() 匯出的 ONNX 檔案時，改用 ONNX Runtime 預測
+        self.onnx_path = os.path.splitext(model_path)[0] + '.onnx'
+        self.onnx_session = self._load_onnx_session() if use_onnx else None
+
+        # 快取IV資料 (依使用順序淘汰，最多 IV_CACHE_SIZE 個日期；多執行緒共用同一個預測器時以鎖保護)
+        self.iv_cache = OrderedDict()
+        self._iv_cache_lock = threading.Lock()
+
+    def _check_feature_coverage(self):
+        """以完整的3檔IV資料試算一次，列出 _compute_features 沒有產生的模型特徵"""
+        sample_iv = {col: 1.0 for col in IV_COLS}
+        sample_input = {'strike': 90, 'ko_barrier': 100, 'ki_barrier': 70, 'tenor': 6,
+                        'non_call': 1, 'cost': 99, 'barrier_type': 'AKI'}
+        row = self._compute_features(sample_input, [sample_iv] * MAX_STOCKS)
+        missing = [col for col, value in zip(self.feature_cols, row) if np.isnan(value)]
+        if missing:
+            print(f"⚠️ 有 {len(missing)} 個模型特徵沒有計算，將以 NaN 代入: {missing}")
+
+    def _load_onnx_session(self):
+        """載入 ONNX 模型 (需安裝 onnxruntime 且 ONNX 檔案不舊於 pkl 模型)，無法使用時回傳 None"""
+        if ort is None or not os.path.exists(self.onnx_path):
+            return None
+        if os.path.getmtime(self.onnx_path) < os.path.getmtime(self.model_path):
+            print(f"⚠️ ONNX 模型比 {self.model_path} 舊，請重新執行 export_onnx()，暫以 sklearn 預測")
+            return None
+
+        session = ort.InferenceSession(self.onnx_path, providers=['CPUExecutionProvider'])
+        n_inputs = session.get_inputs()[0].shape[1]
+        if n_inputs != len(self.feature_cols):
+            print(f"⚠️ ONNX 模型特徵數 ({n_inputs}) 與特徵列表不符，暫以 sklearn 預測")
+            return None
+        print(f"✅ ONNX 模型載入成功: {self.onnx_path}")
+        return session
+
+    def _build_onnx_check_matrix(self):
+        """用最新日期的前 20 檔股票建立所有 1-3 檔組合的特徵，供驗證 ONNX 模型使用"""
+        dates = sorted(f[:-len('.xlsx')] for f in os.listdir(self.iv_data_folder) if f.endswith('.xlsx'))
+        if not dates:
+            raise FileNotFoundError(f"找不到IV資料: {self.iv_data_folder}")
+        codes = [code for code in self._load_iv_rows(dates[-1]) if isinstance(code, str)][:20]
+        combos = [c for k in range(1, MAX_STOCKS + 1) for c in combinations(codes, k)]
+
+        X = np.empty((len(combos), len(self.feature_cols)), dtype=np.float64)
+        for i, combo in enumerate(combos):
+            X[i], _, _ = self._prepare_features(dates[-1], list(combo), strike=90, ko_barrier=100, ki_barrier=70,
+                                                tenor=6, non_call=1, cost=99, barrier_type='EKI')
+        return X
+
+    def export_onnx(self):
+        """
+        將模型匯出為 ONNX 格式 (需另外安裝 skl2onnx、onnx)
+
+        ONNX 的樹模型以 float32 比較特徵，落在門檻值附近的特徵會走到不同的分支，
+        實測最大差距：根目錄的模型 0.15 個百分點 (20251212，1350 個組合)，後端的 V8 模型 0.40 個百分點。
+        匯出前先用最新日期的 IV 資料驗證，最大差距超過 ONNX_MAX_DIFF 時丟出 ValueError，不儲存檔案；
+        通過驗證且 use_onnx=True 時改用 ONNX Runtime 預測
+        """
+        if ort is None:
+            raise ImportError("驗證 ONNX 模型需要安裝 onnxruntime")
+        from skl2onnx import convert_sklearn
+        from skl2onnx.common.data_types import FloatTensorType
+
+        onnx_model = convert_sklearn(
+            self.model, initial_types=[('input', FloatTensorType([None, len(self.feature_cols)]))])
+        onnx_bytes = onnx_model.SerializeToString()
+
+        # 先驗證 ONNX 與 sklearn 的預測差距，通過後才寫入檔案
+        X = self._build_onnx_check_matrix()
+        session = ort.InferenceSession(onnx_bytes, providers=['CPUExecutionProvider'])
+        diff = np.abs(self.model.predict(X) - session.run(None, {'input': X.astype(np.float32)})[0].ravel())
+        print(f"驗證 {len(X)} 筆組合: 最大差距 {diff.max():.4f}%, 差距 > 0.01% 的筆數 {(diff > 0.01).sum()}")
+        if diff.max() > ONNX_MAX_DIFF:
+            raise ValueError(f"ONNX 與 sklearn 的最大差距 {diff.max():.4f}% 超過容許值 {ONNX_MAX_DIFF}%，"
+                             f"不儲存 ONNX 模型")
+
+        # 先寫入暫存檔再改名，避免留下寫到一半的檔案
+        tmp_file = f'{self.onnx_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_file, 'wb') as f:
+                f.write(onnx_bytes)
+            os.replace(tmp_file, self.onnx_path)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        print(f"✅ ONNX 模型已儲存至: {self.onnx_path}")
+        if self.use_onnx:
+            self.onnx_session = self._load_onnx_session()
+
+    def _predict_matrix(self, X):
+        """以 ONNX Runtime (有載入時) 或 sklearn 模型預測特徵矩陣"""
+        if self.onnx_session is not None:
+            return self.onnx_session.run(None, {'input': X.astype(np.float32)})[0].ravel().astype(np.float64)
+        return self.model.predict(X)
 
     def _load_feature_list(self):
         """載入特徵列表"""
@@ -85,15 +215,18 @@ class FCNPredictor:
         pd.DataFrame
             IV資料
         """
-        # 統一日期格式
-        if '-' in pricing_date:
-            date_key = pricing_date.replace('-', '')
-        else:
-            date_key = pricing_date
+        return self._load_iv_entry(pricing_date)[0]
+
+    def _load_iv_entry(self, pricing_date):
+        """載入指定日期的IV資料，回傳 (DataFrame, BBG_Code -> IV資料 dict)"""
+        date_key = self._date_key(pricing_date)
 
         # 檢查快取
-        if date_key in self.iv_cache:
-            return self.iv_cache[date_key]
+        with self._iv_cache_lock:
+            entry = self.iv_cache.get(date_key)
+            if entry is not None:
+                self.iv_cache.move_to_end(date_key)
+                return entry
 
         # 載入IV檔案
         iv_file = os.path.join(self.iv_data_folder, f'{date_key}.xlsx')
@@ -101,16 +234,76 @@ class FCNPredictor:
         if not os.path.exists(iv_file):
             raise FileNotFoundError(f"找不到IV資料檔案: {iv_file}")
 
-        df_iv = pd.read_excel(iv_file)
-
-        # 跳過第一行（中文標題）
-        df_iv = df_iv.iloc[1:].reset_index(drop=True)
+        # 優先讀取 Parquet 快取 (記錄來源 xlsx 的修改時間與大小，xlsx 更換過時重新解析)
+        parquet_file = os.path.join(self.iv_data_folder, f'{date_key}.parquet')
+        stat = os.stat(iv_file)
+        source_stamp = f'{stat.st_mtime_ns}:{stat.st_size}'.encode()
+        try:
+            metadata = pq.read_schema(parquet_file).metadata or {}
+        except (OSError, pa.ArrowInvalid):
+            metadata = {}
+
+        if metadata.get(IV_SOURCE_KEY) == source_stamp:
+            df_iv = pd.read_parquet(parquet_file, engine='pyarrow').fillna(np.nan)
+        else:
+            df_iv = self._read_iv_excel(iv_file)
+            table = pa.Table.from_pandas(df_iv, preserve_index=False)
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), IV_SOURCE_KEY: source_stamp})
+            # 先寫入暫存檔再改名，其他執行緒或程序不會讀到寫到一半的檔案
+            tmp_file = f'{parquet_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+            try:
+                pq.write_table(table, tmp_file, compression='zstd')
+                os.replace(tmp_file, parquet_file)
+            except OSError as e:
+                print(f"⚠️ 警告: 無法寫入IV資料快取 {parquet_file}: {e}")
+
+        # 每檔股票的IV資料 dict 在載入時建立一次 (同一代碼以第一筆為準)
+        iv_rows = {}
+        for row in df_iv.to_dict('records'):
+            iv_rows.setdefault(row['BBG_Code'], row)
+
+        # 快取 (讀檔在鎖外進行，同一日期同時載入時以先寫入的為準)
+        with self._iv_cache_lock:
+            entry = self.iv_cache.setdefault(date_key, (df_iv, iv_rows))
+            self.iv_cache.move_to_end(date_key)
+            if len(self.iv_cache) > IV_CACHE_SIZE:
+                self.iv_cache.popitem(last=False)
+
+        return entry
+
+    def _load_iv_rows(self, pricing_date):
+        """載入指定日期的IV資料，回傳 BBG_Code -> IV資料 dict"""
+        return self._load_iv_entry(pricing_date)[1]
+
+    @staticmethod
+    def _date_key(pricing_date):
+        """統一日期格式 (YYYY-MM-DD 或 YYYYMMDD -> YYYYMMDD)"""
+        if '-' in pricing_date:
+            return pricing_date.replace('-', '')
+        return pricing_date
+
+    def _read_iv_excel(self, iv_file):
+        """解析 Bloomberg 匯出的 IV xlsx (設定欄位名稱、移除後綴、轉換數值)"""
+        # 以 openpyxl 唯讀模式逐列讀取 (比 pd.read_excel 建立整份活頁簿快)
+        wb = load_workbook(iv_file, read_only=True, data_only=True)
+        try:
+            rows = wb.worksheets[0].iter_rows(values_only=True)
+            next(rows, None)  # 欄位名稱列
+            next(rows, None)  # 跳過第二行（中文標題）
+            data = list(rows)
+        finally:
+            wb.close()
+
+        # 與 pd.read_excel 相同，只移除結尾的全空白列
+        while data and all(v is None or v == '' for v in data[-1]):
+            data.pop()
 
         # 設定欄位名稱
-        df_iv.columns = ['BBG_Code', 'PX_LAST', 'PUT_IMP_VOL_3M', 'CALL_IMP_VOL_2M_25D',
-                         'PUT_IMP_VOL_2M_25D', 'HIST_PUT_IMP_VOL', 'VOL_STDDEV',
-                         'VOLATILITY_90D', 'VOL_PERCENTILE', 'CHG_PCT_1YR',
-                         'CORR_COEF', 'DIVIDEND_YIELD']
+        df_iv = pd.DataFrame(data, columns=['BBG_Code', 'PX_LAST', 'PUT_IMP_VOL_3M', 'CALL_IMP_VOL_2M_25D',
+                                            'PUT_IMP_VOL_2M_25D', 'HIST_PUT_IMP_VOL', 'VOL_STDDEV',
+                                            'VOLATILITY_90D', 'VOL_PERCENTILE', 'CHG_PCT_1YR',
+                                            'CORR_COEF', 'DIVIDEND_YIELD'])
+        df_iv = df_iv.replace('', np.nan).fillna(np.nan)
 
         # 移除" Equity"後綴
         df_iv['BBG_Code'] = df_iv['BBG_Code'].str.replace(' Equity', '', regex=False)
@@ -120,24 +313,25 @@ class FCNPredictor:
                         'PUT_IMP_VOL_2M_25D', 'HIST_PUT_IMP_VOL', 'VOL_STDDEV',
                         'VOLATILITY_90D', 'VOL_PERCENTILE', 'CHG_PCT_1YR',
                         'CORR_COEF', 'DIVIDEND_YIELD']
-        for col in numeric_cols:
-            df_iv[col] = pd.to_numeric(df_iv[col], errors='coerce')
-
-        # 快取
-        self.iv_cache[date_key] = df_iv
+        try:
+            # 一次轉成 float64，有無法轉換的字串 (例如 #N/A) 時才逐欄轉換
+            df_iv[numeric_cols] = df_iv[numeric_cols].to_numpy(dtype=np.float64)
+        except (TypeError, ValueError):
+            for col in numeric_cols:
+                df_iv[col] = pd.to_numeric(df_iv[col], errors='coerce')
 
         return df_iv
 
-    def _get_stock_iv(self, iv_data, bbg_code):
-        """取得特定股票的IV資料"""
-        stock_data = iv_data[iv_data['BBG_Code'] == bbg_code]
-        if len(stock_data) == 0:
+    def _get_stock_iv(self, iv_rows, bbg_code):
+        """取得特定股票的IV資料 (回傳複本，避免修改到快取)"""
+        stock_iv = iv_rows.get(bbg_code)
+        if stock_iv is None:
             return None
-        return stock_data.iloc[0].to_dict()
+        return dict(stock_iv)
 
     def _compute_features(self, input_data, iv_data_list):
         """
-        計算所有特徵
+        計算所有特徵，依特徵位置直接寫入預先配置的 NumPy 陣列
 
         Parameters:
         -----------
@@ -148,216 +342,169 @@ class FCNPredictor:
 
         Returns:
         --------
-        pd.DataFrame
-            特徵DataFrame (單行)
+        np.ndarray
+            特徵陣列 (順序與 feature_cols 相同，模型沒有的特徵為 NaN)
         """
-        features = {}
+        idx = self._feature_idx
+        row = np.full(len(self.feature_cols) + 1, np.nan)
+
+        strike = input_data['strike']
+        ko_barrier = input_data['ko_barrier']
+        ki_barrier = input_data['ki_barrier']
+        tenor = input_data['tenor']
+        non_call = input_data['non_call']
 
         # ==================== 基本FCN條件特徵 ====================
-        features['Strike (%)'] = input_data['strike']
-        features['KO Barrier (%)'] = input_data['ko_barrier']
-        features['KI Barrier (%)'] = input_data['ki_barrier']
-        features['Tenor (m)'] = input_data['tenor']
-        features['Non-call Periods (m)'] = input_data['non_call']
-        features['Cost (%)'] = input_data['cost']
-        features['Barrier_Type_AKI'] = 1 if input_data['barrier_type'] == 'AKI' else 0
+        row[idx['Strike (%)']] = strike
+        row[idx['KO Barrier (%)']] = ko_barrier
+        row[idx['KI Barrier (%)']] = ki_barrier
+        row[idx['Tenor (m)']] = tenor
+        row[idx['Non-call Periods (m)']] = non_call
+        row[idx['Cost (%)']] = input_data['cost']
+        row[idx['Barrier_Type_AKI']] = 1 if input_data['barrier_type'] == 'AKI' else 0
 
         # ==================== 費用特徵 ====================
-        features['Fee'] = 100 - input_data['cost']
-        features['Annualized_Fee'] = features['Fee'] / input_data['tenor'] * 12
+        fee = 100 - input_data['cost']
+        row[idx['Fee']] = fee
+        row[idx['Annualized_Fee']] = fee / tenor * 12
 
         # ==================== 時間特徵 ====================
-        features['Tenor_Sqrt'] = np.sqrt(input_data['tenor'])
-        features['Tenor_Squared'] = input_data['tenor'] ** 2
-        features['Callable_Period'] = input_data['tenor'] - input_data['non_call']
-        features['Callable_Ratio'] = features['Callable_Period'] / input_data['tenor']
-        features['NonCall_Ratio'] = input_data['non_call'] / input_data['tenor']
+        callable_period = tenor - non_call
+        row[idx['Tenor_Sqrt']] = np.sqrt(tenor)
+        row[idx['Tenor_Squared']] = tenor ** 2
+        row[idx['Callable_Period']] = callable_period
+        row[idx['Callable_Ratio']] = callable_period / tenor
+        row[idx['NonCall_Ratio']] = non_call / tenor
 
         # ==================== 障礙價特徵 ====================
-        features['KO_Strike_Distance'] = input_data['ko_barrier'] - input_data['strike']
-        features['Strike_KI_Distance'] = input_data['strike'] - input_data['ki_barrier']
-        features['KO_KI_Range'] = input_data['ko_barrier'] - input_data['ki_barrier']
-        features['KI_Strike_Ratio'] = input_data['ki_barrier'] / input_data['strike']
-        features['KO_Strike_Ratio'] = input_data['ko_barrier'] / input_data['strike']
-        features['KI_Distance_Pct'] = input_data['strike'] - input_data['ki_barrier']
-        features['KO_Distance_Pct'] = input_data['ko_barrier'] - input_data['strike']
+        ki_distance_pct = strike - ki_barrier
+        ko_distance_pct = ko_barrier - strike
+        row[idx['KO_Strike_Distance']] = ko_distance_pct
+        row[idx['Strike_KI_Distance']] = ki_distance_pct
+        row[idx['KO_KI_Range']] = ko_barrier - ki_barrier
+        row[idx['KI_Strike_Ratio']] = ki_barrier / strike
+        row[idx['KO_Strike_Ratio']] = ko_barrier / strike
+        row[idx['KI_Distance_Pct']] = ki_distance_pct
+        row[idx['KO_Distance_Pct']] = ko_distance_pct
 
         # ==================== Basket特徵 ====================
         basket_size = len(iv_data_list)
-        features['Basket_Size'] = basket_size
-        features['Num_Underlyings'] = basket_size
-        features['Basket_Complexity_Factor'] = basket_size / 3.0
+        row[idx['Basket_Size']] = basket_size
+        row[idx['Num_Underlyings']] = basket_size
+        row[idx['Basket_Complexity_Factor']] = basket_size / 3.0
 
         # ==================== 排序後的IV特徵 (Rank_1, 2, 3) ====================
-        # IV資料已經按PUT_IMP_VOL_3M降冪排序
-
-        iv_cols_mapping = {
-            'PUT_IMP_VOL_3M': 'PUT_IMP_VOL_3M_Rank',
-            'CALL_IMP_VOL_2M_25D': 'CALL_IMP_VOL_2M_25D_Rank',
-            'PUT_IMP_VOL_2M_25D': 'PUT_IMP_VOL_2M_25D_Rank',
-            'HIST_PUT_IMP_VOL': 'HIST_PUT_IMP_VOL_Rank',
-            'VOL_STDDEV': 'VOL_STDDEV_Rank',
-            'VOLATILITY_90D': 'VOLATILITY_90D_Rank',
-            'VOL_PERCENTILE': 'VOL_PERCENTILE_Rank',
-            'CHG_PCT_1YR': 'CHG_PCT_1YR_Rank',
-            'CORR_COEF': 'CORR_COEF_Rank',
-            'DIVIDEND_YIELD': 'DIVIDEND_YIELD_Rank',
-            'PX_LAST': 'PX_LAST_Rank',
-        }
-
-        for orig_col, rank_prefix in iv_cols_mapping.items():
-            for i in range(3):
-                rank_col = f'{rank_prefix}_{i+1}'
+        # IV資料已經按PUT_IMP_VOL_3M降冪排序，缺少的名次維持 NaN
+        for orig_col, rank_cols in _RANK_COLS:
+            for i, rank_col in enumerate(rank_cols):
                 if i < basket_size and iv_data_list[i] is not None:
-                    features[rank_col] = iv_data_list[i].get(orig_col, np.nan)
-                else:
-                    features[rank_col] = np.nan
+                    row[idx[rank_col]] = iv_data_list[i].get(orig_col, np.nan)
 
         # ==================== IV Skew 和 Premium ====================
-        for i in range(3):
-            if i < basket_size and iv_data_list[i] is not None:
-                put_iv = iv_data_list[i].get('PUT_IMP_VOL_2M_25D', np.nan)
-                call_iv = iv_data_list[i].get('CALL_IMP_VOL_2M_25D', np.nan)
-                hist_iv = iv_data_list[i].get('VOLATILITY_90D', np.nan)
-                iv_3m = iv_data_list[i].get('PUT_IMP_VOL_3M', np.nan)
-
-                # IV Skew
-                if pd.notna(put_iv) and pd.notna(call_iv):
-                    features[f'IV_Skew_Rank_{i+1}'] = put_iv - call_iv
-                else:
-                    features[f'IV_Skew_Rank_{i+1}'] = np.nan
-
-                # IV Premium
-                if pd.notna(iv_3m) and pd.notna(hist_iv) and hist_iv != 0:
-                    features[f'IV_Premium_Rank_{i+1}'] = (iv_3m - hist_iv) / hist_iv
-                else:
-                    features[f'IV_Premium_Rank_{i+1}'] = np.nan
-            else:
-                features[f'IV_Skew_Rank_{i+1}'] = np.nan
-                features[f'IV_Premium_Rank_{i+1}'] = np.nan
+        skew_values = []
+        premium_values = []
+        for i in range(min(basket_size, MAX_STOCKS)):
+            if iv_data_list[i] is None:
+                continue
+            put_iv = iv_data_list[i].get('PUT_IMP_VOL_2M_25D', np.nan)
+            call_iv = iv_data_list[i].get('CALL_IMP_VOL_2M_25D', np.nan)
+            hist_iv = iv_data_list[i].get('VOLATILITY_90D', np.nan)
+            iv_3m = iv_data_list[i].get('PUT_IMP_VOL_3M', np.nan)
+
+            # IV Skew
+            if pd.notna(put_iv) and pd.notna(call_iv):
+                skew = put_iv - call_iv
+                row[idx[_SKEW_RANK_COLS[i]]] = skew
+                if pd.notna(skew):
+                    skew_values.append(skew)
+
+            # IV Premium
+            if pd.notna(iv_3m) and pd.notna(hist_iv) and hist_iv != 0:
+                premium = (iv_3m - hist_iv) / hist_iv
+                row[idx[_PREMIUM_RANK_COLS[i]]] = premium
+                if pd.notna(premium):
+                    premium_values.append(premium)
 
         # ==================== Basket聚合特徵 ====================
         # 收集有效的IV值
         iv_values = [d.get('PUT_IMP_VOL_3M') for d in iv_data_list if d and pd.notna(d.get('PUT_IMP_VOL_3M'))]
         hv_values = [d.get('VOLATILITY_90D') for d in iv_data_list if d and pd.notna(d.get('VOLATILITY_90D'))]
         corr_values = [d.get('CORR_COEF') for d in iv_data_list if d and pd.notna(d.get('CORR_COEF'))]
-        skew_values = [features.get(f'IV_Skew_Rank_{i+1}') for i in range(basket_size)
-                       if pd.notna(features.get(f'IV_Skew_Rank_{i+1}'))]
-        premium_values = [features.get(f'IV_Premium_Rank_{i+1}') for i in range(basket_size)
-                          if pd.notna(features.get(f'IV_Premium_Rank_{i+1}'))]
 
         # IV相關聚合
-        features['IV_Spread'] = max(iv_values) - min(iv_values) if len(iv_values) >= 2 else 0
-        features['Basket_IV_Range'] = features['IV_Spread']
+        iv_spread = max(iv_values) - min(iv_values) if len(iv_values) >= 2 else 0
+        row[idx['IV_Spread']] = iv_spread
+        row[idx['Basket_IV_Range']] = iv_spread
 
         # 相關性聚合
-        features['Basket_Avg_Corr'] = np.mean(corr_values) if corr_values else np.nan
-        features['Basket_Min_Corr'] = min(corr_values) if corr_values else np.nan
-        features['Max_Correlation'] = max(corr_values) if corr_values else np.nan
-        features['Min_Correlation'] = min(corr_values) if corr_values else np.nan
+        avg_corr = np.mean(corr_values) if corr_values else np.nan
+        if corr_values:
+            row[idx['Basket_Avg_Corr']] = avg_corr
+            row[idx['Basket_Min_Corr']] = min(corr_values)
+            row[idx['Max_Correlation']] = max(corr_values)
+            row[idx['Min_Correlation']] = min(corr_values)
 
         # Skew聚合
-        features['Basket_Avg_Skew'] = np.mean(skew_values) if skew_values else np.nan
-        features['Basket_Max_Skew'] = max(skew_values) if skew_values else np.nan
+        if skew_values:
+            row[idx['Basket_Avg_Skew']] = np.mean(skew_values)
+            row[idx['Basket_Max_Skew']] = max(skew_values)
 
         # IV Premium聚合
-        features['Basket_Avg_IV_Premium'] = np.mean(premium_values) if premium_values else np.nan
-        features['Basket_Max_IV_Premium'] = max(premium_values) if premium_values else np.nan
+        if premium_values:
+            row[idx['Basket_Avg_IV_Premium']] = np.mean(premium_values)
+            row[idx['Basket_Max_IV_Premium']] = max(premium_values)
 
         # IV/HV比率
         if iv_values and hv_values:
-            features['IV_HV_Ratio'] = np.mean(iv_values) / np.mean(hv_values)
-        else:
-            features['IV_HV_Ratio'] = np.nan
+            row[idx['IV_HV_Ratio']] = np.mean(iv_values) / np.mean(hv_values)
 
         # ==================== 風險評分特徵 ====================
-        # 使用Rank_1 (最高IV)
-        rank_1_iv = features.get('PUT_IMP_VOL_3M_Rank_1', np.nan)
+        # 使用Rank_1 (最高IV)，沒有時風險評分特徵維持 NaN
+        rank_1_iv = iv_data_list[0].get('PUT_IMP_VOL_3M', np.nan) if basket_size and iv_data_list[0] is not None else np.nan
 
         if pd.notna(rank_1_iv):
             # 年化波動因子
-            features['Annualized_Vol_Factor'] = rank_1_iv / 100 * np.sqrt(input_data['tenor'] / 12)
+            vol_factor = rank_1_iv / 100 * np.sqrt(tenor / 12)
+            row[idx['Annualized_Vol_Factor']] = vol_factor
 
             # 標準化KI距離
-            if features['Annualized_Vol_Factor'] > 0:
-                features['KI_Distance_Std'] = features['KI_Distance_Pct'] / 100 / features['Annualized_Vol_Factor']
-                features['KO_Distance_Std'] = features['KO_Distance_Pct'] / 100 / features['Annualized_Vol_Factor']
-                features['KI_Distance_Std_Sorted'] = features['KI_Distance_Std']
-            else:
-                features['KI_Distance_Std'] = np.nan
-                features['KO_Distance_Std'] = np.nan
-                features['KI_Distance_Std_Sorted'] = np.nan
+            if vol_factor > 0:
+                ki_distance_std = ki_distance_pct / 100 / vol_factor
+                row[idx['KI_Distance_Std']] = ki_distance_std
+                row[idx['KO_Distance_Std']] = ko_distance_pct / 100 / vol_factor
+                row[idx['KI_Distance_Std_Sorted']] = ki_distance_std
 
             # 年化波動率
-            features['Annualized_Vol'] = rank_1_iv * np.sqrt(input_data['tenor'] / 12)
+            row[idx['Annualized_Vol']] = rank_1_iv * np.sqrt(tenor / 12)
 
             # 相關性調整IV
-            if pd.notna(features['Basket_Avg_Corr']) and basket_size > 1:
-                features['Corr_Adjusted_IV'] = rank_1_iv * (1 + 0.1 * (basket_size - 1) * (1 - features['Basket_Avg_Corr']))
+            if pd.notna(avg_corr) and basket_size > 1:
+                row[idx['Corr_Adjusted_IV']] = rank_1_iv * (1 + 0.1 * (basket_size - 1) * (1 - avg_corr))
             else:
-                features['Corr_Adjusted_IV'] = rank_1_iv
+                row[idx['Corr_Adjusted_IV']] = rank_1_iv
 
             # KI風險評分
-            features['KI_Risk_Score'] = (rank_1_iv / 43.5) * (input_data['ki_barrier'] / 100)  # 43.5是訓練時的平均IV
+            ki_risk_score = (rank_1_iv / 43.5) * (ki_barrier / 100)  # 43.5是訓練時的平均IV
+            row[idx['KI_Risk_Score']] = ki_risk_score
 
             # Basket風險評分
-            features['Basket_Risk_Score'] = features['KI_Risk_Score'] * (1 + 0.2 * (basket_size - 1))
-            if pd.notna(features['Basket_Avg_Corr']) and basket_size > 1:
-                features['Basket_Risk_Score'] *= (1 + 0.1 * (1 - features['Basket_Avg_Corr']))
+            basket_risk_score = ki_risk_score * (1 + 0.2 * (basket_size - 1))
+            if pd.notna(avg_corr) and basket_size > 1:
+                basket_risk_score *= (1 + 0.1 * (1 - avg_corr))
+            row[idx['Basket_Risk_Score']] = basket_risk_score
 
             # 排序後的風險評分
-            features['Risk_Score_Sorted'] = (rank_1_iv / 52.4) * (input_data['ki_barrier'] / 100) * (1 + 0.2 * (basket_size - 1))
-
-        else:
-            features['Annualized_Vol_Factor'] = np.nan
-            features['KI_Distance_Std'] = np.nan
-            features['KO_Distance_Std'] = np.nan
-            features['KI_Distance_Std_Sorted'] = np.nan
-            features['Annualized_Vol'] = np.nan
-            features['Corr_Adjusted_IV'] = np.nan
-            features['KI_Risk_Score'] = np.nan
-            features['Basket_Risk_Score'] = np.nan
-            features['Risk_Score_Sorted'] = np.nan
+            row[idx['Risk_Score_Sorted']] = (rank_1_iv / 52.4) * (ki_barrier / 100) * (1 + 0.2 * (basket_size - 1))
 
         # 收益潛力
-        features['Return_Potential'] = (input_data['ko_barrier'] / 100) * (input_data['tenor'] / 12)
-
-        # 轉換為DataFrame
-        df = pd.DataFrame([features])
-
-        return df
+        row[idx['Return_Potential']] = (ko_barrier / 100) * (tenor / 12)
 
-    def predict(self, pricing_date, bbg_codes, strike, ko_barrier, ki_barrier,
-                tenor, non_call, cost, barrier_type='AKI'):
-        """
-        預測FCN的Coupon
+        # 最後一格是模型沒有用到的特徵的暫存位置
+        return row[:-1]
 
-        Parameters:
-        -----------
-        pricing_date : str
-            定價日期 (格式: YYYY-MM-DD 或 YYYYMMDD)
-        bbg_codes : list
-            標的股票代碼列表 (1-3個)，例如 ['NVDA US', 'TSLA US', 'AMD US']
-        strike : float
-            履約價 (%)
-        ko_barrier : float
-            敲出障礙價 (%)
-        ki_barrier : float
-            敲入障礙價 (%)
-        tenor : int
-            期限 (月)
-        non_call : int
-            不可贖回期間 (月)
-        cost : float
-            成本 (%)
-        barrier_type : str
-            障礙類型 ('AKI' 或 'EKI')
-
-        Returns:
-        --------
-        dict
-            預測結果，包含 predicted_coupon, features, iv_data 等
-        """
+    def _prepare_features(self, pricing_date, bbg_codes, strike, ko_barrier, ki_barrier,
+                          tenor, non_call, cost, barrier_type):
+        """驗證輸入、查詢並排序IV資料，回傳 (特徵陣列, 排序後的原始位置, 排序後的IV資料)"""
         # 驗證輸入
         if len(bbg_codes) < 1 or len(bbg_codes) > 3:
             raise ValueError("標的數量必須在1-3之間")
@@ -366,12 +513,12 @@ class FCNPredictor:
             raise ValueError("barrier_type 必須是 'AKI' 或 'EKI'")
 
         # 載入IV資料
-        iv_data = self._load_iv_data(pricing_date)
+        iv_rows = self._load_iv_rows(pricing_date)
 
         # 取得各標的的IV資料
         iv_data_list = []
         for bbg in bbg_codes:
-            stock_iv = self._get_stock_iv(iv_data, bbg)
+            stock_iv = self._get_stock_iv(iv_rows, bbg)
             if stock_iv is None:
                 print(f"⚠️ 警告: 找不到 {bbg} 的IV資料")
             iv_data_list.append(stock_iv)
@@ -382,8 +529,7 @@ class FCNPredictor:
         sorted_iv_data = [d for _, d in valid_iv_data]
 
         # 填補到3個（用None）
-        while len(sorted_iv_data) < 3:
-            sorted_iv_data.append(None)
+        sorted_iv_data += [None] * (MAX_STOCKS - len(sorted_iv_data))
 
         # 準備輸入資料
         input_data = {
@@ -396,14 +542,47 @@ class FCNPredictor:
             'barrier_type': barrier_type
         }
 
-        # 計算特徵
-        features_df = self._compute_features(input_data, sorted_iv_data)
+        # 計算特徵 (順序已與 feature_cols 相同)
+        row = self._compute_features(input_data, sorted_iv_data)
+
+        return row, valid_iv_data, sorted_iv_data
+
+    def predict(self, pricing_date, bbg_codes, strike, ko_barrier, ki_barrier,
+                tenor, non_call, cost, barrier_type='AKI'):
+        """
+        預測FCN的Coupon
+
+        Parameters:
+        -----------
+        pricing_date : str
+            定價日期 (格式: YYYY-MM-DD 或 YYYYMMDD)
+        bbg_codes : list
+            標的股票代碼列表 (1-3個)，例如 ['NVDA US', 'TSLA US', 'AMD US']
+        strike : float
+            履約價 (%)
+        ko_barrier : float
+            敲出障礙價 (%)
+        ki_barrier : float
+            敲入障礙價 (%)
+        tenor : int
+            期限 (月)
+        non_call : int
+            不可贖回期間 (月)
+        cost : float
+            成本 (%)
+        barrier_type : str
+            障礙類型 ('AKI' 或 'EKI')
 
-        # 確保特徵順序正確
-        X = features_df.reindex(columns=self.feature_cols)
+        Returns:
+        --------
+        dict
+            預測結果，包含 predicted_coupon, features, iv_data 等
+        """
+        row, valid_iv_data, sorted_iv_data = self._prepare_features(
+            pricing_date, bbg_codes, strike, ko_barrier, ki_barrier, tenor, non_call, cost, barrier_type)
 
         # 預測
-        predicted_coupon = self.model.predict(X)[0]
+        predicted_coupon = self._predict_matrix(row.reshape(1, -1))[0]
 
         # 組織結果
         result = {
@@ -421,7 +600,7 @@ class FCNPredictor:
             },
             'sorted_bbg_codes': [bbg_codes[i] for i, _ in valid_iv_data],
             'sorted_ivs': [d.get('PUT_IMP_VOL_3M') if d else None for d in sorted_iv_data],
-            'features': features_df.to_dict('records')[0]
+            'features': dict(zip(self.feature_cols, row.tolist()))
         }
 
         return result
@@ -440,9 +619,11 @@ class FCNPredictor:
         pd.DataFrame
             加入predicted_coupon欄位的DataFrame
         """
-        predictions = []
+        # 先逐筆填入特徵矩陣，最後只呼叫一次模型預測
+        X = np.empty((len(df_input), len(self.feature_cols)), dtype=np.float64)
+        valid = np.zeros(len(df_input), dtype=bool)
 
-        for idx, row in df_input.iterrows():
+        for pos, (idx, row) in enumerate(df_input.iterrows()):
             try:
                 # 收集BBG codes
                 bbg_codes = []
@@ -451,7 +632,7 @@ class FCNPredictor:
                     if col in row and pd.notna(row[col]):
                         bbg_codes.append(row[col])
 
-                result = self.predict(
+                X[pos], _, _ = self._prepare_features(
                     pricing_date=row['Pricing Date'].strftime('%Y%m%d') if hasattr(row['Pricing Date'], 'strftime') else str(row['Pricing Date']),
                     bbg_codes=bbg_codes,
                     strike=row['Strike (%)'],
@@ -462,10 +643,13 @@ class FCNPredictor:
                     cost=row['Cost (%)'],
                     barrier_type=row['Barrier Type']
                 )
-                predictions.append(result['predicted_coupon'])
+                valid[pos] = True
             except Exception as e:
                 print(f"警告: 第{idx}筆預測失敗: {e}")
-                predictions.append(np.nan)
+
+        predictions = np.full(len(df_input), np.nan)
+        if valid.any():
+            predictions[valid] = self._predict_matrix(X[valid])
 
         df_input['Predicted_Coupon'] = predictions
         return df_input
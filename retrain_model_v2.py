@@ -14,6 +14,9 @@ from sklearn.ensemble import HistGradientBoostingRegressor
 import joblib
 import warnings
 import os
+
+from excel_cache import read_excel_cached
+
 warnings.filterwarnings('ignore')
 
 print("=" * 80)
@@ -28,7 +31,7 @@ print("1. 載入資料")
 print("=" * 80)
 
 # 載入 FCN 資料表
-df_fcn = pd.read_excel('FCN資料表.xlsx')
+df_fcn = read_excel_cached('FCN資料表.xlsx')
 print(f"FCN 資料表: {df_fcn.shape}")
 
 # 檢查新資料
@@ -58,13 +61,12 @@ print(f"找到 {len(iv_files)} 個 IV 資料檔案")
 all_iv_data = {}
 for iv_file in iv_files:
     date_key = iv_file.replace('.xlsx', '')
-    df_iv = pd.read_excel(os.path.join(iv_data_path, iv_file))
+    df_iv = read_excel_cached(os.path.join(iv_data_path, iv_file))
     # 跳過標題行
     df_iv = df_iv.iloc[1:].reset_index(drop=True)
     df_iv = df_iv.rename(columns={'Unnamed: 0': 'BBG_Code'})
     # 清理代碼
-    df_iv['BBG_Code'] = df_iv['BBG_Code'].astype(str).str.replace(' Equity', '', regex=False)
-    df_iv['BBG_Code'] = df_iv['BBG_Code'].str.replace(' US', '', regex=False)
+    df_iv['BBG_Code'] = df_iv['BBG_Code'].astype(str).str.replace(r' Equity| US', '', regex=True)
     all_iv_data[date_key] = df_iv
 
 print(f"已載入 IV 資料日期: {list(all_iv_data.keys())}")
@@ -76,48 +78,28 @@ print("\n" + "=" * 80)
 print("3. 資料合併與前處理")
 print("=" * 80)
 
-# 清理 FCN 資料
-df = df_fcn.copy()
-
-# 移除不需要的欄位
+# 清理 FCN 資料：移除不需要的欄位 (drop 會回傳新的 DataFrame，不需要先複製 df_fcn)
 cols_to_drop = ['Unnamed: 17', 'BBG Code 4', 'BBG Code 5']
-existing_cols_to_drop = [col for col in cols_to_drop if col in df.columns]
-if existing_cols_to_drop:
-    df = df.drop(existing_cols_to_drop, axis=1)
+existing_cols_to_drop = [col for col in cols_to_drop if col in df_fcn.columns]
+df = df_fcn.drop(columns=existing_cols_to_drop)
 
 # 處理 Coupon 欄位
 df['Coupon_Valid'] = (df['Coupon p.a. (%)'] != '-')
-df['Coupon'] = df['Coupon p.a. (%)'].apply(lambda x: float(x) if x != '-' else np.nan)
+df['Coupon'] = pd.to_numeric(df['Coupon p.a. (%)'], errors='coerce')  # '-' 轉為 NaN
 
-# 只保留有效 Coupon
-df = df[df['Coupon_Valid']].copy()
+# 只保留有效 Coupon (布林篩選本身就會產生新的 DataFrame)
+df = df[df['Coupon_Valid']]
 print(f"有效 Coupon 資料: {len(df)} 筆")
 
 # 標的數量
 df['Num_Underlyings'] = (
-    df['BBG Code 1'].notna().astype(int) +
-    df['BBG Code 2'].notna().astype(int) +
-    df['BBG Code 3'].notna().astype(int)
+    df[['BBG Code 1', 'BBG Code 2', 'BBG Code 3']].notna().to_numpy().sum(axis=1, dtype=np.int8)
 )
 
-# 轉換 Pricing Date 格式以便匹配 IV 資料
-def get_date_key(date_val):
-    """將日期轉換為 YYYYMMDD 格式"""
-    try:
-        if pd.isna(date_val):
-            return None
-        if isinstance(date_val, str):
-            # 嘗試不同格式
-            for fmt in ['%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y']:
-                try:
-                    return pd.to_datetime(date_val, format=fmt).strftime('%Y%m%d')
-                except:
-                    continue
-        return pd.to_datetime(date_val).strftime('%Y%m%d')
-    except:
-        return None
-
-df['Date_Key'] = df['Pricing Date'].apply(get_date_key)
+# 轉換 Pricing Date 為 YYYYMMDD 格式以便匹配 IV 資料
+# (整欄一次轉換，字串日期也可解析，無法解析的日期為 NaN)
+pricing_dates = pd.to_datetime(df['Pricing Date'], errors='coerce', format='mixed')
+df['Date_Key'] = pricing_dates.dt.strftime('%Y%m%d')
 
 # 為每個標的合併 IV 資料
 print("\n合併 IV 資料...")
@@ -134,64 +116,60 @@ iv_rename = {
     'DIVIDEND_INDICATED_YIELD': 'DIVIDEND_YIELD'
 }
 
-def get_iv_for_stock(row, stock_col, suffix=''):
-    """取得特定股票的 IV 資料"""
-    date_key = row.get('Date_Key')
-    stock_code = row.get(stock_col)
+# 所有日期的 IV 資料合併成一張表，以 (IV 日期, BBG_Code) 做 left merge
+# 同一日期有重複代碼時取第一筆；無法轉成數字的值視為 NaN
+iv_dates = np.array(sorted(all_iv_data.keys()))
+iv_frames = []
+for d in iv_dates:
+    iv_df = all_iv_data[d]
+    iv_frame = pd.DataFrame({
+        iv_rename.get(col, col): (pd.to_numeric(iv_df[col], errors='coerce').astype(np.float64)
+                                  if col in iv_df.columns else np.nan)
+        for col in iv_columns
+    }, index=iv_df.index)
+    iv_frame.insert(0, 'IV_Date', d)
+    iv_frame.insert(1, 'BBG_Code', iv_df['BBG_Code'].to_numpy())
+    iv_frames.append(iv_frame)
+iv_all = pd.concat(iv_frames, ignore_index=True).drop_duplicates(['IV_Date', 'BBG_Code'], keep='first')
+
+def resolve_iv_date(date_key):
+    """對應的 IV 日期：同一天優先，否則取之前最近的日期，都沒有時取最新日期"""
+    if pd.isna(date_key) or len(iv_dates) == 0:
+        return None
+    idx = np.searchsorted(iv_dates, date_key, side='right') - 1
+    return iv_dates[idx] if idx >= 0 else iv_dates[-1]
 
-    if pd.isna(date_key) or pd.isna(stock_code):
-        return pd.Series({f'{iv_rename.get(col, col)}{suffix}': np.nan for col in iv_columns})
+# 每個 Date_Key 只解析一次
+iv_date = df['Date_Key'].map({k: resolve_iv_date(k) for k in df['Date_Key'].unique()})
 
+def get_iv_for_stock(stock_col, suffix=''):
+    """取得特定標的欄位的 IV 資料 (與 df 相同 index)"""
+    stock_code = df[stock_col]
     # 清理股票代碼
-    stock_code = str(stock_code).replace(' Equity', '').replace(' US', '').strip()
-
-    # 查找 IV 資料
-    iv_df = all_iv_data.get(date_key)
-    if iv_df is None:
-        # 找最近的日期
-        available_dates = sorted(all_iv_data.keys(), reverse=True)
-        for d in available_dates:
-            if d <= date_key:
-                iv_df = all_iv_data[d]
-                break
-        if iv_df is None and available_dates:
-            iv_df = all_iv_data[available_dates[0]]
-
-    if iv_df is None:
-        return pd.Series({f'{iv_rename.get(col, col)}{suffix}': np.nan for col in iv_columns})
-
-    # 查找股票
-    stock_row = iv_df[iv_df['BBG_Code'] == stock_code]
-    if len(stock_row) == 0:
-        return pd.Series({f'{iv_rename.get(col, col)}{suffix}': np.nan for col in iv_columns})
-
-    result = {}
-    for col in iv_columns:
-        new_col = f'{iv_rename.get(col, col)}{suffix}'
-        if col in stock_row.columns:
-            val = stock_row.iloc[0][col]
-            try:
-                result[new_col] = float(val) if pd.notna(val) else np.nan
-            except:
-                result[new_col] = np.nan
-        else:
-            result[new_col] = np.nan
-
-    return pd.Series(result)
+    keys = pd.DataFrame({
+        'IV_Date': iv_date.to_numpy(),
+        'BBG_Code': stock_code.astype(str).str.replace(' Equity', '', regex=False)
+                              .str.replace(' US', '', regex=False).str.strip()
+                              .where(stock_code.notna()).to_numpy(),
+    })
+    merged = keys.merge(iv_all, on=['IV_Date', 'BBG_Code'], how='left')
+    merged = merged.drop(columns=['IV_Date', 'BBG_Code']).add_suffix(suffix)
+    merged.index = df.index
+    return merged
 
 # 合併 BBG Code 1 的 IV
 print("  處理 BBG Code 1...")
-iv_1 = df.apply(lambda row: get_iv_for_stock(row, 'BBG Code 1', ''), axis=1)
+iv_1 = get_iv_for_stock('BBG Code 1', '')
 df = pd.concat([df, iv_1], axis=1)
 
 # 合併 BBG Code 2 的 IV
 print("  處理 BBG Code 2...")
-iv_2 = df.apply(lambda row: get_iv_for_stock(row, 'BBG Code 2', '_2'), axis=1)
+iv_2 = get_iv_for_stock('BBG Code 2', '_2')
 df = pd.concat([df, iv_2], axis=1)
 
 # 合併 BBG Code 3 的 IV
 print("  處理 BBG Code 3...")
-iv_3 = df.apply(lambda row: get_iv_for_stock(row, 'BBG Code 3', '_3'), axis=1)
+iv_3 = get_iv_for_stock('BBG Code 3', '_3')
 df = pd.concat([df, iv_3], axis=1)
 
 print(f"合併後資料形狀: {df.shape}")
@@ -219,6 +197,8 @@ df['KO_Distance_Pct'] = df['KO Barrier (%)'] - df['Strike (%)']
 # 4.3 時間價值特徵
 df['Tenor_Sqrt'] = np.sqrt(df['Tenor (m)'])
 df['Tenor_Squared'] = df['Tenor (m)'] ** 2
+tenor_years = df['Tenor (m)'] / 12  # 年化用，下方多個特徵共用
+sqrt_tenor_years = np.sqrt(tenor_years)
 df['Callable_Period'] = df['Tenor (m)'] - df['Non-call Periods (m)']
 df['Callable_Ratio'] = df['Callable_Period'] / df['Tenor (m)']
 df['NonCall_Ratio'] = df['Non-call Periods (m)'] / df['Tenor (m)']
@@ -229,64 +209,58 @@ df['No_KO_Flag'] = (df['Non-call Periods (m)'] == df['Tenor (m)']).astype(int)
 # 4.5 Basket 特徵
 df['Basket_Size'] = df['Num_Underlyings']
 
-# Worst/Best IV
-df['Basket_Worst_IV'] = df[['PUT_IMP_VOL_3M', 'PUT_IMP_VOL_3M_2', 'PUT_IMP_VOL_3M_3']].max(axis=1, skipna=True)
-df['Basket_Best_IV'] = df[['PUT_IMP_VOL_3M', 'PUT_IMP_VOL_3M_2', 'PUT_IMP_VOL_3M_3']].min(axis=1, skipna=True)
-df['Basket_IV_Range'] = df['Basket_Worst_IV'] - df['Basket_Best_IV']
-
-# 平均 IV
-def safe_mean(row, cols):
-    values = [row[col] for col in cols if col in row.index and pd.notna(row[col])]
-    return np.mean(values) if values else np.nan
-
+# 各組欄位只轉成陣列一次，最大/最小/平均值都由同一個陣列計算 (忽略 NaN，全部缺值時為 NaN)
 iv_3m_cols = ['PUT_IMP_VOL_3M', 'PUT_IMP_VOL_3M_2', 'PUT_IMP_VOL_3M_3']
 hv_90d_cols = ['VOLATILITY_90D', 'VOLATILITY_90D_2', 'VOLATILITY_90D_3']
 corr_cols = ['CORR_COEF', 'CORR_COEF_2', 'CORR_COEF_3']
+iv_mat = df[iv_3m_cols].to_numpy(dtype=np.float64)
+hv_mat = df[hv_90d_cols].to_numpy(dtype=np.float64)
+corr_mat = df[corr_cols].to_numpy(dtype=np.float64)
 
-df['Basket_Avg_IV'] = df.apply(lambda row: safe_mean(row, iv_3m_cols), axis=1)
-df['Basket_Avg_HV'] = df.apply(lambda row: safe_mean(row, hv_90d_cols), axis=1)
-df['Basket_Avg_Corr'] = df.apply(lambda row: safe_mean(row, corr_cols), axis=1)
+# Worst/Best IV 與平均值
+df['Basket_Worst_IV'] = np.nanmax(iv_mat, axis=1)
+df['Basket_Best_IV'] = np.nanmin(iv_mat, axis=1)
+df['Basket_IV_Range'] = df['Basket_Worst_IV'] - df['Basket_Best_IV']
+df['Basket_Avg_IV'] = np.nanmean(iv_mat, axis=1)
+df['Basket_Avg_HV'] = np.nanmean(hv_mat, axis=1)
+df['Basket_Avg_Corr'] = np.nanmean(corr_mat, axis=1)
 
 # 歷史波動率
-df['Basket_Worst_HV'] = df[['VOLATILITY_90D', 'VOLATILITY_90D_2', 'VOLATILITY_90D_3']].max(axis=1, skipna=True)
-df['Basket_Best_HV'] = df[['VOLATILITY_90D', 'VOLATILITY_90D_2', 'VOLATILITY_90D_3']].min(axis=1, skipna=True)
+df['Basket_Worst_HV'] = np.nanmax(hv_mat, axis=1)
+df['Basket_Best_HV'] = np.nanmin(hv_mat, axis=1)
 
 # 相關性
-df['Basket_Min_Corr'] = df[['CORR_COEF', 'CORR_COEF_2', 'CORR_COEF_3']].min(axis=1, skipna=True)
-df['Max_Correlation'] = df[['CORR_COEF', 'CORR_COEF_2', 'CORR_COEF_3']].max(axis=1, skipna=True)
+df['Basket_Min_Corr'] = np.nanmin(corr_mat, axis=1)
+df['Max_Correlation'] = np.nanmax(corr_mat, axis=1)
 df['Min_Correlation'] = df['Basket_Min_Corr']
 
 # Basket 複雜度
 df['Basket_Complexity_Factor'] = df['Basket_Size'] / 3.0
 
 # 相關性調整 IV
-df['Corr_Adjusted_IV'] = df['Basket_Worst_IV'].copy()
-multi_asset_mask = (df['Basket_Size'] > 1) & (df['Basket_Avg_Corr'].notna())
-df.loc[multi_asset_mask, 'Corr_Adjusted_IV'] = (
-    df.loc[multi_asset_mask, 'Basket_Worst_IV'] *
-    (1 + 0.1 * (df.loc[multi_asset_mask, 'Basket_Size'] - 1) *
-     (1 - df.loc[multi_asset_mask, 'Basket_Avg_Corr']))
+multi_asset_mask = ((df['Basket_Size'] > 1) & (df['Basket_Avg_Corr'].notna())).to_numpy()
+df['Corr_Adjusted_IV'] = np.where(
+    multi_asset_mask,
+    df['Basket_Worst_IV'] * (1 + 0.1 * (df['Basket_Size'] - 1) * (1 - df['Basket_Avg_Corr'])),
+    df['Basket_Worst_IV']
 )
 
 # 4.6 IV Skew 和 Premium
-df['IV_Skew_1'] = df['PUT_IMP_VOL_2M_25D'] - df['CALL_IMP_VOL_2M_25D']
-df['IV_Skew_2'] = df['PUT_IMP_VOL_2M_25D_2'] - df['CALL_IMP_VOL_2M_25D_2']
-df['IV_Skew_3'] = df['PUT_IMP_VOL_2M_25D_3'] - df['CALL_IMP_VOL_2M_25D_3']
-
-skew_cols = ['IV_Skew_1', 'IV_Skew_2', 'IV_Skew_3']
-df['Basket_Avg_Skew'] = df.apply(lambda row: safe_mean(row, skew_cols), axis=1)
-df['Basket_Max_Skew'] = df[skew_cols].max(axis=1, skipna=True)
-
-df['IV_Premium_1'] = (df['PUT_IMP_VOL_3M'] - df['VOLATILITY_90D']) / df['VOLATILITY_90D']
-df['IV_Premium_2'] = (df['PUT_IMP_VOL_3M_2'] - df['VOLATILITY_90D_2']) / df['VOLATILITY_90D_2']
-df['IV_Premium_3'] = (df['PUT_IMP_VOL_3M_3'] - df['VOLATILITY_90D_3']) / df['VOLATILITY_90D_3']
-
-premium_cols = ['IV_Premium_1', 'IV_Premium_2', 'IV_Premium_3']
-df['Basket_Avg_IV_Premium'] = df.apply(lambda row: safe_mean(row, premium_cols), axis=1)
-df['Basket_Max_IV_Premium'] = df[premium_cols].max(axis=1, skipna=True)
+# 3 檔一起計算
+suffixes = ['', '_2', '_3']
+skew_mat = (df[[f'PUT_IMP_VOL_2M_25D{s}' for s in suffixes]].to_numpy(dtype=np.float64) -
+            df[[f'CALL_IMP_VOL_2M_25D{s}' for s in suffixes]].to_numpy(dtype=np.float64))
+df[['IV_Skew_1', 'IV_Skew_2', 'IV_Skew_3']] = skew_mat
+df['Basket_Avg_Skew'] = np.nanmean(skew_mat, axis=1)
+df['Basket_Max_Skew'] = np.nanmax(skew_mat, axis=1)
+
+premium_mat = (iv_mat - hv_mat) / hv_mat
+df[['IV_Premium_1', 'IV_Premium_2', 'IV_Premium_3']] = premium_mat
+df['Basket_Avg_IV_Premium'] = np.nanmean(premium_mat, axis=1)
+df['Basket_Max_IV_Premium'] = np.nanmax(premium_mat, axis=1)
 
 # 4.7 標準化距離
-df['Annualized_Vol_Factor'] = df['Basket_Worst_IV'] / 100 * np.sqrt(df['Tenor (m)'] / 12)
+df['Annualized_Vol_Factor'] = df['Basket_Worst_IV'] / 100 * sqrt_tenor_years
 df['KI_Distance_Std'] = df['KI_Distance_Pct'] / 100 / df['Annualized_Vol_Factor']
 df['KO_Distance_Std'] = df['KO_Distance_Pct'] / 100 / df['Annualized_Vol_Factor']
 
@@ -295,40 +269,32 @@ df['IV_HV_Ratio'] = df['Basket_Avg_IV'] / df['Basket_Avg_HV']
 
 # 4.9 風險評分
 df['KI_Risk_Score'] = (df['Basket_Worst_IV'] / df['Basket_Worst_IV'].mean()) * (df['KI Barrier (%)'] / 100)
-df['Return_Potential'] = (df['KO Barrier (%)'] / 100) * (df['Tenor (m)'] / 12)
+df['Return_Potential'] = (df['KO Barrier (%)'] / 100) * tenor_years
 
 df['Basket_Risk_Score'] = (
     (df['Basket_Worst_IV'] / df['Basket_Worst_IV'].mean()) *
     (df['KI Barrier (%)'] / 100) *
     (1 + 0.2 * (df['Basket_Size'] - 1))
 )
-df.loc[multi_asset_mask, 'Basket_Risk_Score'] = (
-    df.loc[multi_asset_mask, 'Basket_Risk_Score'] *
-    (1 + 0.1 * (1 - df.loc[multi_asset_mask, 'Basket_Avg_Corr']))
+df['Basket_Risk_Score'] = np.where(
+    multi_asset_mask,
+    df['Basket_Risk_Score'] * (1 + 0.1 * (1 - df['Basket_Avg_Corr'])),
+    df['Basket_Risk_Score']
 )
 
 # 4.10 Barrier Type 編碼
 df['Barrier_Type_AKI'] = (df['Barrier Type'] == 'AKI').astype(int)
 
 # 4.11 年化波動率
-df['Annualized_Vol'] = df['Basket_Avg_IV'] * np.sqrt(df['Tenor (m)'] / 12)
+df['Annualized_Vol'] = df['Basket_Avg_IV'] * sqrt_tenor_years
 
 # 4.12 IV 排序特徵 (按 PUT_IMP_VOL_3M 降冪排序)
 print("\n建立 IV 排序特徵...")
 
-def get_iv_sort_indices(row):
-    iv_values = [
-        (0, row['PUT_IMP_VOL_3M'] if pd.notna(row.get('PUT_IMP_VOL_3M')) else -np.inf),
-        (1, row.get('PUT_IMP_VOL_3M_2', np.nan) if pd.notna(row.get('PUT_IMP_VOL_3M_2')) else -np.inf),
-        (2, row.get('PUT_IMP_VOL_3M_3', np.nan) if pd.notna(row.get('PUT_IMP_VOL_3M_3')) else -np.inf),
-    ]
-    sorted_indices = sorted(iv_values, key=lambda x: x[1], reverse=True)
-    return [x[0] for x in sorted_indices]
-
-sort_indices = df.apply(get_iv_sort_indices, axis=1)
-df['_sort_idx_0'] = sort_indices.apply(lambda x: x[0])
-df['_sort_idx_1'] = sort_indices.apply(lambda x: x[1])
-df['_sort_idx_2'] = sort_indices.apply(lambda x: x[2])
+# 缺值視為 -inf 排在最後，穩定排序讓同值保持原本順序
+base_iv = df.reindex(columns=['PUT_IMP_VOL_3M', 'PUT_IMP_VOL_3M_2', 'PUT_IMP_VOL_3M_3']).to_numpy(dtype=np.float64)
+base_iv = np.nan_to_num(base_iv, nan=-np.inf, posinf=np.inf, neginf=-np.inf)
+sort_order = np.argsort(-base_iv, axis=1, kind='stable')
 
 # IV 欄位組
 iv_groups = {
@@ -345,16 +311,12 @@ iv_groups = {
     'PX_LAST': ['PX_LAST', 'PX_LAST_2', 'PX_LAST_3'],
 }
 
-for group_name, cols in iv_groups.items():
-    if all(col in df.columns for col in cols[:1]):
-        rank_cols = [f'{group_name}_Rank_{i+1}' for i in range(3)]
-        for i, rank_col in enumerate(rank_cols):
-            def get_sorted_value(row, original_cols=cols, idx_col=f'_sort_idx_{i}'):
-                idx = int(row[idx_col])
-                if idx < len(original_cols) and original_cols[idx] in row.index:
-                    return row[original_cols[idx]]
-                return np.nan
-            df[rank_col] = df.apply(get_sorted_value, axis=1)
+# 所有組的欄位疊成 (筆數, 組數, 3) 陣列，以同一組排序索引一次取出 (缺少的欄位視為 NaN)
+sorted_groups = {name: cols for name, cols in iv_groups.items() if cols[0] in df.columns}
+stacked = np.stack([df.reindex(columns=cols).to_numpy(dtype=np.float64) for cols in sorted_groups.values()], axis=1)
+ranked = np.take_along_axis(stacked, sort_order[:, None, :], axis=2)
+rank_cols = [f'{group_name}_Rank_{i+1}' for group_name in sorted_groups for i in range(3)]
+df[rank_cols] = ranked.reshape(len(df), -1)
 
 # IV Skew 和 Premium 排序版本
 for i in range(3):
@@ -371,7 +333,7 @@ for i in range(3):
 # 排序後的風險特徵
 df['KI_Distance_Std_Sorted'] = (
     (df['Strike (%)'] - df['KI Barrier (%)']) / 100 /
-    (df['PUT_IMP_VOL_3M_Rank_1'] / 100 * np.sqrt(df['Tenor (m)'] / 12))
+    (df['PUT_IMP_VOL_3M_Rank_1'] / 100 * sqrt_tenor_years)
 )
 
 df['Risk_Score_Sorted'] = (
@@ -380,9 +342,6 @@ df['Risk_Score_Sorted'] = (
     (1 + 0.2 * (df['Basket_Size'] - 1))
 )
 
-# 移除輔助欄位
-df = df.drop(['_sort_idx_0', '_sort_idx_1', '_sort_idx_2'], axis=1)
-
 print(f"特徵工程後資料形狀: {df.shape}")
 
 # ============================================================================
@@ -404,12 +363,13 @@ exclude_cols = [
 
 # 獲取所有數值型特徵
 all_numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
-feature_cols = [col for col in all_numeric_cols if col not in exclude_cols]
+exclude_set = set(exclude_cols)
+feature_cols = [col for col in all_numeric_cols if col not in exclude_set]
 
 print(f"總特徵數: {len(feature_cols)}")
 
-X = df[feature_cols].copy()
-y = df[target].copy()
+X = df[feature_cols]
+y = df[target]
 
 # 移除 NaN 目標值
 valid_mask = y.notna()
@@ -492,9 +452,8 @@ if hasattr(model, 'feature_importances_'):
 
     print(f"{'排名':<5} {'特徵名稱':<40} {'重要性':>10}")
     print("-" * 60)
-    for i, row in feature_importance.head(25).iterrows():
-        rank = feature_importance.index.get_loc(i) + 1
-        print(f"{rank:<5} {row['feature']:<40} {row['importance']:>10.4f}")
+    for rank, row in enumerate(feature_importance.head(25).itertuples(index=False), 1):
+        print(f"{rank:<5} {row.feature:<40} {row.importance:>10.4f}")
 
     feature_importance.to_excel('feature_importance_v2.xlsx', index=False)
 
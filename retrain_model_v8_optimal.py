@@ -18,6 +18,9 @@ import joblib
 import json
 import warnings
 import os
+
+from excel_cache import read_excel_cached
+
 warnings.filterwarnings('ignore')
 
 print("=" * 80)
@@ -31,22 +34,24 @@ print("\n" + "=" * 80)
 print("1. 載入資料")
 print("=" * 80)
 
-df_raw = pd.read_excel('FCN資料表.xlsx')
+df_raw = read_excel_cached('FCN資料表.xlsx')
 print(f"原始資料形狀: {df_raw.shape}")
 
 # 轉換日期
 df_raw['Date_Str'] = pd.to_datetime(df_raw['Pricing Date']).dt.strftime('%Y-%m-%d')
 
 # 標記發行商和期間
-df_raw['Issuer'] = df_raw['Date_Str'].apply(lambda x: 'Barclays' if x == '2025-12-12' else 'UBS')
+df_raw['Issuer'] = np.where(df_raw['Date_Str'] == '2025-12-12', 'Barclays', 'UBS')
 
 # 計算 Basket Size (支援 4 檔)
-df_raw['Basket_Size'] = df_raw[['BBG Code 1', 'BBG Code 2', 'BBG Code 3', 'BBG Code 4']].notna().sum(axis=1)
+df_raw['Basket_Size'] = (
+    df_raw[['BBG Code 1', 'BBG Code 2', 'BBG Code 3', 'BBG Code 4']].notna().to_numpy().sum(axis=1, dtype=np.int8)
+)
 
 # 處理 Coupon
-df_raw['Coupon'] = pd.to_numeric(df_raw['Coupon p.a. (%)'], errors='coerce')
-barclays_mask = df_raw['Issuer'] == 'Barclays'
-df_raw.loc[barclays_mask, 'Coupon'] = df_raw.loc[barclays_mask, 'Coupon'] * 100
+coupon = pd.to_numeric(df_raw['Coupon p.a. (%)'], errors='coerce')
+barclays_mask = (df_raw['Issuer'] == 'Barclays').to_numpy()
+df_raw['Coupon'] = np.where(barclays_mask, coupon * 100, coupon)
 
 # 過濾有效資料
 df_raw = df_raw[df_raw['Coupon'].notna() & (df_raw['Coupon'] > 0)]
@@ -55,10 +60,11 @@ df_raw = df_raw[df_raw['Coupon'].notna() & (df_raw['Coupon'] > 0)]
 df_raw['No_KO_Flag'] = (df_raw['Non-call Periods (m)'] == df_raw['Tenor (m)']).astype(int)
 
 # 標記期間
-df_raw['Period'] = df_raw['Date_Str'].apply(lambda x:
-    'Original' if x < '2025-12-01' else
-    'Dec12_Barclays' if x == '2025-12-12' else
-    'Dec16_UBS')
+df_raw['Period'] = np.select(
+    [df_raw['Date_Str'] < '2025-12-01', df_raw['Date_Str'] == '2025-12-12'],
+    ['Original', 'Dec12_Barclays'],
+    default='Dec16_UBS'
+)
 
 print("\n【資料分類統計】")
 summary = df_raw.groupby('Period').agg({
@@ -88,10 +94,10 @@ all_iv_data = {}
 for f in os.listdir(iv_data_path):
     if f.endswith('.xlsx') and not f.startswith('~$'):
         date_key = f.replace('.xlsx', '')
-        df_iv = pd.read_excel(os.path.join(iv_data_path, f))
+        df_iv = read_excel_cached(os.path.join(iv_data_path, f))
         df_iv = df_iv.iloc[1:].reset_index(drop=True)
         df_iv = df_iv.rename(columns={'Unnamed: 0': 'BBG_Code'})
-        df_iv['BBG_Code'] = df_iv['BBG_Code'].astype(str).str.replace(' Equity', '').str.replace(' US', '')
+        df_iv['BBG_Code'] = df_iv['BBG_Code'].astype(str).str.replace(r' Equity| US', '', regex=True)
         all_iv_data[date_key] = df_iv
 
 print(f"已載入 IV 資料日期: {sorted(all_iv_data.keys())}")
@@ -109,62 +115,57 @@ iv_rename = {
     'DIVIDEND_INDICATED_YIELD': 'DIVIDEND_YIELD'
 }
 
-def get_date_key(date_str):
-    """將日期字串轉換為 YYYYMMDD 格式"""
-    try:
-        return date_str.replace('-', '')
-    except:
+# 日期字串轉換為 YYYYMMDD 格式 (與 IV 檔名相同)
+df_ubs['Date_Key'] = df_ubs['Date_Str'].str.replace('-', '', regex=False)
+
+# 所有日期的 IV 資料合併成一張表，以 (IV 日期, BBG_Code) 做 left merge
+# 同一日期有重複代碼時取第一筆；無法轉成數字的值視為 NaN
+iv_dates = np.array(sorted(all_iv_data.keys()))
+iv_frames = []
+for d in iv_dates:
+    iv_df = all_iv_data[d]
+    iv_frame = pd.DataFrame({
+        iv_rename.get(col, col): (pd.to_numeric(iv_df[col], errors='coerce').astype(np.float64)
+                                  if col in iv_df.columns else np.nan)
+        for col in iv_columns
+    }, index=iv_df.index)
+    iv_frame.insert(0, 'IV_Date', d)
+    iv_frame.insert(1, 'BBG_Code', iv_df['BBG_Code'].to_numpy())
+    iv_frames.append(iv_frame)
+iv_all = pd.concat(iv_frames, ignore_index=True).drop_duplicates(['IV_Date', 'BBG_Code'], keep='first')
+
+def resolve_iv_date(date_key):
+    """對應的 IV 日期：同一天優先，否則取之前最近的日期，都沒有時取最新日期"""
+    if pd.isna(date_key) or len(iv_dates) == 0:
         return None
-
-df_ubs['Date_Key'] = df_ubs['Date_Str'].apply(get_date_key)
-
-def get_iv_for_stock(row, stock_col, suffix=''):
-    """取得特定股票的 IV 資料"""
-    date_key = row.get('Date_Key')
-    stock_code = row.get(stock_col)
-
-    if pd.isna(date_key) or pd.isna(stock_code):
-        return pd.Series({f'{iv_rename.get(col, col)}{suffix}': np.nan for col in iv_columns})
-
-    stock_code = str(stock_code).replace(' Equity', '').replace(' US', '').strip()
-
-    iv_df = all_iv_data.get(date_key)
-    if iv_df is None:
-        available_dates = sorted(all_iv_data.keys(), reverse=True)
-        for d in available_dates:
-            if d <= date_key:
-                iv_df = all_iv_data[d]
-                break
-        if iv_df is None and available_dates:
-            iv_df = all_iv_data[available_dates[0]]
-
-    if iv_df is None:
-        return pd.Series({f'{iv_rename.get(col, col)}{suffix}': np.nan for col in iv_columns})
-
-    stock_row = iv_df[iv_df['BBG_Code'] == stock_code]
-    if len(stock_row) == 0:
-        return pd.Series({f'{iv_rename.get(col, col)}{suffix}': np.nan for col in iv_columns})
-
-    result = {}
-    for col in iv_columns:
-        new_col = f'{iv_rename.get(col, col)}{suffix}'
-        if col in stock_row.columns:
-            val = stock_row.iloc[0][col]
-            try:
-                result[new_col] = float(val) if pd.notna(val) else np.nan
-            except:
-                result[new_col] = np.nan
-        else:
-            result[new_col] = np.nan
-
-    return pd.Series(result)
-
-# 合併 IV 資料 (4 檔股票)
+    idx = np.searchsorted(iv_dates, date_key, side='right') - 1
+    return iv_dates[idx] if idx >= 0 else iv_dates[-1]
+
+# 每個 Date_Key 只解析一次
+df_ubs = df_ubs.reset_index(drop=True)
+iv_date = df_ubs['Date_Key'].map({k: resolve_iv_date(k) for k in df_ubs['Date_Key'].unique()})
+
+def get_iv_for_stock(stock_col, suffix=''):
+    """取得特定標的欄位的 IV 資料 (與 df_ubs 相同 index)"""
+    stock_code = df_ubs[stock_col]
+    keys = pd.DataFrame({
+        'IV_Date': iv_date.to_numpy(),
+        'BBG_Code': stock_code.astype(str).str.replace(' Equity', '', regex=False)
+                              .str.replace(' US', '', regex=False).str.strip()
+                              .where(stock_code.notna()).to_numpy(),
+    })
+    merged = keys.merge(iv_all, on=['IV_Date', 'BBG_Code'], how='left')
+    merged = merged.drop(columns=['IV_Date', 'BBG_Code']).add_suffix(suffix)
+    merged.index = df_ubs.index
+    return merged
+
+# 合併 IV 資料 (4 檔股票)，最後一次 concat
 print("\n合併 IV 資料...")
+iv_parts = []
 for i, suffix in [(1, ''), (2, '_2'), (3, '_3'), (4, '_4')]:
     print(f"  處理 BBG Code {i}...")
-    iv_data = df_ubs.apply(lambda row: get_iv_for_stock(row, f'BBG Code {i}', suffix), axis=1)
-    df_ubs = pd.concat([df_ubs.reset_index(drop=True), iv_data], axis=1)
+    iv_parts.append(get_iv_for_stock(f'BBG Code {i}', suffix))
+df_ubs = pd.concat([df_ubs] + iv_parts, axis=1)
 
 print(f"合併後資料形狀: {df_ubs.shape}")
 
@@ -196,6 +197,8 @@ df['KO_Distance_Pct'] = df['KO Barrier (%)'] - df['Strike (%)']
 # 時間價值特徵
 df['Tenor_Sqrt'] = np.sqrt(df['Tenor (m)'])
 df['Tenor_Squared'] = df['Tenor (m)'] ** 2
+tenor_years = df['Tenor (m)'] / 12  # 年化用，下方多個特徵共用
+sqrt_tenor_years = np.sqrt(tenor_years)
 df['Callable_Period'] = df['Tenor (m)'] - df['Non-call Periods (m)']
 df['Callable_Ratio'] = df['Callable_Period'] / df['Tenor (m)']
 df['NonCall_Ratio'] = df['Non-call Periods (m)'] / df['Tenor (m)']
@@ -205,65 +208,52 @@ iv_3m_cols = ['PUT_IMP_VOL_3M', 'PUT_IMP_VOL_3M_2', 'PUT_IMP_VOL_3M_3', 'PUT_IMP
 hv_90d_cols = ['VOLATILITY_90D', 'VOLATILITY_90D_2', 'VOLATILITY_90D_3', 'VOLATILITY_90D_4']
 corr_cols = ['CORR_COEF', 'CORR_COEF_2', 'CORR_COEF_3', 'CORR_COEF_4']
 
-def safe_agg(row, cols, func):
-    values = [row[col] for col in cols if col in row.index and pd.notna(row[col])]
-    if not values:
-        return np.nan
-    if func == 'max':
-        return max(values)
-    elif func == 'min':
-        return min(values)
-    elif func == 'mean':
-        return np.mean(values)
-    elif func == 'range':
-        return max(values) - min(values) if len(values) > 1 else 0
-
-df['Basket_Worst_IV'] = df.apply(lambda row: safe_agg(row, iv_3m_cols, 'max'), axis=1)
-df['Basket_Best_IV'] = df.apply(lambda row: safe_agg(row, iv_3m_cols, 'min'), axis=1)
+# 各組欄位只轉成陣列一次，最大/最小/平均值都由同一個陣列計算 (忽略 NaN，全部缺值時為 NaN)
+iv_mat = df[iv_3m_cols].to_numpy(dtype=np.float64)
+hv_mat = df[hv_90d_cols].to_numpy(dtype=np.float64)
+corr_mat = df[corr_cols].to_numpy(dtype=np.float64)
+
+df['Basket_Worst_IV'] = np.nanmax(iv_mat, axis=1)
+df['Basket_Best_IV'] = np.nanmin(iv_mat, axis=1)
 df['Basket_IV_Range'] = df['Basket_Worst_IV'] - df['Basket_Best_IV']
-df['Basket_Avg_IV'] = df.apply(lambda row: safe_agg(row, iv_3m_cols, 'mean'), axis=1)
-df['Basket_Avg_HV'] = df.apply(lambda row: safe_agg(row, hv_90d_cols, 'mean'), axis=1)
-df['Basket_Avg_Corr'] = df.apply(lambda row: safe_agg(row, corr_cols, 'mean'), axis=1)
-
-df['Basket_Worst_HV'] = df.apply(lambda row: safe_agg(row, hv_90d_cols, 'max'), axis=1)
-df['Basket_Best_HV'] = df.apply(lambda row: safe_agg(row, hv_90d_cols, 'min'), axis=1)
-df['Basket_Min_Corr'] = df.apply(lambda row: safe_agg(row, corr_cols, 'min'), axis=1)
-df['Max_Correlation'] = df.apply(lambda row: safe_agg(row, corr_cols, 'max'), axis=1)
+df['Basket_Avg_IV'] = np.nanmean(iv_mat, axis=1)
+df['Basket_Avg_HV'] = np.nanmean(hv_mat, axis=1)
+df['Basket_Avg_Corr'] = np.nanmean(corr_mat, axis=1)
+
+df['Basket_Worst_HV'] = np.nanmax(hv_mat, axis=1)
+df['Basket_Best_HV'] = np.nanmin(hv_mat, axis=1)
+df['Basket_Min_Corr'] = np.nanmin(corr_mat, axis=1)
+df['Max_Correlation'] = np.nanmax(corr_mat, axis=1)
 df['Min_Correlation'] = df['Basket_Min_Corr']
 
 df['Basket_Complexity_Factor'] = df['Basket_Size'] / 3.0
 
 # 相關性調整 IV
-df['Corr_Adjusted_IV'] = df['Basket_Worst_IV'].copy()
-multi_asset_mask = (df['Basket_Size'] > 1) & (df['Basket_Avg_Corr'].notna())
-df.loc[multi_asset_mask, 'Corr_Adjusted_IV'] = (
-    df.loc[multi_asset_mask, 'Basket_Worst_IV'] *
-    (1 + 0.1 * (df.loc[multi_asset_mask, 'Basket_Size'] - 1) *
-     (1 - df.loc[multi_asset_mask, 'Basket_Avg_Corr']))
+multi_asset_mask = ((df['Basket_Size'] > 1) & (df['Basket_Avg_Corr'].notna())).to_numpy()
+df['Corr_Adjusted_IV'] = np.where(
+    multi_asset_mask,
+    df['Basket_Worst_IV'] * (1 + 0.1 * (df['Basket_Size'] - 1) * (1 - df['Basket_Avg_Corr'])),
+    df['Basket_Worst_IV']
 )
 
 # IV Skew 和 Premium
-for i, suffix in [(1, ''), (2, '_2'), (3, '_3'), (4, '_4')]:
-    put_col = f'PUT_IMP_VOL_2M_25D{suffix}'
-    call_col = f'CALL_IMP_VOL_2M_25D{suffix}'
-    if put_col in df.columns and call_col in df.columns:
-        df[f'IV_Skew_{i}'] = df[put_col] - df[call_col]
+# 4 檔一起計算 (HV 為 0 時 Premium 為 NaN)，欄位依 Skew_1, Premium_1, Skew_2, ... 的順序寫回
+suffixes = ['', '_2', '_3', '_4']
+put_mat = df[[f'PUT_IMP_VOL_2M_25D{s}' for s in suffixes]].to_numpy(dtype=np.float64)
+call_mat = df[[f'CALL_IMP_VOL_2M_25D{s}' for s in suffixes]].to_numpy(dtype=np.float64)
+skew_premium = np.stack([put_mat - call_mat, (iv_mat - hv_mat) / np.where(hv_mat == 0, np.nan, hv_mat)], axis=2)
+df[[f'IV_{name}_{i}' for i in range(1, 5) for name in ('Skew', 'Premium')]] = skew_premium.reshape(len(df), -1)
 
-    iv_col = f'PUT_IMP_VOL_3M{suffix}'
-    hv_col = f'VOLATILITY_90D{suffix}'
-    if iv_col in df.columns and hv_col in df.columns:
-        df[f'IV_Premium_{i}'] = (df[iv_col] - df[hv_col]) / df[hv_col].replace(0, np.nan)
-
-skew_cols = [f'IV_Skew_{i}' for i in range(1, 5) if f'IV_Skew_{i}' in df.columns]
-df['Basket_Avg_Skew'] = df.apply(lambda row: safe_agg(row, skew_cols, 'mean'), axis=1)
-df['Basket_Max_Skew'] = df.apply(lambda row: safe_agg(row, skew_cols, 'max'), axis=1)
+skew_mat = skew_premium[:, :, 0]
+df['Basket_Avg_Skew'] = np.nanmean(skew_mat, axis=1)
+df['Basket_Max_Skew'] = np.nanmax(skew_mat, axis=1)
 
-premium_cols = [f'IV_Premium_{i}' for i in range(1, 5) if f'IV_Premium_{i}' in df.columns]
-df['Basket_Avg_IV_Premium'] = df.apply(lambda row: safe_agg(row, premium_cols, 'mean'), axis=1)
-df['Basket_Max_IV_Premium'] = df.apply(lambda row: safe_agg(row, premium_cols, 'max'), axis=1)
+premium_mat = skew_premium[:, :, 1]
+df['Basket_Avg_IV_Premium'] = np.nanmean(premium_mat, axis=1)
+df['Basket_Max_IV_Premium'] = np.nanmax(premium_mat, axis=1)
 
 # 標準化距離
-df['Annualized_Vol_Factor'] = df['Basket_Worst_IV'] / 100 * np.sqrt(df['Tenor (m)'] / 12)
+df['Annualized_Vol_Factor'] = df['Basket_Worst_IV'] / 100 * sqrt_tenor_years
 df['KI_Distance_Std'] = df['KI_Distance_Pct'] / 100 / df['Annualized_Vol_Factor'].replace(0, np.nan)
 df['KO_Distance_Std'] = df['KO_Distance_Pct'] / 100 / df['Annualized_Vol_Factor'].replace(0, np.nan)
 
@@ -273,42 +263,32 @@ df['IV_HV_Ratio'] = df['Basket_Avg_IV'] / df['Basket_Avg_HV'].replace(0, np.nan)
 # 風險評分
 mean_worst_iv = df['Basket_Worst_IV'].mean()
 df['KI_Risk_Score'] = (df['Basket_Worst_IV'] / mean_worst_iv) * (df['KI Barrier (%)'] / 100)
-df['Return_Potential'] = (df['KO Barrier (%)'] / 100) * (df['Tenor (m)'] / 12)
+df['Return_Potential'] = (df['KO Barrier (%)'] / 100) * tenor_years
 
 df['Basket_Risk_Score'] = (
     (df['Basket_Worst_IV'] / mean_worst_iv) *
     (df['KI Barrier (%)'] / 100) *
     (1 + 0.2 * (df['Basket_Size'] - 1))
 )
-df.loc[multi_asset_mask, 'Basket_Risk_Score'] = (
-    df.loc[multi_asset_mask, 'Basket_Risk_Score'] *
-    (1 + 0.1 * (1 - df.loc[multi_asset_mask, 'Basket_Avg_Corr']))
+df['Basket_Risk_Score'] = np.where(
+    multi_asset_mask,
+    df['Basket_Risk_Score'] * (1 + 0.1 * (1 - df['Basket_Avg_Corr'])),
+    df['Basket_Risk_Score']
 )
 
 # Barrier Type 編碼
 df['Barrier_Type_AKI'] = (df['Barrier Type'] == 'AKI').astype(int)
 
 # 年化波動率
-df['Annualized_Vol'] = df['Basket_Avg_IV'] * np.sqrt(df['Tenor (m)'] / 12)
+df['Annualized_Vol'] = df['Basket_Avg_IV'] * sqrt_tenor_years
 
 # IV 排序特徵 (按 PUT_IMP_VOL_3M 降冪排序) - 支援 4 檔
 print("\n建立 IV 排序特徵...")
 
-def get_iv_sort_indices(row):
-    iv_values = []
-    for i, suffix in [(0, ''), (1, '_2'), (2, '_3'), (3, '_4')]:
-        col = f'PUT_IMP_VOL_3M{suffix}'
-        val = row.get(col, np.nan)
-        if pd.notna(val):
-            iv_values.append((i, val))
-        else:
-            iv_values.append((i, -np.inf))
-    sorted_indices = sorted(iv_values, key=lambda x: x[1], reverse=True)
-    return [x[0] for x in sorted_indices]
-
-sort_indices = df.apply(get_iv_sort_indices, axis=1)
-for i in range(4):
-    df[f'_sort_idx_{i}'] = sort_indices.apply(lambda x: x[i])
+# 缺值視為 -inf 排在最後，穩定排序讓同值保持原本順序
+base_iv = df.reindex(columns=['PUT_IMP_VOL_3M', 'PUT_IMP_VOL_3M_2', 'PUT_IMP_VOL_3M_3', 'PUT_IMP_VOL_3M_4']).to_numpy(dtype=np.float64)
+base_iv = np.nan_to_num(base_iv, nan=-np.inf, posinf=np.inf, neginf=-np.inf)
+sort_order = np.argsort(-base_iv, axis=1, kind='stable')
 
 # IV 欄位組 (4 檔)
 iv_groups = {
@@ -325,18 +305,11 @@ iv_groups = {
     'PX_LAST': ['PX_LAST', 'PX_LAST_2', 'PX_LAST_3', 'PX_LAST_4'],
 }
 
-for group_name, cols in iv_groups.items():
-    for i in range(4):
-        rank_col = f'{group_name}_Rank_{i+1}'
-        idx_col = f'_sort_idx_{i}'
-
-        def get_sorted_value(row, original_cols=cols, idx_col=idx_col):
-            idx = int(row[idx_col])
-            if idx < len(original_cols) and original_cols[idx] in row.index:
-                return row[original_cols[idx]]
-            return np.nan
-
-        df[rank_col] = df.apply(get_sorted_value, axis=1)
+# 所有組的欄位疊成 (筆數, 組數, 4) 陣列，以同一組排序索引一次取出 (缺少的欄位視為 NaN)
+stacked = np.stack([df.reindex(columns=cols).to_numpy(dtype=np.float64) for cols in iv_groups.values()], axis=1)
+ranked = np.take_along_axis(stacked, sort_order[:, None, :], axis=2)
+rank_cols = [f'{group_name}_Rank_{i+1}' for group_name in iv_groups for i in range(4)]
+df[rank_cols] = ranked.reshape(len(df), -1)
 
 # IV Skew 和 Premium 排序版本
 for i in range(4):
@@ -353,7 +326,7 @@ for i in range(4):
 # 排序後的風險特徵
 df['KI_Distance_Std_Sorted'] = (
     (df['Strike (%)'] - df['KI Barrier (%)']) / 100 /
-    (df['PUT_IMP_VOL_3M_Rank_1'] / 100 * np.sqrt(df['Tenor (m)'] / 12))
+    (df['PUT_IMP_VOL_3M_Rank_1'] / 100 * sqrt_tenor_years)
 )
 
 mean_rank1_iv = df['PUT_IMP_VOL_3M_Rank_1'].mean()
@@ -363,10 +336,6 @@ df['Risk_Score_Sorted'] = (
     (1 + 0.2 * (df['Basket_Size'] - 1))
 )
 
-# 移除輔助欄位
-for i in range(4):
-    df = df.drop([f'_sort_idx_{i}'], axis=1, errors='ignore')
-
 # No_KO 交互特徵
 df['No_KO_Tenor_Interaction'] = df['No_KO_Flag'] * df['Tenor (m)']
 df['No_KO_Basket_Interaction'] = df['No_KO_Flag'] * df['Basket_Size']
@@ -395,12 +364,13 @@ exclude_cols = [
 
 # 獲取所有數值型特徵
 all_numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
-feature_cols = [col for col in all_numeric_cols if col not in exclude_cols]
+exclude_set = set(exclude_cols)
+feature_cols = [col for col in all_numeric_cols if col not in exclude_set]
 
 print(f"總特徵數: {len(feature_cols)}")
 
-X = df[feature_cols].copy()
-y = df[target].copy()
+X = df[feature_cols]
+y = df[target]
 
 # 移除 NaN 目標值
 valid_mask = y.notna()
@@ -409,10 +379,14 @@ y = y[valid_mask]
 
 print(f"有效樣本數: {len(y)}")
 
-# 填充 NaN
-X = X.fillna(X.median())
-X = X.replace([np.inf, -np.inf], np.nan)
-X = X.fillna(X.median())
+# 填充 NaN：先以中位數補缺值，inf 改為 NaN 後再以補值後的中位數補一次
+# (整數欄位不會有缺值，只處理浮點欄位)
+float_cols = X.select_dtypes(include=[np.floating]).columns
+X_float = X[float_cols].to_numpy(dtype=np.float64)
+X_float = np.where(np.isnan(X_float), np.nanmedian(X_float, axis=0), X_float)
+inf_mask = np.isinf(X_float)
+X_float = np.where(inf_mask, np.nanmedian(np.where(inf_mask, np.nan, X_float), axis=0), X_float)
+X = X.assign(**dict(zip(float_cols, X_float.T)))
 
 # 分割資料
 X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
@@ -467,6 +441,7 @@ print("6. 各類型樣本表現")
 print("=" * 80)
 
 test_basket_size = X_test['Basket_Size'].values
+residuals_test = y_pred_test - y_test.to_numpy()  # 預測 - 實際，各分組共用
 
 print("\n【按 Basket Size 分析】")
 for bs in [1, 2, 3, 4]:
@@ -474,7 +449,7 @@ for bs in [1, 2, 3, 4]:
     if bs_mask.sum() > 5:
         r2 = r2_score(y_test[bs_mask], y_pred_test[bs_mask])
         mae = mean_absolute_error(y_test[bs_mask], y_pred_test[bs_mask])
-        bias = (y_pred_test[bs_mask] - y_test[bs_mask].values).mean()
+        bias = residuals_test[bs_mask].mean()
         print(f"  {bs}檔股票: n={bs_mask.sum()}, R²={r2:.4f}, MAE={mae:.4f}, Bias={bias:+.4f}")
 
 # 高 IV 分析
@@ -510,11 +485,13 @@ if len(df_barclays) > 0:
             'description': 'No_KO 結構相比正常 KO 的 Coupon 調整值'
         }
 
-        for bs in [1, 2, 3, 4]:
-            no_ko_bs = barclays_no_ko[barclays_no_ko['Basket_Size'] == bs]['Coupon'].mean()
-            normal_bs = barclays_normal[barclays_normal['Basket_Size'] == bs]['Coupon'].mean()
-            if not np.isnan(no_ko_bs) and not np.isnan(normal_bs):
-                adjustment_config['by_basket_size'][str(bs)] = no_ko_bs - normal_bs
+        # 各 Basket Size 的平均 Coupon 差 (兩邊都有資料才記錄)
+        by_basket_size = (
+            barclays_no_ko.groupby('Basket_Size')['Coupon'].mean() -
+            barclays_normal.groupby('Basket_Size')['Coupon'].mean()
+        ).reindex([1, 2, 3, 4]).dropna()
+        for bs, adjustment in by_basket_size.items():
+            adjustment_config['by_basket_size'][str(bs)] = adjustment
 else:
     adjustment_config = {'global_no_ko_adjustment': 0, 'by_basket_size': {}}
 
@@ -533,8 +510,8 @@ if hasattr(model, 'feature_importances_'):
 
     print(f"{'排名':<5} {'特徵名稱':<40} {'重要性':>10}")
     print("-" * 60)
-    for i, (_, row) in enumerate(feature_importance.head(20).iterrows()):
-        print(f"{i+1:<5} {row['feature']:<40} {row['importance']:>10.4f}")
+    for rank, row in enumerate(feature_importance.head(20).itertuples(index=False), 1):
+        print(f"{rank:<5} {row.feature:<40} {row.importance:>10.4f}")
 
 # ============================================================================
 # 9. 儲存模型
@@ -1,11 +1,18 @@
+import os
+import sys
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from sklearn.model_selection import train_test_split, cross_val_score, KFold
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 from sklearn.preprocessing import LabelEncoder
 import warnings
 warnings.filterwarnings('ignore')
 
+# 加上 --verbose 參數時，列出所有使用的特徵 (特徵列表也會存到 model_features.txt)
+VERBOSE = '--verbose' in sys.argv
+
 print("=" * 80)
 print("FCN 報價預測模型訓練")
 print("=" * 80)
@@ -17,8 +24,24 @@ print("\n" + "=" * 80)
 print("1. 載入資料")
 print("=" * 80)
 
-df = pd.read_excel('FCN_features_v3_sorted.xlsx')
-print(f"資料形狀: {df.shape}")
+# 優先讀取 feature_engineering_v3_sorted_iv.py 輸出的 Parquet
+# Parquet 先只讀 schema 取得數值欄位，選完特徵後再只讀取需要的欄位
+DATA_FILE = 'FCN_features_v3_sorted.parquet'
+if os.path.exists(DATA_FILE):
+    parquet_file = pq.ParquetFile(DATA_FILE)
+    all_columns = parquet_file.schema_arrow.names
+    all_numeric_cols = [
+        field.name for field in parquet_file.schema_arrow
+        if pa.types.is_integer(field.type) or pa.types.is_floating(field.type)
+    ]
+    n_rows = parquet_file.metadata.num_rows
+    df = None
+else:
+    df = pd.read_excel('FCN_features_v3_sorted.xlsx')
+    all_columns = df.columns.tolist()
+    all_numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
+    n_rows = len(df)
+print(f"資料形狀: {(n_rows, len(all_columns))}")
 
 # ============================================================================
 # 2. 特徵選擇
@@ -60,13 +83,14 @@ exclude_cols = [
     'Basket_Worst_HV', 'Basket_Best_HV', 'Basket_Avg_HV',
 ]
 
-# 獲取所有數值型特徵
-all_numeric_cols = df.select_dtypes(include=[np.number]).columns.tolist()
+# 過濾出要使用的特徵 (all_numeric_cols 已在載入資料時取得)
+exclude_set = set(exclude_cols)
+feature_cols = [col for col in all_numeric_cols if col not in exclude_set]
 
-# 過濾出要使用的特徵
-feature_cols = [col for col in all_numeric_cols if col not in exclude_cols]
+if df is None:
+    df = pd.read_parquet(DATA_FILE, columns=feature_cols + [target])
 
-print(f"總欄位數: {len(df.columns)}")
+print(f"總欄位數: {len(all_columns)}")
 print(f"排除欄位數: {len(exclude_cols)}")
 print(f"使用特徵數: {len(feature_cols)}")
 
@@ -75,9 +99,10 @@ print("\n【類別變數處理】")
 # Barrier Type 已經有 Barrier_Type_AKI 的編碼
 
 # 顯示最終使用的特徵
-print("\n【使用的特徵列表】")
-for i, col in enumerate(sorted(feature_cols), 1):
-    print(f"  {i:3d}. {col}")
+if VERBOSE:
+    print("\n【使用的特徵列表】")
+    for i, col in enumerate(sorted(feature_cols), 1):
+        print(f"  {i:3d}. {col}")
 
 # ============================================================================
 # 3. 準備訓練資料
@@ -86,8 +111,8 @@ print("\n" + "=" * 80)
 print("3. 準備訓練資料")
 print("=" * 80)
 
-X = df[feature_cols].copy()
-y = df[target].copy()
+X = df[feature_cols]
+y = df[target]
 
 print(f"X shape: {X.shape}")
 print(f"y shape: {y.shape}")
@@ -296,11 +321,10 @@ if hasattr(best_model, 'feature_importances_'):
 
     total_importance = feature_importance['importance'].sum()
     cumulative = 0
-    for i, row in feature_importance.head(25).iterrows():
-        rank = feature_importance.index.get_loc(i) + 1
-        pct = row['importance'] / total_importance * 100
+    for rank, row in enumerate(feature_importance.head(25).itertuples(index=False), 1):
+        pct = row.importance / total_importance * 100
         cumulative += pct
-        print(f"{rank:<5} {row['feature']:<40} {row['importance']:>10.4f} {pct:>9.2f}%")
+        print(f"{rank:<5} {row.feature:<40} {row.importance:>10.4f} {pct:>9.2f}%")
 
     print(f"\nTop 25 特徵累積重要性: {cumulative:.2f}%")
 
@@ -326,17 +350,19 @@ print(f"最大低估:              {errors.max():.4f}")
 
 # 誤差百分位數
 print(f"\n【誤差百分位數】")
-for pct in [5, 25, 50, 75, 95]:
-    print(f"  {pct}%: {np.percentile(errors, pct):.4f}")
+error_pcts = [5, 25, 50, 75, 95]
+for pct, value in zip(error_pcts, np.percentile(errors, error_pcts)):
+    print(f"  {pct}%: {value:.4f}")
 
 # 絕對誤差分佈
 abs_errors = np.abs(errors)
 print(f"\n【絕對誤差分佈】")
 print(f"平均絕對誤差 (MAE): {abs_errors.mean():.4f}")
-print(f"  < 0.5%:  {(abs_errors < 0.5).sum() / len(abs_errors) * 100:.1f}%")
-print(f"  < 1.0%:  {(abs_errors < 1.0).sum() / len(abs_errors) * 100:.1f}%")
-print(f"  < 2.0%:  {(abs_errors < 2.0).sum() / len(abs_errors) * 100:.1f}%")
-print(f"  < 3.0%:  {(abs_errors < 3.0).sum() / len(abs_errors) * 100:.1f}%")
+# 排序一次，以二分搜尋計算小於各門檻的比例
+thresholds = [0.5, 1.0, 2.0, 3.0]
+below_counts = np.searchsorted(np.sort(abs_errors), thresholds, side='left')
+for thr, count in zip(thresholds, below_counts):
+    print(f"  < {thr}%:  {count / len(abs_errors) * 100:.1f}%")
 
 # ============================================================================
 # 9. 儲存模型